@@ -0,0 +1,69 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List
+
+from starlette.exceptions import HTTPException
+
+from config import BATCH_CONCURRENCY
+from models import AudioRequest, BatchItemStatus
+from pipelines import process_call
+from rate_limiter import PRIORITY_BATCH
+
+
+# Shared across batches so concurrent uploads together stay within upstream limits
+batch_executor = ThreadPoolExecutor(
+    max_workers=BATCH_CONCURRENCY, thread_name_prefix="analysis-batch"
+)
+
+
+def process_batch_item(audio: AudioRequest, indexes: List[int], include_analysis: bool):
+    """Analyze one unique call of a batch and describe the outcome"""
+
+    try:
+        processed_analysis, duplicate = process_call(audio, PRIORITY_BATCH)
+    except HTTPException as e:
+        return BatchItemStatus(
+            indexes=indexes,
+            mp3_url=audio.mp3_url,
+            status="FAILED",
+            error_class=str(type(e).__name__),
+            error_description=str(e.detail),
+        )
+    except Exception as e:
+        return BatchItemStatus(
+            indexes=indexes,
+            mp3_url=audio.mp3_url,
+            status="FAILED",
+            error_class=str(type(e).__name__),
+            error_description=str(e),
+        )
+
+    return BatchItemStatus(
+        indexes=indexes,
+        mp3_url=audio.mp3_url,
+        status="DUPLICATE" if duplicate else "SUCCESS",
+        analysis=processed_analysis if include_analysis else None,
+    )
+
+
+def run_batch(audios: List[AudioRequest], include_analysis: bool = False):
+    """Analyze a batch of calls, yielding one NDJSON status line per unique MP3 as it finishes"""
+
+    # Repeated MP3 URLs are analyzed once and reported against every batch index
+    indexes_by_mp3 = {}
+    for index, audio in enumerate(audios):
+        indexes_by_mp3.setdefault(audio.mp3_url, []).append(index)
+
+    futures = [
+        batch_executor.submit(
+            process_batch_item, audios[indexes[0]], indexes, include_analysis
+        )
+        for indexes in indexes_by_mp3.values()
+    ]
+
+    try:
+        for future in as_completed(futures):
+            yield future.result().json(exclude_none=True) + "\n"
+    finally:
+        # Drop work that has not started yet if the client goes away
+        for future in futures:
+            future.cancel()
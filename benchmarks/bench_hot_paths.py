@@ -0,0 +1,202 @@
+"""Micro-benchmarks of the pipeline's CPU hot paths on synthetic and anonymised calls.
+
+Run from the repository root: ``python -m benchmarks.bench_hot_paths``
+
+Every case is timed on each call length and reports ops/sec, the peak memory
+of one call and the memory blocks it allocated and kept (its result). Results
+are compared against a stored baseline when one exists; store one on the
+reference machine with ``--save-baseline``.
+"""
+
+import os
+import gc
+import sys
+import json
+import timeit
+import argparse
+import platform
+import tracemalloc
+
+from benchmarks.deepgram import CALL_LENGTHS, synthetic_response, load_responses
+from benchmarks.legacy import (
+    jq_format_utterances,
+    remove_whitespace_between_brackets,
+    replace_speaker_labels,
+)
+from helper import validate_speaker_count
+from models import DetailedAudioResponse, RatingsObject, SummaryObject, UsageObject
+from models import DiarizedTranscriptObject, CallMetadata
+from token_budget import count_tokens
+from utterances import Transcript
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+LABELS = {"speaker_0": "salesperson: ", "speaker_1": "customer: "}
+
+RATINGS = {
+    "rudeness_or_politeness_metric": 4,
+    "salesperson_company_introduction": 3,
+    "meeting_request": 2,
+    "salesperson_convincing_abilities": 3,
+    "salesperson_understanding_of_customer_requirements": 4,
+    "customer_sentiment_by_the_end_of_call": 3,
+    "customer_eagerness_to_buy": 2,
+    "customer_budget": "80 lakhs",
+    "customer_preferences": "2 BHK near the metro",
+}
+
+SUMMARY = {
+    "title": "Site visit for a 2 BHK in Gurgaon",
+    "discussion_points": "Budget, location and possession timeline.",
+    "customer_queries": "Distance to the metro.",
+    "meeting_request_attempt": "Site visit proposed for Saturday.",
+    "next_action_items": "Share the brochure on WhatsApp.",
+}
+
+USAGE = {"prompt_tokens": 3000, "completion_tokens": 400, "total_tokens": 3400, "cached_tokens": 0}
+
+
+def build_response(transcript: str) -> DetailedAudioResponse:
+    """The model construction prepare_analysis ends with, from the parsed LLM outputs"""
+
+    return DetailedAudioResponse(
+        mp3="https://example.com/call.mp3",
+        sales_lead_info=CallMetadata(lead_id=1, salesperson_name="Rahul"),
+        ratings=RatingsObject(**RATINGS),
+        summary=SummaryObject(**SUMMARY),
+        script=DiarizedTranscriptObject(diarized_transcript=transcript),
+        token_usage=UsageObject(**USAGE),
+    )
+
+
+def cases(response: dict):
+    """(name, zero-argument callable) for every benchmarked hot path on one call"""
+
+    transcript = Transcript.from_deepgram(response)
+    raw = transcript.render()
+    speaker_labels = {0: LABELS["speaker_0"], 1: LABELS["speaker_1"]}
+    labelled = transcript.render(speaker_labels)
+
+    return [
+        ("jq_extraction", lambda: jq_format_utterances(response)),
+        ("native_extraction", lambda: Transcript.from_deepgram(response).render()),
+        ("remove_whitespace_between_brackets", lambda: remove_whitespace_between_brackets(raw)),
+        ("count_tokens", lambda: count_tokens(raw)),
+        ("count_tokens_limited", lambda: count_tokens(raw, limit=4096)),
+        ("validate_speaker_count", lambda: validate_speaker_count(transcript)),
+        ("replace_chain", lambda: replace_speaker_labels(raw, LABELS)),
+        ("render_labels", lambda: transcript.render(speaker_labels)),
+        ("detailed_audio_response", lambda: build_response(labelled)),
+    ]
+
+
+def measure(function, repeat: int) -> dict:
+    timer = timeit.Timer(function)
+    loops, _ = timer.autorange()
+    seconds = min(timer.repeat(repeat=repeat, number=loops)) / loops
+
+    # Memory is measured on a single call, tracing slows the call down too much to time it
+    gc.collect()
+    tracemalloc.start()
+    ignore_tracemalloc = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    before = tracemalloc.take_snapshot().filter_traces(ignore_tracemalloc)
+    tracemalloc.reset_peak()
+    start_bytes, _ = tracemalloc.get_traced_memory()
+
+    result = function()
+
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot().filter_traces(ignore_tracemalloc)
+    tracemalloc.stop()
+    del result
+
+    blocks = sum(
+        stat.count_diff for stat in after.compare_to(before, "lineno") if stat.count_diff > 0
+    )
+
+    return {
+        "ops_per_sec": 1 / seconds,
+        "peak_bytes": max(0, peak_bytes - start_bytes),
+        "allocated_blocks": blocks,
+    }
+
+
+def load_baseline(path: str) -> dict:
+    try:
+        with open(path) as file:
+            return json.load(file)["results"]
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(path: str, results: dict):
+    with open(path, "w") as file:
+        json.dump(
+            {
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "results": results,
+            },
+            file,
+            indent=2,
+            sort_keys=True,
+        )
+
+
+def compare(current: float, baseline: dict, key: str) -> str:
+    if not baseline or not baseline.get(key):
+        return ""
+
+    return f"{(current / baseline[key] - 1) * 100:+7.1f}%"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--responses", help="directory of recorded Deepgram JSON responses, anonymised on load")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repeats, the best is kept")
+    args = parser.parse_args(argv)
+
+    calls = {
+        name: synthetic_response(count, seed)
+        for seed, (name, count) in enumerate(CALL_LENGTHS.items())
+    }
+    if args.responses:
+        calls.update(load_responses(args.responses))
+
+    baseline = {} if args.save_baseline else load_baseline(args.baseline)
+    results = {}
+
+    print(
+        f"{'case':<36}{'call':>10}{'ops/sec':>14}{'peak KiB':>11}{'blocks':>9}"
+        f"{'vs ops/sec':>12}{'vs peak':>10}"
+    )
+
+    for call_name, response in calls.items():
+        for case_name, function in cases(response):
+            if args.filter not in case_name:
+                continue
+
+            key = f"{case_name}/{call_name}"
+            result = results[key] = measure(function, args.repeat)
+            reference = baseline.get(key)
+
+            print(
+                f"{case_name:<36}{call_name:>10}{result['ops_per_sec']:>14,.0f}"
+                f"{result['peak_bytes'] / 1024:>11.1f}{result['allocated_blocks']:>9}"
+                f"{compare(result['ops_per_sec'], reference, 'ops_per_sec'):>12}"
+                f"{compare(result['peak_bytes'], reference, 'peak_bytes'):>10}"
+            )
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"baseline stored in {args.baseline}")
+    elif not baseline:
+        print(f"no baseline at {args.baseline}, run with --save-baseline to store one")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""Compare native utterance extraction against the former jq filter.
+
+Run from the repository root: ``python -m benchmarks.bench_utterances``
+Equivalence with the jq output is covered by tests/test_utterances.py.
+"""
+
+import timeit
+
+from utterances import Transcript
+from benchmarks.deepgram import CALL_LENGTHS, synthetic_response
+from benchmarks.legacy import jq_format_utterances
+
+
+def native_format_utterances(response_json):
+    return Transcript.from_deepgram(response_json).render()
+
+
+def main():
+    for name, count in CALL_LENGTHS.items():
+        response = synthetic_response(count)
+        results = {}
+
+        for label, function in (
+            ("jq", jq_format_utterances),
+            ("native", native_format_utterances),
+        ):
+            timer = timeit.Timer(lambda: function(response))
+            loops, _ = timer.autorange()
+            best = min(timer.repeat(repeat=5, number=loops)) / loops
+            results[label] = best
+
+        print(
+            f"{name:>6} ({count} utterances): jq {results['jq'] * 1e6:9.1f} us, "
+            f"native {results['native'] * 1e6:9.1f} us, "
+            f"{results['jq'] / results['native']:.1f}x faster"
+        )
+
+
+if __name__ == "__main__":
+    main()
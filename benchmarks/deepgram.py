@@ -0,0 +1,104 @@
+"""Synthetic and anonymised Deepgram responses shaped like our sales calls."""
+
+import os
+import json
+import random
+import string
+
+SALESPERSON_LINES = [
+    "Hello sir, this is Rahul calling from Square Yards.",
+    "You had enquired about a 2 BHK in Gurgaon, is this a good time to talk?",
+    "The project is ready to move and the builder is offering a discount this month.",
+    "Can we schedule a site visit this Saturday at 11 am?",
+    "जी सर, मैं आपको व्हाट्सएप पर ब्रोशर भेज देता हूँ।",
+]
+
+CUSTOMER_LINES = [
+    "Yes, tell me.",
+    "My budget is around 80 lakhs, not more than that.",
+    "I prefer something near the metro, Sector 65 or Golf Course Extension.",
+    "Okay, send me the details on WhatsApp.",
+    "हाँ ठीक है, शनिवार को देखते हैं।",
+]
+
+# Number of utterances in short, typical and long site-visit calls
+CALL_LENGTHS = {"short": 20, "medium": 150, "long": 900}
+
+
+def synthetic_response(utterance_count: int, seed: int = 0) -> dict:
+    """A Deepgram pre-recorded response with alternating diarized utterances"""
+
+    rng = random.Random(seed)
+    utterances = []
+    start = 0.0
+
+    for index in range(utterance_count):
+        speaker = index % 2
+        lines = SALESPERSON_LINES if speaker == 0 else CUSTOMER_LINES
+        transcript = " ".join(rng.choice(lines) for _ in range(rng.randint(1, 3)))
+        duration = round(len(transcript) / 15, 2)
+
+        utterances.append(
+            {
+                "start": round(start, 2),
+                "end": round(start + duration, 2),
+                "confidence": round(rng.uniform(0.8, 1.0), 4),
+                "channel": 0,
+                "transcript": transcript,
+                "speaker": speaker,
+                "id": f"utterance-{index}",
+            }
+        )
+        start += duration + 0.3
+
+    return {"metadata": {"duration": start}, "results": {"utterances": utterances}}
+
+
+def anonymise_text(text: str, rng: random.Random) -> str:
+    """Replace every letter and digit while keeping word lengths, punctuation and script"""
+
+    characters = []
+
+    for character in text:
+        if character.isdigit():
+            characters.append(rng.choice(string.digits))
+        elif character.isascii() and character.isalpha():
+            replacement = rng.choice(string.ascii_lowercase)
+            characters.append(replacement.upper() if character.isupper() else replacement)
+        else:
+            # Non-Latin scripts are kept, they tokenize very differently from ASCII
+            characters.append(character)
+
+    return "".join(characters)
+
+
+def anonymise_response(response_json: dict, seed: int = 0) -> dict:
+    """A recorded Deepgram response reduced to what the pipeline reads, with the words scrambled"""
+
+    rng = random.Random(seed)
+    utterances = [
+        {
+            "start": utterance.get("start"),
+            "end": utterance.get("end"),
+            "transcript": anonymise_text(utterance["transcript"], rng),
+            "speaker": utterance["speaker"],
+        }
+        for utterance in response_json["results"]["utterances"]
+    ]
+
+    return {"results": {"utterances": utterances}}
+
+
+def load_responses(directory: str) -> dict:
+    """Anonymised responses from every recorded Deepgram JSON file in a directory, keyed by file name"""
+
+    responses = {}
+
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+
+        with open(os.path.join(directory, name)) as file:
+            responses[name[: -len(".json")]] = anonymise_response(json.load(file))
+
+    return responses
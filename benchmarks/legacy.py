@@ -0,0 +1,48 @@
+"""Reference implementations the pipeline used before they were optimised."""
+
+import re
+
+from jq import jq
+
+
+def remove_whitespace_between_brackets(text):
+    """Remove whitespace between brackets as a precaution"""
+
+    pattern = re.compile(r"\[\s*Speaker:\s*(\d+)\s*\]")
+
+    result = re.sub(pattern, lambda match: f"[Speaker:{match.group(1)}]", text)
+
+    return result
+
+
+def jq_format_utterances(response_json):
+    """The jq filter + regex pass formerly run by get_diarized_output"""
+
+    diarized_output = []
+
+    filter_query = '.results.utterances[] | "[Speaker:\\(.speaker)] \\(.transcript)"'
+    result = jq(filter_query).input(response_json)
+
+    for item in result.all():
+        diarized_output.append(item)
+
+    return remove_whitespace_between_brackets("\n".join(diarized_output))
+
+
+def replace_speaker_labels(raw_diarization, labels):
+    """The str.replace chain formerly used to apply speaker labels"""
+
+    return raw_diarization.replace("[Speaker:0]", labels["speaker_0"]).replace(
+        "[Speaker:1]", labels["speaker_1"]
+    )
+
+
+def strip_speaker_labels(raw_diarization):
+    """The str.replace chain formerly used when the speaker count was invalid"""
+
+    return (
+        raw_diarization.replace("[Speaker:0]", "")
+        .replace("[Speaker:1]", "")
+        .replace("[Speaker:2]", "")
+        .replace("[Speaker:3]", "")
+    )
@@ -0,0 +1,175 @@
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from config import (
+    LLM_CACHE_STAGES,
+    LLM_CACHE_BACKENDS,
+    LLM_CACHE_MAX_ENTRIES,
+    LLM_CACHE_TTL_SECONDS,
+)
+from mongodb import db
+from metrics import CACHE_REQUESTS
+
+
+# Credentials and endpoints do not change the completion, so they stay out of the key
+UNKEYED_REQUEST_FIELDS = ("api_key", "api_base", "api_type")
+
+
+def completion_cache_key(request: dict) -> str:
+    """Stable hash of a chat completion request"""
+
+    keyed_request = {
+        field: value
+        for field, value in request.items()
+        if field not in UNKEYED_REQUEST_FIELDS
+    }
+    serialized = json.dumps(keyed_request, sort_keys=True, separators=(",", ":"))
+
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+class LRUCompletionCache:
+    """In-process completions, least recently used evicted first"""
+
+    name = "memory"
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            completion = self.entries.get(key)
+
+            if completion is not None:
+                self.entries.move_to_end(key)
+
+            return completion
+
+    def set(self, key, completion):
+        with self.lock:
+            self.entries[key] = completion
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class MongoCompletionCache:
+    """Completions shared by every worker in a Mongo collection, expired by a TTL index"""
+
+    name = "mongo"
+
+    def __init__(self, collection, ttl_seconds):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+
+    def ensure_indexes(self):
+        self.collection.create_index(
+            "created_at", expireAfterSeconds=self.ttl_seconds
+        )
+
+    def get(self, key):
+        entry = self.collection.find_one(
+            {
+                "_id": key,
+                "created_at": {
+                    "$gt": datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+                },
+            },
+            {"completion": 1},
+        )
+
+        return entry["completion"] if entry else None
+
+    def set(self, key, completion):
+        self.collection.update_one(
+            {"_id": key},
+            {"$set": {"completion": completion, "created_at": datetime.utcnow()}},
+            upsert=True,
+        )
+
+
+class CompletionCache:
+    """Opt-in per stage cache of deterministic chat completions, with per-stage counters"""
+
+    def __init__(self, tiers, stages):
+        self.tiers = tiers
+        self.stages = set(stages)
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def enabled_for(self, stage: str):
+        return bool(self.tiers) and stage in self.stages
+
+    def count(self, stage, counter):
+        CACHE_REQUESTS.inc(cache="completion", scope=stage, result=counter)
+
+        with self.lock:
+            stage_counters = self.counters.setdefault(
+                stage, {"hits": 0, "misses": 0, "errors": 0}
+            )
+            stage_counters[counter] += 1
+
+    def get(self, stage: str, request: dict):
+        key = completion_cache_key(request)
+
+        for position, tier in enumerate(self.tiers):
+            try:
+                completion = tier.get(key)
+            except Exception:
+                self.count(stage, "errors")
+                continue
+
+            if completion is not None:
+                self.count(stage, "hits")
+
+                for faster_tier in self.tiers[:position]:
+                    self.set_tier(stage, faster_tier, key, completion)
+
+                return completion
+
+        self.count(stage, "misses")
+        return None
+
+    def set(self, stage: str, request: dict, completion):
+        key = completion_cache_key(request)
+        # Round-trip through JSON so every tier stores plain dicts
+        completion = json.loads(json.dumps(completion))
+
+        for tier in self.tiers:
+            self.set_tier(stage, tier, key, completion)
+
+    def set_tier(self, stage, tier, key, completion):
+        try:
+            tier.set(key, completion)
+        except Exception:
+            self.count(stage, "errors")
+
+    def ensure_indexes(self):
+        for tier in self.tiers:
+            if hasattr(tier, "ensure_indexes"):
+                tier.ensure_indexes()
+
+    def stats(self):
+        with self.lock:
+            return {stage: dict(counters) for stage, counters in self.counters.items()}
+
+
+def build_completion_cache():
+    tiers = []
+
+    if "memory" in LLM_CACHE_BACKENDS:
+        tiers.append(LRUCompletionCache(LLM_CACHE_MAX_ENTRIES))
+
+    if "mongo" in LLM_CACHE_BACKENDS:
+        tiers.append(MongoCompletionCache(db["completion_cache"], LLM_CACHE_TTL_SECONDS))
+
+    return CompletionCache(tiers, LLM_CACHE_STAGES)
+
+
+completion_cache = build_completion_cache()
@@ -3,11 +3,69 @@ import os
 
 MONGODB_URI = os.getenv("MONGO_URI")
 
+MONGO_WRITE_CONCERN = os.getenv("MONGO_WRITE_CONCERN", "1")
+MONGO_WRITE_CONCERN = (
+    int(MONGO_WRITE_CONCERN) if MONGO_WRITE_CONCERN.isdigit() else MONGO_WRITE_CONCERN
+)
+MONGO_WRITE_JOURNAL = os.getenv("MONGO_WRITE_JOURNAL", "false").lower() == "true"
+# Stages whose outputs are written as soon as they finish, the rest go out with the final logs
+MONGO_CHECKPOINT_STAGES = [
+    stage.strip()
+    for stage in os.getenv("MONGO_CHECKPOINT_STAGES", "transcript").split(",")
+    if stage.strip()
+]
+
+# Connection pool and timeouts of every MongoClient, blocking and async alike
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+# Pooled connections idle longer than this are closed, 0 keeps them open
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "0")) or None
+# How long an operation may wait for a free pooled connection before failing
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000")
+)
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+MONGO_READ_CONCERN = os.getenv("MONGO_READ_CONCERN", "local")
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+
 CALL_ANALYSIS_API_KEY = os.getenv("CALL_ANALYSIS_API_KEY")
 
 DEEPGRAM_API_BASE = os.getenv("DEEPGRAM_API_BASE")
 DEEPGRAM_TOKEN = os.getenv("DEEPGRAM_API_KEY")
 
+AUDIO_MAX_BYTES = int(os.getenv("AUDIO_MAX_BYTES", str(200 * 1024 * 1024)))
+AUDIO_CHUNK_BYTES = int(os.getenv("AUDIO_CHUNK_BYTES", str(64 * 1024)))
+# Buffer and fingerprint audio before the Deepgram upload so identical recordings are reused
+AUDIO_DEDUPLICATION = os.getenv("AUDIO_DEDUPLICATION", "true").lower() == "true"
+AUDIO_SPOOL_MEMORY_BYTES = int(
+    os.getenv("AUDIO_SPOOL_MEMORY_BYTES", str(8 * 1024 * 1024))
+)
+
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "8"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))
+HTTP_POOL_BLOCK = os.getenv("HTTP_POOL_BLOCK", "false").lower() == "true"
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "300"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.5"))
+
+TRANSCRIPT_CACHE_BACKENDS = [
+    backend.strip()
+    for backend in os.getenv("TRANSCRIPT_CACHE_BACKENDS", "disk,mongo").split(",")
+    if backend.strip()
+]
+TRANSCRIPT_CACHE_DIR = os.getenv(
+    "TRANSCRIPT_CACHE_DIR", "/tmp/echosensai/transcript_cache"
+)
+TRANSCRIPT_CACHE_MAX_BYTES = int(
+    os.getenv("TRANSCRIPT_CACHE_MAX_BYTES", str(512 * 1024 * 1024))
+)
+TRANSCRIPT_CACHE_TTL_SECONDS = int(
+    os.getenv("TRANSCRIPT_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60))
+)
+
 AZURE_OPENAI_PARAMS_4K = {
     "engine": os.getenv("AZURE_DEPLOYMENT_NAME_4K"),
     "api_key": os.getenv("AZURE_OPENAI_API_KEY"),
@@ -24,6 +82,113 @@ AZURE_OPENAI_PARAMS_16K = {
     "api_version": os.getenv("AZURE_OPENAI_API_VERSION"),
 }
 
-TOKENS_FACTOR_OF_SAFTEY = 3000
+AZURE_OPENAI_PARAMS_BY_MODEL = {
+    "4k": AZURE_OPENAI_PARAMS_4K,
+    "16k": AZURE_OPENAI_PARAMS_16K,
+}
+
+MODEL_CONTEXT_WINDOWS = {
+    "4k": 4096,
+    "16k": 16384,
+}
+
+EXPECTED_COMPLETION_TOKENS = {
+    "labels": 32,
+    "summary": 768,
+    "summary_reduce": 768,
+    "ratings": 256,
+    "fused": 1024,
+}
+
+# Speaker roles are labelled locally at or above this confidence, the LLM is asked otherwise
+LOCAL_LABEL_CONFIDENCE_THRESHOLD = float(
+    os.getenv("LOCAL_LABEL_CONFIDENCE_THRESHOLD", "0.9")
+)
+LOCAL_LABEL_UTTERANCES = int(os.getenv("LOCAL_LABEL_UTTERANCES", "10"))
+# Utterances sent to the labelling LLM call, 0 sends the whole transcript
+LABEL_PREFIX_UTTERANCES = int(os.getenv("LABEL_PREFIX_UTTERANCES", "40"))
+
+# Transcript tokens per chunk when a call is too long for the largest context
+CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", "8000"))
+
+# "staged" sends one request per LLM stage, "fused" asks for all of them at once
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "staged")
+
+PIPELINE_CONCURRENT_STAGES = (
+    os.getenv("PIPELINE_CONCURRENT_STAGES", "true").lower() == "true"
+)
+PIPELINE_STAGE_WORKERS = int(os.getenv("PIPELINE_STAGE_WORKERS", "8"))
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "64"))
+# A queued job holds a lease this long, so one lost in a restart is taken over by the next duplicate
+JOB_QUEUED_LEASE_SECONDS = float(os.getenv("JOB_QUEUED_LEASE_SECONDS", "600"))
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "5000"))
+
+# Stages (labels, summary, ratings) whose completions may be served from the cache
+LLM_CACHE_STAGES = [
+    stage.strip()
+    for stage in os.getenv("LLM_CACHE_STAGES", "").split(",")
+    if stage.strip()
+]
+LLM_CACHE_BACKENDS = [
+    backend.strip()
+    for backend in os.getenv("LLM_CACHE_BACKENDS", "memory,mongo").split(",")
+    if backend.strip()
+]
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_TTL_SECONDS = int(
+    os.getenv("LLM_CACHE_TTL_SECONDS", str(30 * 24 * 60 * 60))
+)
+
+# Azure OpenAI quota of each deployment, shared by every worker through the bucket store
+AZURE_OPENAI_RPM_LIMIT = int(os.getenv("AZURE_OPENAI_RPM_LIMIT", "300"))
+AZURE_OPENAI_TPM_LIMIT = int(os.getenv("AZURE_OPENAI_TPM_LIMIT", "120000"))
+AZURE_OPENAI_MAX_CONCURRENCY = int(os.getenv("AZURE_OPENAI_MAX_CONCURRENCY", "16"))
+# "sqlite" shares the token buckets between the workers of a host, "memory" keeps them per process
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "sqlite")
+RATE_LIMIT_STORE_PATH = os.getenv(
+    "RATE_LIMIT_STORE_PATH", "/tmp/echosensai/rate_limits.sqlite3"
+)
+# Retries of a call answered with a 429, and the pause before the next admission
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", "2"))
+RATE_LIMIT_COOLDOWN_SECONDS = float(os.getenv("RATE_LIMIT_COOLDOWN_SECONDS", "2"))
+
+# Time budget of an analysis, every outbound call's timeout is derived from what is left
+ANALYSIS_DEADLINE_SECONDS = float(os.getenv("ANALYSIS_DEADLINE_SECONDS", "300"))
+JOB_DEADLINE_SECONDS = float(os.getenv("JOB_DEADLINE_SECONDS", "1800"))
+OPENAI_REQUEST_TIMEOUT = float(os.getenv("OPENAI_REQUEST_TIMEOUT", "120"))
+
+# Consecutive failures that open an upstream's circuit, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+# Hedged MP3 downloads: a second request is sent once the first is slower than this latency quantile
+HEDGE_AUDIO_DOWNLOADS = os.getenv("HEDGE_AUDIO_DOWNLOADS", "false").lower() == "true"
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "1"))
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Records beyond this many waiting to be written are dropped rather than blocking a request
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Serialised size of the finished analyses kept in memory per worker, in front of the Mongo lookup
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# A running analysis holds a lease until its deadline plus this grace, then a duplicate may take it over
+RESULT_LEASE_GRACE_SECONDS = float(os.getenv("RESULT_LEASE_GRACE_SECONDS", "30"))
+# How often a duplicate polls for the result of an analysis running in another worker
+RESULT_POLL_SECONDS = float(os.getenv("RESULT_POLL_SECONDS", "1"))
+
+# Deferred first-use costs are paid at startup: "background" while serving, "blocking" before it, or "off"
+# Index creation is one of them, with "off" run main.create_indexes() as a deploy step instead
+STARTUP_WARM_UP = os.getenv("STARTUP_WARM_UP", "background").lower()
+
 TIKTOKEN_MODEL_NAME = "gpt-3.5-turbo"
+# Local copy of the cl100k_base ranks, fetched at build time so tiktoken never downloads them
+TIKTOKEN_ENCODING_FILE = os.getenv(
+    "TIKTOKEN_ENCODING_FILE",
+    os.path.join(os.path.dirname(__file__), "encodings", "cl100k_base.tiktoken"),
+)
 SEED = 123
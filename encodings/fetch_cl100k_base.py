@@ -0,0 +1,40 @@
+"""Download the cl100k_base BPE ranks next to this script, where token_budget loads them from.
+
+Run at build time: ``python encodings/fetch_cl100k_base.py``
+"""
+
+import os
+import sys
+import hashlib
+
+import requests
+
+
+URL = "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+# The hash tiktoken itself checks the file against
+SHA256 = "223921b76ee99bde995b7ff738513eef100fb51d18c93597a113bcffe865b2a7"
+PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cl100k_base.tiktoken")
+
+
+def main():
+    if os.path.exists(PATH):
+        with open(PATH, "rb") as file:
+            if hashlib.sha256(file.read()).hexdigest() == SHA256:
+                print(f"{PATH} is up to date")
+                return
+
+    response = requests.get(URL, timeout=60)
+    response.raise_for_status()
+
+    if hashlib.sha256(response.content).hexdigest() != SHA256:
+        sys.exit(f"{URL} does not match the expected hash, not saving it")
+
+    with open(PATH + ".tmp", "wb") as file:
+        file.write(response.content)
+    os.replace(PATH + ".tmp", PATH)
+
+    print(f"Saved {len(response.content)} bytes to {PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,12 @@ from enum import Enum
 
 class HttpStatusCode(Enum):
     OK: int = 200
+    ACCEPTED: int = 202
     BAD_REQUEST: int = 400
     UNAUTHORIZED: int = 401
     NOT_FOUND: int = 404
+    CONFLICT: int = 409
+    PAYLOAD_TOO_LARGE: int = 413
     INTERNAL_SERVER_ERROR: int = 500
+    SERVICE_UNAVAILABLE: int = 503
+    GATEWAY_TIMEOUT: int = 504
@@ -4,3 +4,11 @@ class InvalidSpeakerCountException(Exception):
     def __init__(self, message="Invalid number of speakers detected!"):
         self.message = message
         super().__init__(self.message)
+
+
+class MissingEncodingException(Exception):
+    """Custom Exception for a missing bundled tiktoken encoding"""
+
+    def __init__(self, message="The bundled tiktoken encoding is missing!"):
+        self.message = message
+        super().__init__(self.message)
@@ -68,6 +68,8 @@ EVALUATE_PARAMETERS = {
 }
 
 
+SPEAKER_ROLES = {"salesperson: ", "customer: "}
+
 LABEL_SPEAKERS = {
     "name": "speaker_classifier",
     "description": "Identifies between salesperson and customer",
@@ -124,3 +126,18 @@ SUMMARIZE_CALL = {
         ]
     },
 }
+
+
+ANALYZE_CALL = {
+    "name": "fused_call_analysis",
+    "description": "Identifies the speakers, summarizes the conversation and shows a detailed analysis of the call.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "speaker_labels": LABEL_SPEAKERS["parameters"],
+            "summary": SUMMARIZE_CALL["parameters"],
+            "ratings": EVALUATE_PARAMETERS["parameters"],
+        },
+        "required": ["speaker_labels", "summary", "ratings"],
+    },
+}
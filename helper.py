@@ -1,39 +1,334 @@
 import json
-import validators
+import time
+import hashlib
 import requests
-import re
-from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from urllib.parse import urlsplit
 
-import openai
-import tiktoken
-from typing import Union
-from jq import jq
 from fastapi import HTTPException
 
-from config import SEED, TIKTOKEN_MODEL_NAME
+from config import (
+    SEED,
+    AUDIO_MAX_BYTES,
+    AUDIO_CHUNK_BYTES,
+    AUDIO_SPOOL_MEMORY_BYTES,
+    RATE_LIMIT_RETRIES,
+    OPENAI_REQUEST_TIMEOUT,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    HEDGE_AUDIO_DOWNLOADS,
+)
+from completion_cache import completion_cache
+from http_client import get_session
+from rate_limiter import get_scheduler
+from resilience import NO_DEADLINE, get_upstream
+from logs import get_logger
+from startup import Lazy, lazy_import, warm_up_hook
+from metrics import (
+    AUDIO_BYTES,
+    AUDIO_DOWNLOAD_SECONDS,
+    DEEPGRAM_SECONDS,
+    LLM_STAGE_SECONDS,
+    LLM_TOKENS,
+)
+from token_budget import estimate_request_tokens
 from prompts import *
+from utterances import Transcript
 from exceptions import InvalidSpeakerCountException
 from enums import HttpStatusCode
 
 
-def count_tokens(string):
-    encoding = tiktoken.encoding_for_model(TIKTOKEN_MODEL_NAME)
+logger = get_logger("helper")
 
-    return len(encoding.encode(string))
+# Imported on first use, importing openai alone takes a quarter of a second
+openai = lazy_import("openai")
+# Read off the resolved parent, importing the submodule on its own can deadlock with the parent's import
+openai_error = Lazy(lambda: openai.resolve().error, "import openai.error")
+validators = lazy_import("validators")
 
 
-def remove_whitespace_between_brackets(text):
-    """Remove whitespace between brackets as a precaution"""
+@warm_up_hook
+def import_clients():
+    """Import the modules the first analysis needs"""
 
-    pattern = re.compile(r"\[\s*Speaker:\s*(\d+)\s*\]")
+    openai.resolve()
+    openai_error.resolve()
+    validators.resolve()
 
-    result = re.sub(pattern, lambda match: f"[Speaker:{match.group(1)}]", text)
 
-    return result
+def http_upstream_failed(timeout):
+    """Tells whether an HTTP call made with the (connect, read) `timeout` failed because of the upstream rather than the request
 
+    A timeout the deadline cut short below its cap says nothing about the upstream's health.
+    """
 
-def convert_url(url: str) -> Union[BytesIO, HTTPException]:
-    """Convert an MP3 URL of a string object into BytesIO object"""
+    connect_timeout, read_timeout = timeout
+
+    def failed(response, error) -> bool:
+        if isinstance(error, requests.ConnectTimeout):
+            return connect_timeout >= HTTP_CONNECT_TIMEOUT
+
+        if isinstance(error, requests.Timeout):
+            return read_timeout >= HTTP_READ_TIMEOUT
+
+        if error is not None:
+            return isinstance(error, requests.RequestException)
+
+        return response.status_code >= HttpStatusCode.INTERNAL_SERVER_ERROR.value
+
+    return failed
+
+
+def openai_upstream_failed(request_timeout: float):
+    """Tells whether a completion made with `request_timeout` failed because the deployment itself is unhealthy"""
+
+    def failed(completion, error) -> bool:
+        if isinstance(error, openai_error.Timeout):
+            # Near the deadline calls time out on purpose, only a full-length timeout counts
+            return request_timeout >= OPENAI_REQUEST_TIMEOUT
+
+        return isinstance(
+            error,
+            (
+                openai_error.APIError,
+                openai_error.ServiceUnavailableError,
+                openai_error.APIConnectionError,
+            ),
+        )
+
+    return failed
+
+
+def merge_usage(*usages):
+    """Add up the token usage of several completions"""
+
+    usage = {
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "total_tokens": 0,
+        "cached_tokens": 0,
+    }
+
+    for stage_usage in usages:
+        for key in usage:
+            usage[key] += stage_usage.get(key, 0)
+
+    return usage
+
+
+def record_completion(stage: str, source: str, started: float, usage: dict):
+    """Time and token accounting of one LLM stage call"""
+
+    duration = time.perf_counter() - started
+    LLM_STAGE_SECONDS.observe(duration, stage=stage, source=source)
+
+    for kind in ("prompt", "completion", "cached"):
+        if usage[f"{kind}_tokens"]:
+            LLM_TOKENS.inc(usage[f"{kind}_tokens"], stage=stage, kind=kind)
+
+    logger.info(
+        "LLM stage finished",
+        extra={
+            "fields": {
+                "stage": stage,
+                "source": source,
+                "duration_ms": round(duration * 1000, 1),
+                **usage,
+            }
+        },
+    )
+
+
+def create_chat_completion(
+    stage: str, deadline=NO_DEADLINE, transcript_tokens: int = None, **request
+):
+    """Create a chat completion, served from the completion cache when the stage opted in
+
+    `transcript_tokens`, the already counted size of the transcript in the request, spares
+    the scheduler from encoding the request again.
+    """
+
+    started = time.perf_counter()
+    cacheable = completion_cache.enabled_for(stage)
+
+    if cacheable:
+        completion = completion_cache.get(stage, request)
+
+        if completion is not None:
+            # Nothing was billed, the tokens the cache saved are reported on their own
+            usage = {
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "total_tokens": 0,
+                "cached_tokens": completion["usage"]["total_tokens"],
+            }
+            record_completion(stage, "cache", started, usage)
+            return completion, usage
+
+    completion = schedule_chat_completion(stage, request, deadline, transcript_tokens)
+
+    if cacheable:
+        try:
+            json.loads(completion["choices"][0]["message"]["function_call"]["arguments"])
+        except Exception:
+            pass
+        else:
+            completion_cache.set(stage, request, completion)
+
+    usage = {
+        "prompt_tokens": completion["usage"]["prompt_tokens"],
+        "completion_tokens": completion["usage"]["completion_tokens"],
+        "total_tokens": completion["usage"]["total_tokens"],
+        "cached_tokens": 0,
+    }
+    record_completion(stage, "azure", started, usage)
+
+    return completion, usage
+
+
+def retry_after_seconds(error):
+    try:
+        return float(error.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def schedule_chat_completion(
+    stage: str, request: dict, deadline=NO_DEADLINE, transcript_tokens: int = None
+):
+    """Send a chat completion once the deployment's rate limits admit it, retrying 429s"""
+
+    scheduler = get_scheduler(request.get("engine"))
+    upstream = get_upstream(f"openai:{request.get('engine')}")
+    estimated_tokens = estimate_request_tokens(stage, request, transcript_tokens)
+
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        scheduler.acquire(estimated_tokens, deadline)
+
+        try:
+            request_timeout = deadline.timeout(
+                f"the {stage} completion", OPENAI_REQUEST_TIMEOUT
+            )
+            completion = upstream.call(
+                lambda: openai.ChatCompletion.create(
+                    **request, request_timeout=request_timeout
+                ),
+                unhealthy=openai_upstream_failed(request_timeout),
+            )
+        except openai_error.RateLimitError as error:
+            scheduler.release(rate_limited=True, retry_after=retry_after_seconds(error))
+            # A throttled request is not billed, hand its tokens back
+            scheduler.settle(estimated_tokens, 0)
+
+            if attempt == RATE_LIMIT_RETRIES:
+                raise
+
+            logger.warning(
+                "Rate limited, retrying",
+                extra={
+                    "fields": {
+                        "stage": stage,
+                        "attempt": attempt + 1,
+                        "retries": RATE_LIMIT_RETRIES,
+                    }
+                },
+            )
+            continue
+        except Exception:
+            scheduler.release()
+            raise
+
+        scheduler.release()
+        scheduler.settle(estimated_tokens, completion["usage"]["total_tokens"])
+
+        return completion
+
+
+class AudioStream:
+    """Chunked view over an MP3 download that enforces the maximum audio size and fingerprints the bytes"""
+
+    def __init__(
+        self, response, content_length=None, deadline=NO_DEADLINE, started=None
+    ):
+        self.response = response
+        self.content_length = content_length
+        self.deadline = deadline
+        self.started = time.perf_counter() if started is None else started
+        self.bytes_read = 0
+        self.buffer = None
+        self.digest = hashlib.sha256()
+        self.fingerprint = None
+
+    def __iter__(self):
+        if self.buffer is not None:
+            self.buffer.seek(0)
+            yield from iter(lambda: self.buffer.read(AUDIO_CHUNK_BYTES), b"")
+            return
+
+        for chunk in self.response.iter_content(chunk_size=AUDIO_CHUNK_BYTES):
+            self.deadline.check("the MP3 download finished")
+            self.bytes_read += len(chunk)
+            AUDIO_BYTES.inc(len(chunk))
+
+            if self.bytes_read > AUDIO_MAX_BYTES:
+                self.close()
+                raise HTTPException(
+                    status_code=HttpStatusCode.PAYLOAD_TOO_LARGE.value,
+                    detail=f"The MP3 file exceeds the maximum size of {AUDIO_MAX_BYTES} bytes!",
+                )
+
+            self.digest.update(chunk)
+            yield chunk
+
+        self.fingerprint = self.digest.hexdigest()
+
+        duration = time.perf_counter() - self.started
+        AUDIO_DOWNLOAD_SECONDS.observe(duration)
+        logger.info(
+            "MP3 downloaded",
+            extra={
+                "fields": {
+                    "bytes": self.bytes_read,
+                    "duration_ms": round(duration * 1000, 1),
+                }
+            },
+        )
+
+    def __len__(self):
+        # Lets requests send a Content-Length instead of a chunked upload
+        return self.content_length
+
+    def spool(self):
+        """Buffer the audio in a temp file that only spills to disk when it is large"""
+
+        if self.buffer is not None:
+            return self
+
+        buffer = SpooledTemporaryFile(max_size=AUDIO_SPOOL_MEMORY_BYTES)
+
+        try:
+            for chunk in self:
+                buffer.write(chunk)
+        except Exception:
+            buffer.close()
+            raise
+        finally:
+            self.response.close()
+
+        self.buffer = buffer
+        self.content_length = self.bytes_read
+
+        return self
+
+    def close(self):
+        self.response.close()
+
+        if self.buffer is not None:
+            self.buffer.close()
+
+
+def convert_url(url: str, deadline=NO_DEADLINE) -> AudioStream:
+    """Open an MP3 URL as a size-limited stream that can be piped into an upload"""
 
     if not validators.url(url):
         raise HTTPException(
@@ -41,20 +336,51 @@ def convert_url(url: str) -> Union[BytesIO, HTTPException]:
             detail="The server cannot process your request because the provided URL syntax is invalid or malformed!",
         )
 
+    started = time.perf_counter()
+
+    # Hosts fail independently, each gets its own circuit breaker
+    upstream = get_upstream(f"audio:{urlsplit(url).netloc}")
+    timeout = deadline.requests_timeout("downloading the MP3")
+
     try:
-        response = requests.get(url)
+        response = upstream.call(
+            lambda: get_session("audio").get(
+                url,
+                stream=True,
+                headers={"Accept-Encoding": "identity"},
+                timeout=timeout,
+            ),
+            deadline,
+            hedge=HEDGE_AUDIO_DOWNLOADS,
+            unhealthy=http_upstream_failed(timeout),
+            discard=lambda response: response.close(),
+        )
 
         if response.status_code == HttpStatusCode.OK.value:
-            mp3_content = response.content
-            buffer = BytesIO(mp3_content)
-            buffer.name = "temp.mp3"
-            return buffer
+            content_length = response.headers.get("Content-Length")
+
+            if content_length is None or not content_length.isdigit():
+                # Without a known size the upload needs a seekable body
+                return AudioStream(response, deadline=deadline, started=started).spool()
+
+            content_length = int(content_length)
+
+            if content_length > AUDIO_MAX_BYTES:
+                response.close()
+                raise HTTPException(
+                    status_code=HttpStatusCode.PAYLOAD_TOO_LARGE.value,
+                    detail=f"The MP3 file exceeds the maximum size of {AUDIO_MAX_BYTES} bytes!",
+                )
+
+            return AudioStream(response, content_length, deadline, started)
         elif response.status_code == HttpStatusCode.NOT_FOUND.value:
+            response.close()
             raise HTTPException(
                 status_code=HttpStatusCode.NOT_FOUND.value,
                 detail="The input resource could not be found!",
             )
         else:
+            response.close()
             raise HTTPException(
                 status_code=response.status_code,
                 detail="An error occurred while fetching the MP3 file!",
@@ -67,28 +393,45 @@ def convert_url(url: str) -> Union[BytesIO, HTTPException]:
         )
 
 
-def get_diarized_output(audio_data, token, deepgram_api_base):
+def get_diarized_output(audio_data, token, deepgram_api_base, deadline=NO_DEADLINE):
     """Get a diarized output from Deepgram API"""
 
-    print("Preparing diarization")
-
     headers = {
         "Authorization": f"Token {token}",
         "content-type": "audio/mp3",
     }
 
-    response = requests.post(deepgram_api_base, headers=headers, data=audio_data)
-
-    diarized_output = []
+    try:
+        # Deepgram answers once the whole file is transcribed, so the read timeout bounds the call
+        timeout = deadline.requests_timeout("transcription")
+        started = time.perf_counter()
+
+        with DEEPGRAM_SECONDS.time():
+            response = get_upstream("deepgram").call(
+                lambda: get_session("deepgram").post(
+                    deepgram_api_base, headers=headers, data=audio_data, timeout=timeout
+                ),
+                unhealthy=http_upstream_failed(timeout),
+            )
+    except requests.RequestException:
+        raise HTTPException(
+            status_code=HttpStatusCode.INTERNAL_SERVER_ERROR.value,
+            detail="An error occurred while streaming the MP3 file to deepgram!",
+        )
+    finally:
+        audio_data.close()
 
     if response.status_code == HttpStatusCode.OK.value:
-        response_json = response.json()
-
-        filter_query = '.results.utterances[] | "[Speaker:\(.speaker)] \(.transcript)"'
-        result = jq(filter_query).input(response_json)
-
-        for item in result.all():
-            diarized_output.append(item)
+        diarized_output = Transcript.from_deepgram(response.json())
+        logger.info(
+            "Transcription finished",
+            extra={
+                "fields": {
+                    "utterances": len(diarized_output),
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+                }
+            },
+        )
 
     else:
         raise HTTPException(
@@ -96,15 +439,22 @@ def get_diarized_output(audio_data, token, deepgram_api_base):
             detail=f"An error occured while getting results from deepgram API, {response.status_code}:\n{response.text}",
         )
 
-    return remove_whitespace_between_brackets("\n".join(diarized_output))
+    return diarized_output
 
 
-def get_speaker_labels(diarized_output, function, AZURE_OPENAI_PARAMS):
+def get_speaker_labels(
+    diarized_output,
+    function,
+    AZURE_OPENAI_PARAMS,
+    deadline=NO_DEADLINE,
+    transcript_tokens: int = None,
+):
     """Get the corresponding labels for the speakers on the basis of a diarized transcript"""
 
-    print("Labelling Speakers")
-
-    speaker_classification = openai.ChatCompletion.create(
+    speaker_classification, labelling_usage = create_chat_completion(
+        "labels",
+        deadline,
+        transcript_tokens,
         **AZURE_OPENAI_PARAMS,
         seed=SEED,
         messages=[
@@ -122,7 +472,7 @@ def get_speaker_labels(diarized_output, function, AZURE_OPENAI_PARAMS):
                     "arguments"
                 ]
             ),
-            speaker_classification["usage"],
+            labelling_usage,
         )
     except Exception:
         raise HTTPException(
@@ -131,10 +481,19 @@ def get_speaker_labels(diarized_output, function, AZURE_OPENAI_PARAMS):
         )
 
 
-def get_summary(transcript, function, AZURE_OPENAI_PARAMS):
+def get_summary(
+    transcript,
+    function,
+    AZURE_OPENAI_PARAMS,
+    deadline=NO_DEADLINE,
+    transcript_tokens: int = None,
+):
     """Get an AI powered call summary"""
 
-    summary = openai.ChatCompletion.create(
+    summary, summarizing_usage = create_chat_completion(
+        "summary",
+        deadline,
+        transcript_tokens,
         **AZURE_OPENAI_PARAMS,
         messages=[
             {"role": "user", "content": "Conversation: \n\n" + transcript},
@@ -146,16 +505,51 @@ def get_summary(transcript, function, AZURE_OPENAI_PARAMS):
     )
     return (
         json.loads(summary["choices"][0]["message"]["function_call"]["arguments"]),
-        summary["usage"],
+        summarizing_usage,
     )
 
 
-def get_ratings(diarized_transcript, function, AZURE_OPENAI_PARAMS):
-    """Get an AI powered parameter evaluation"""
+def get_merged_summary(partial_summaries, function, AZURE_OPENAI_PARAMS, deadline=NO_DEADLINE):
+    """Merge the summaries of consecutive parts of a call into one call summary"""
+
+    summaries = "\n\n".join(
+        f"Part {number}:\n{json.dumps(summary.dict(), ensure_ascii=False)}"
+        for number, summary in enumerate(partial_summaries, start=1)
+    )
 
-    print("Evaluating Ratings")
+    merged_summary, merging_usage = create_chat_completion(
+        "summary_reduce",
+        deadline,
+        **AZURE_OPENAI_PARAMS,
+        messages=[
+            {"role": "user", "content": "Summaries: \n\n" + summaries},
+            {"role": "system", "content": summary_reduce_system_prompt},
+        ],
+        functions=[function],
+        temperature=0.0,
+        function_call={"name": "summarize"},
+    )
+    return (
+        json.loads(
+            merged_summary["choices"][0]["message"]["function_call"]["arguments"]
+        ),
+        merging_usage,
+    )
+
+
+def get_ratings(
+    diarized_transcript,
+    function,
+    AZURE_OPENAI_PARAMS,
+    deadline=NO_DEADLINE,
+    transcript_tokens: int = None,
+):
+    """Get an AI powered parameter evaluation"""
 
-    ratings_completion = openai.ChatCompletion.create(
+    ratings_completion, rating_usage = create_chat_completion(
+        "ratings",
+        deadline,
+        transcript_tokens,
         **AZURE_OPENAI_PARAMS,
         seed=SEED,
         messages=[
@@ -169,21 +563,47 @@ def get_ratings(diarized_transcript, function, AZURE_OPENAI_PARAMS):
         json.loads(
             ratings_completion["choices"][0]["message"]["function_call"]["arguments"]
         ),
-        ratings_completion["usage"],
+        rating_usage,
     )
 
 
-def validate_speaker_count(text: str):
-    """Validate if the Deepgram API generates only two speakers"""
+def get_fused_analysis(
+    diarized_output,
+    function,
+    AZURE_OPENAI_PARAMS,
+    deadline=NO_DEADLINE,
+    transcript_tokens: int = None,
+):
+    """Get speaker labels, a call summary and a parameter evaluation in one request, as unparsed function arguments"""
+
+    fused_completion, fused_usage = create_chat_completion(
+        "fused",
+        deadline,
+        transcript_tokens,
+        **AZURE_OPENAI_PARAMS,
+        seed=SEED,
+        messages=[
+            {"role": "system", "content": fused_system_prompt},
+            {"role": "user", "content": diarized_output},
+        ],
+        functions=[function],
+        temperature=0.0,
+        function_call={"name": "fused_call_analysis"},
+    )
+    # Parsed by the caller, so a malformed reply is still billed in its usage
+    return (
+        fused_completion["choices"][0]["message"]["function_call"]["arguments"],
+        fused_usage,
+    )
 
-    pattern = re.compile(r"\[speaker:(\d+)\]")
 
-    matches = pattern.findall(text.lower())
+def validate_speaker_count(transcript: Transcript):
+    """Validate if the Deepgram API generates only two speakers"""
 
-    unique_speakers = set(matches)
+    unique_speakers = transcript.speakers()
 
     if len(unique_speakers) == 2:
-        return text
+        return transcript
     else:
         raise InvalidSpeakerCountException(
             "Invalid number of speakers. Expected 2, found {}".format(
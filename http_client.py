@@ -0,0 +1,125 @@
+import random
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (
+    HTTP_POOL_CONNECTIONS,
+    HTTP_POOL_MAXSIZE,
+    HTTP_POOL_BLOCK,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    HTTP_MAX_RETRIES,
+    HTTP_RETRY_BACKOFF,
+)
+
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class JitteredRetry(Retry):
+    """Retry policy with full-jitter exponential backoff"""
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+
+        return random.uniform(0, backoff) if backoff else 0
+
+
+class PooledSession(requests.Session):
+    """Session that applies the default connect/read timeouts to every request"""
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+
+        return super().request(method, url, **kwargs)
+
+
+def build_session():
+    """Build a keep-alive session with a tuned connection pool and idempotent retries"""
+
+    # Only methods in DEFAULT_ALLOWED_METHODS are retried once a request was sent,
+    # so uploads such as the Deepgram POST are never replayed
+    retry = JitteredRetry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        pool_block=HTTP_POOL_BLOCK,
+        max_retries=retry,
+    )
+
+    session = PooledSession()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
+def get_session(name: str = "default") -> requests.Session:
+    """Get the process-wide session for an upstream, creating it on first use"""
+
+    with _sessions_lock:
+        session = _sessions.get(name)
+
+        if session is None:
+            session = build_session()
+            _sessions[name] = session
+
+        return session
+
+
+def pool_stats():
+    """Connection pool usage of every session, keyed by session name"""
+
+    stats = {}
+
+    with _sessions_lock:
+        sessions = list(_sessions.items())
+
+    for name, session in sessions:
+        pools = []
+        adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+
+        for adapter in adapters.values():
+            pool_manager = adapter.poolmanager
+
+            for key in list(pool_manager.pools.keys()):
+                pool = pool_manager.pools.get(key)
+
+                if pool is None:
+                    continue
+
+                idle_connections = sum(
+                    1 for connection in list(pool.pool.queue) if connection
+                )
+                pools.append(
+                    {
+                        "host": pool.host,
+                        "port": pool.port,
+                        "scheme": pool.scheme,
+                        "maxsize": pool.pool.maxsize,
+                        "connections_opened": pool.num_connections,
+                        "requests": pool.num_requests,
+                        "idle_connections": idle_connections,
+                    }
+                )
+
+        stats[name] = {
+            "pool_connections": HTTP_POOL_CONNECTIONS,
+            "pool_maxsize": HTTP_POOL_MAXSIZE,
+            "pools": pools,
+        }
+
+    return stats
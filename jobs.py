@@ -0,0 +1,188 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from starlette.exceptions import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+from config import (
+    JOB_WORKERS,
+    JOB_QUEUE_SIZE,
+    JOB_DEADLINE_SECONDS,
+    JOB_QUEUED_LEASE_SECONDS,
+)
+from mongodb import collection
+from models import AudioRequest, DetailedAudioResponse, JobStatusResponse
+from enums import HttpStatusCode
+from persistence import build_analysis_response
+from pipelines import run_analysis
+from rate_limiter import PRIORITY_JOB
+from resilience import Deadline
+from result_cache import result_projection, new_lease, lease_active
+from repository import analysis_repository
+from metrics import MONGO_WRITE_SECONDS
+
+
+job_executor = ThreadPoolExecutor(
+    max_workers=JOB_WORKERS, thread_name_prefix="analysis-job"
+)
+
+# Running plus queued jobs, beyond which submissions are turned away
+job_slots = threading.BoundedSemaphore(JOB_WORKERS + JOB_QUEUE_SIZE)
+
+
+def job_status(document: dict) -> JobStatusResponse:
+    """Read the job status out of an analysis document"""
+
+    log = document.get("logs") or {}
+
+    return JobStatusResponse(
+        job_id=str(document["_id"]),
+        status=log.get("status", "UNKNOWN"),
+        error_class=log.get("error_class") or None,
+        error_description=log.get("error_description") or None,
+    )
+
+
+def queued_lease() -> dict:
+    """Lease of a job waiting in this worker's queue, lost with the queue if the worker restarts"""
+
+    return new_lease(Deadline(JOB_QUEUED_LEASE_SECONDS))
+
+
+def run_job(audio: AudioRequest, document_id, lease: dict, resume: bool = False):
+    """Run a queued analysis, making sure a crash still leaves a FAILED status behind"""
+
+    # Nobody waits on the response, the job gets a longer budget than a request
+    deadline = Deadline(JOB_DEADLINE_SECONDS)
+
+    try:
+        # A job that outlived its queued lease may have been taken over by a duplicate
+        with MONGO_WRITE_SECONDS.time(operation="job_status"):
+            started = collection.update_one(
+                {"_id": document_id, "lease.token": lease["token"]},
+                {"$set": {"logs.status": "RUNNING", "lease": new_lease(deadline)}},
+            )
+
+        if started.modified_count == 0:
+            return
+
+        run_analysis(audio, document_id, PRIORITY_JOB, deadline, resume=resume)
+    except HTTPException:
+        # run_analysis already logged the failure on the document
+        pass
+    except Exception as e:
+        collection.update_one(
+            {"_id": document_id},
+            {
+                "$set": {
+                    "logs": {
+                        "status": "FAILED",
+                        "error_class": str(type(e).__name__),
+                        "error_description": str(e),
+                    }
+                }
+            },
+        )
+    finally:
+        job_slots.release()
+
+
+async def claim_job(audio: AudioRequest, lease: dict):
+    """Create the job document, or take over a failed or abandoned one, returning (document_id, existing document)"""
+
+    try:
+        return await analysis_repository.create_job(audio, lease), None
+    except DuplicateKeyError:
+        pass
+
+    document = await analysis_repository.fetch_result(
+        mp3=audio.mp3_url, projection={"_id": 1, "logs": 1, "lease": 1}
+    )
+
+    # Deleted between the insert and the lookup, the url is free again
+    if document is None:
+        return await analysis_repository.create_job(audio, lease), None
+
+    status = (document.get("logs") or {}).get("status")
+
+    # A failed run, or one whose worker went away, is queued again and resumes from its checkpoints
+    if (
+        status == "SUCCESS"
+        or (status != "FAILED" and lease_active(document))
+        or not await analysis_repository.requeue_job(document, lease)
+    ):
+        return None, document
+
+    return document["_id"], document
+
+
+async def submit_job(audio: AudioRequest) -> JobStatusResponse:
+    """Queue an analysis on the in-process worker pool and return its job id right away"""
+
+    if not job_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=HttpStatusCode.SERVICE_UNAVAILABLE.value,
+            detail="The analysis queue is full, please retry later!",
+        )
+
+    lease = queued_lease()
+    # The permit belongs to the worker once the job is on the executor, until then it is ours to give back
+    handed_off = False
+
+    try:
+        document_id, document = await claim_job(audio, lease)
+
+        if document_id is None:
+            return job_status(document)
+
+        job_executor.submit(run_job, audio, document_id, lease, document is not None)
+        handed_off = True
+    finally:
+        if not handed_off:
+            job_slots.release()
+
+    return job_status({"_id": document_id, "logs": {"status": "QUEUED"}})
+
+
+async def find_job(job_id: str, projection: dict = None) -> dict:
+    try:
+        document_id = ObjectId(job_id)
+    except InvalidId:
+        document_id = None
+
+    document = None
+    if document_id is not None:
+        document = await analysis_repository.fetch_result(
+            document_id=document_id, projection=projection
+        )
+
+    if document is None:
+        raise HTTPException(
+            status_code=HttpStatusCode.NOT_FOUND.value,
+            detail="The requested job could not be found!",
+        )
+
+    return document
+
+
+async def get_job_status(job_id: str) -> JobStatusResponse:
+    """Get the status of a job"""
+
+    return job_status(await find_job(job_id, {"_id": 1, "logs": 1}))
+
+
+async def get_job_result(job_id: str, fields=None) -> DetailedAudioResponse:
+    """Get the analysis of a finished job, only the requested `fields` when given"""
+
+    document = await find_job(job_id, result_projection(fields))
+    status = job_status(document)
+
+    if status.status != "SUCCESS":
+        raise HTTPException(
+            status_code=HttpStatusCode.CONFLICT.value,
+            detail=f"The job has not completed successfully, current status: {status.status}",
+        )
+
+    return build_analysis_response(document, fields)
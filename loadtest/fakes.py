@@ -0,0 +1,244 @@
+"""Local stand-ins for the audio CDN, Deepgram and Azure OpenAI chat completions."""
+
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import Counter, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from benchmarks.deepgram import synthetic_response
+
+
+class Behaviour:
+    """How a fake upstream misbehaves: latency, injected 5xx errors and a requests-per-minute quota answered with 429s"""
+
+    def __init__(
+        self,
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        error_rate: float = 0,
+        rate_limit_rpm: int = 0,
+        retry_after: float = 1,
+        seed: int = 0,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rpm = rate_limit_rpm
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent = deque()
+        self.counters = Counter()
+
+    def count(self, outcome: str):
+        with self.lock:
+            self.counters[outcome] += 1
+
+    def admit(self) -> str:
+        """"ok", "rate_limited" or "error" for the next request, counted"""
+
+        with self.lock:
+            now = time.monotonic()
+
+            if self.rate_limit_rpm:
+                while self.recent and now - self.recent[0] > 60:
+                    self.recent.popleft()
+
+                if len(self.recent) >= self.rate_limit_rpm:
+                    self.counters["rate_limited"] += 1
+                    return "rate_limited"
+
+                self.recent.append(now)
+
+            outcome = "error" if self.rng.random() < self.error_rate else "ok"
+            self.counters[outcome] += 1
+            delay = max(0.0, self.rng.gauss(self.latency_ms, self.jitter_ms)) / 1000
+
+        time.sleep(delay)
+
+        return outcome
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    behaviour = None
+
+    def log_message(self, *args):
+        pass
+
+    def read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            body = bytearray()
+
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return bytes(body)
+                body += self.rfile.read(size)
+                self.rfile.readline()
+
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def send(self, status: int, body: bytes, content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status: int, payload: dict, headers=None):
+        self.send(status, json.dumps(payload).encode(), headers=headers)
+
+    def misbehave(self) -> bool:
+        """Answer with a 429 or a 500 if the behaviour says so, True when it did"""
+
+        outcome = self.behaviour.admit()
+
+        if outcome == "rate_limited":
+            self.send_json(
+                429,
+                {"error": {"code": "429", "message": "Rate limit exceeded."}},
+                {"Retry-After": str(self.behaviour.retry_after)},
+            )
+            return True
+
+        if outcome == "error":
+            self.send_json(500, {"error": {"code": "500", "message": "Injected failure."}})
+            return True
+
+        return False
+
+
+class AudioHandler(FakeHandler):
+    """GET /audio/<name>.mp3 serves deterministic bytes unique to the name, so recordings are never deduplicated"""
+
+    audio_bytes = 256 * 1024
+
+    def do_GET(self):
+        if self.misbehave():
+            return
+
+        if not self.path.startswith("/audio/"):
+            self.send(404, b"", content_type="text/plain")
+            return
+
+        seed = hashlib.sha256(self.path.encode()).digest()
+        body = (seed * (self.audio_bytes // len(seed) + 1))[: self.audio_bytes]
+        self.send(200, body, content_type="audio/mpeg")
+
+
+class DeepgramHandler(FakeHandler):
+    """POST /v1/listen answers a synthetic diarized transcript once the upload is read"""
+
+    utterances = 150
+
+    def do_POST(self):
+        self.read_body()
+
+        if self.misbehave():
+            return
+
+        seed = random.Random().randrange(1 << 30)
+        self.send_json(200, synthetic_response(self.utterances, seed))
+
+
+FUNCTION_ARGUMENTS = {
+    "speaker_classifier": {"speaker_0": "salesperson: ", "speaker_1": "customer: "},
+    "summarize": {
+        "title": "Site visit for a 2 BHK",
+        "discussion_points": "Budget, location and possession.",
+        "customer_queries": "Distance to the metro.",
+        "meeting_request_attempt": "Site visit proposed for Saturday.",
+        "next_action_items": "Share the brochure.",
+    },
+    "call_analysis": {
+        "rudeness_or_politeness_metric": 4,
+        "salesperson_company_introduction": 3,
+        "meeting_request": 2,
+        "salesperson_convincing_abilities": 3,
+        "salesperson_understanding_of_customer_requirements": 4,
+        "customer_sentiment_by_the_end_of_call": 3,
+        "customer_eagerness_to_buy": 2,
+        "customer_budget": "80 lakhs",
+        "customer_preferences": "2 BHK near the metro",
+    },
+}
+FUNCTION_ARGUMENTS["fused_call_analysis"] = {
+    "speaker_labels": FUNCTION_ARGUMENTS["speaker_classifier"],
+    "summary": FUNCTION_ARGUMENTS["summarize"],
+    "ratings": FUNCTION_ARGUMENTS["call_analysis"],
+}
+
+CHAT_COMPLETIONS_PATH = re.compile(r"^/openai/deployments/([^/]+)/chat/completions")
+
+
+class AzureOpenAIHandler(FakeHandler):
+    """POST /openai/deployments/<deployment>/chat/completions answers the requested function call"""
+
+    def do_POST(self):
+        request = json.loads(self.read_body() or b"{}")
+
+        if not CHAT_COMPLETIONS_PATH.match(self.path):
+            self.send_json(404, {"error": {"code": "404", "message": "Unknown path."}})
+            return
+
+        if self.misbehave():
+            return
+
+        name = request.get("function_call", {}).get("name")
+        arguments = json.dumps(FUNCTION_ARGUMENTS.get(name, {}))
+        # Roughly four characters per token is close enough for quota accounting
+        prompt_tokens = sum(
+            len(message.get("content", "")) for message in request.get("messages", [])
+        ) // 4
+        completion_tokens = len(arguments) // 4
+
+        self.send_json(
+            200,
+            {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "gpt-35-turbo",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {
+                            "role": "assistant",
+                            "content": None,
+                            "function_call": {"name": name, "arguments": arguments},
+                        },
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        )
+
+
+def start_fake(handler, behaviour: Behaviour, port: int = 0, **attributes):
+    """Serve a fake upstream on a background thread, returning the server and its base URL"""
+
+    handler = type(handler.__name__, (handler,), {"behaviour": behaviour, **attributes})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
@@ -0,0 +1,364 @@
+"""Load-test /get_detailed_call_analysis against local fakes of the CDN, Deepgram and Azure OpenAI.
+
+Run from the repository root: ``python -m loadtest.run --requests 200 --concurrency 16``
+
+By default the app runs in this process on an in-process Mongo (mongomock).
+``--workers N --mongo-uri URI`` starts ``uvicorn --workers N`` on a local Mongo
+instead, to size worker counts, and ``--target URL`` drives an app that is
+already running (start it with the environment ``--fakes-only`` prints).
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import threading
+import subprocess
+from uuid import uuid4
+from collections import Counter
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from loadtest.fakes import (
+    Behaviour,
+    AudioHandler,
+    DeepgramHandler,
+    AzureOpenAIHandler,
+    start_fake,
+)
+
+
+API_KEY = "load-test"
+ENDPOINT = "/get_detailed_call_analysis"
+PERCENTILES = (50, 90, 95, 99)
+
+
+def start_fakes(args):
+    """Start the three fake upstreams, returning their behaviours and base URLs"""
+
+    behaviours = {
+        "audio": Behaviour(args.audio_latency_ms, args.jitter_ms, args.audio_error_rate),
+        "deepgram": Behaviour(
+            args.deepgram_latency_ms, args.jitter_ms, args.deepgram_error_rate
+        ),
+        "azure": Behaviour(
+            args.azure_latency_ms,
+            args.jitter_ms,
+            args.azure_error_rate,
+            args.azure_rpm,
+            args.retry_after,
+        ),
+    }
+    urls = {}
+
+    _, urls["audio"] = start_fake(
+        AudioHandler, behaviours["audio"], audio_bytes=args.audio_kib * 1024
+    )
+    _, urls["deepgram"] = start_fake(
+        DeepgramHandler, behaviours["deepgram"], utterances=args.utterances
+    )
+    _, urls["azure"] = start_fake(AzureOpenAIHandler, behaviours["azure"])
+
+    return behaviours, urls
+
+
+def app_environment(urls, mongo_uri, args) -> dict:
+    """Environment that points the app at the fakes"""
+
+    return {
+        "MONGO_URI": mongo_uri,
+        "CALL_ANALYSIS_API_KEY": API_KEY,
+        "DEEPGRAM_API_BASE": urls["deepgram"] + "/v1/listen?diarize=true&utterances=true",
+        "DEEPGRAM_API_KEY": API_KEY,
+        "AZURE_OPENAI_API_BASE": urls["azure"],
+        "AZURE_OPENAI_API_KEY": API_KEY,
+        "AZURE_OPENAI_API_TYPE": "azure",
+        "AZURE_OPENAI_API_VERSION": "2023-07-01-preview",
+        "AZURE_DEPLOYMENT_NAME_4K": "gpt-35-turbo",
+        "AZURE_DEPLOYMENT_NAME_16K": "gpt-35-turbo-16k",
+        # Warm caches would turn a second run into a cache benchmark
+        "TRANSCRIPT_CACHE_BACKENDS": "",
+        "LLM_CACHE_STAGES": "",
+        "RATE_LIMIT_STORE_PATH": os.path.join(
+            tempfile.mkdtemp(prefix="echosensai-loadtest-"), "rate_limits.sqlite3"
+        ),
+        "LOG_LEVEL": args.log_level,
+    }
+
+
+def ensure_mp3_index(mongo_uri: str):
+    """The unique mp3 index production relies on for duplicate detection"""
+
+    import pymongo
+
+    client = pymongo.MongoClient(mongo_uri)
+    client.get_default_database()["detailed_analysis"].create_index("mp3", unique=True)
+
+
+def start_in_process(environment, port: int) -> str:
+    """Serve the app from this process on a single uvicorn worker"""
+
+    os.environ.update(environment)
+
+    if environment["MONGO_URI"].startswith("mongomock://"):
+        import mongomock
+        import pymongo
+
+        pymongo.MongoClient = mongomock.MongoClient
+        os.environ["MONGO_URI"] = "mongodb://localhost/loadtest"
+
+    import uvicorn
+
+    ensure_mp3_index(os.environ["MONGO_URI"])
+
+    from main import app
+
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+
+    while not server.started:
+        time.sleep(0.05)
+
+    return f"http://127.0.0.1:{port}"
+
+
+def start_workers(environment, port: int, workers: int):
+    """Serve the app from `workers` uvicorn worker processes"""
+
+    ensure_mp3_index(environment["MONGO_URI"])
+
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--log-level", "warning",
+        ],
+        env={**os.environ, **environment},
+    )
+    base_url = f"http://127.0.0.1:{port}"
+
+    for _ in range(600):
+        try:
+            requests.get(base_url + "/", timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            if process.poll() is not None:
+                raise SystemExit("uvicorn exited before serving requests")
+            time.sleep(0.1)
+
+    process.terminate()
+    raise SystemExit("uvicorn did not start serving within 60s")
+
+
+def drive(base_url, audio_url, args):
+    """Closed-loop load: `concurrency` clients send requests back to back"""
+
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_maxsize=args.concurrency))
+
+    run_id = uuid4().hex[:8]
+    lock = threading.Lock()
+    next_index = [0]
+    results = []
+    stop_at = time.monotonic() + args.duration if args.duration else None
+
+    def client():
+        while True:
+            with lock:
+                index = next_index[0]
+                next_index[0] += 1
+
+            if stop_at is None and index >= args.requests:
+                return
+            if stop_at is not None and time.monotonic() >= stop_at:
+                return
+
+            body = {
+                "mp3_url": f"{audio_url}/audio/{run_id}-{index}.mp3",
+                "sales_lead_info": {"lead_id": index, "salesperson_name": "Load Test"},
+            }
+            started = time.perf_counter()
+
+            try:
+                response = session.post(
+                    base_url + ENDPOINT,
+                    json=body,
+                    headers={"X-API-Key": API_KEY},
+                    timeout=args.timeout,
+                )
+                outcome = str(response.status_code)
+                detail = None if response.ok else response.json().get("detail")
+            except (requests.RequestException, ValueError) as e:
+                outcome, detail = type(e).__name__, str(e)
+
+            latency = time.perf_counter() - started
+
+            with lock:
+                results.append((latency, outcome, detail))
+
+    started = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(args.concurrency)]
+
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+
+    return results, time.perf_counter() - started
+
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile"""
+
+    if not sorted_values:
+        return None
+
+    rank = max(1, -(-percent * len(sorted_values) // 100))
+
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(results, elapsed, behaviours, args) -> dict:
+    all_latencies = sorted(latency for latency, _, _ in results)
+    ok_latencies = sorted(latency for latency, outcome, _ in results if outcome == "200")
+
+    def latency_report(latencies):
+        return {
+            **{f"p{p}": percentile(latencies, p) for p in PERCENTILES},
+            "max": latencies[-1] if latencies else None,
+        }
+
+    return {
+        "requests": len(results),
+        "concurrency": args.concurrency,
+        "workers": args.workers,
+        "elapsed_seconds": elapsed,
+        "throughput_rps": len(results) / elapsed if elapsed else 0,
+        "successful_rps": len(ok_latencies) / elapsed if elapsed else 0,
+        "latency_seconds": latency_report(all_latencies),
+        "success_latency_seconds": latency_report(ok_latencies),
+        "outcomes": dict(Counter(outcome for _, outcome, _ in results)),
+        "errors": dict(
+            Counter(
+                f"{outcome}: {detail}" for _, outcome, detail in results if outcome != "200"
+            ).most_common(10)
+        ),
+        "upstreams": {name: behaviour.stats() for name, behaviour in behaviours.items()},
+    }
+
+
+def print_report(report):
+    def milliseconds(value):
+        return "-" if value is None else f"{value * 1000:.0f}"
+
+    print()
+    print(
+        f"{report['requests']} requests in {report['elapsed_seconds']:.1f}s at concurrency "
+        f"{report['concurrency']}: {report['throughput_rps']:.2f} req/s, "
+        f"{report['successful_rps']:.2f} successful req/s"
+    )
+
+    for label, key in (("all", "latency_seconds"), ("200", "success_latency_seconds")):
+        latencies = report[key]
+        print(
+            f"latency ms ({label}): "
+            + ", ".join(f"{name} {milliseconds(value)}" for name, value in latencies.items())
+        )
+
+    print("outcomes: " + ", ".join(f"{k} x{v}" for k, v in sorted(report["outcomes"].items())))
+
+    for error, count in report["errors"].items():
+        print(f"  {count:>5} x {' '.join(error.split())[:160]}")
+
+    for name, stats in report["upstreams"].items():
+        print(f"fake {name}: " + ", ".join(f"{k} {v}" for k, v in sorted(stats.items())))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+
+    load = parser.add_argument_group("load")
+    load.add_argument("--requests", type=int, default=100, help="requests to send")
+    load.add_argument("--duration", type=float, help="send for this many seconds instead")
+    load.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    load.add_argument("--timeout", type=float, default=600, help="client timeout in seconds")
+
+    app = parser.add_argument_group("app")
+    app.add_argument("--target", help="drive an app already running at this URL")
+    app.add_argument("--workers", type=int, default=1, help="uvicorn workers, more than 1 needs --mongo-uri")
+    app.add_argument("--port", type=int, default=8765, help="port the app is served on")
+    app.add_argument("--mongo-uri", help="local MongoDB, in-process mongomock when omitted")
+    app.add_argument("--log-level", default="WARNING", help="LOG_LEVEL of the app")
+    app.add_argument("--fakes-only", action="store_true", help="only start the fakes and print the app environment")
+
+    fakes = parser.add_argument_group("fakes")
+    fakes.add_argument("--audio-latency-ms", type=float, default=50)
+    fakes.add_argument("--deepgram-latency-ms", type=float, default=2000)
+    fakes.add_argument("--azure-latency-ms", type=float, default=1500)
+    fakes.add_argument("--jitter-ms", type=float, default=0, help="latency standard deviation")
+    fakes.add_argument("--audio-error-rate", type=float, default=0)
+    fakes.add_argument("--deepgram-error-rate", type=float, default=0)
+    fakes.add_argument("--azure-error-rate", type=float, default=0)
+    fakes.add_argument("--azure-rpm", type=int, default=0, help="Azure quota answered with 429s, 0 is unlimited")
+    fakes.add_argument("--retry-after", type=float, default=1, help="Retry-After of the 429s")
+    fakes.add_argument("--utterances", type=int, default=150, help="utterances per transcript")
+    fakes.add_argument("--audio-kib", type=int, default=256, help="size of each MP3")
+
+    parser.add_argument("--json", help="also write the report to this file")
+
+    args = parser.parse_args(argv)
+
+    if args.workers > 1 and not (args.mongo_uri or args.target):
+        parser.error("--workers above 1 needs --mongo-uri, mongomock lives in one process")
+
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    behaviours, urls = start_fakes(args)
+    environment = app_environment(urls, args.mongo_uri or "mongomock://", args)
+    process = None
+
+    if args.fakes_only or args.target:
+        print("App environment:")
+        for name, value in environment.items():
+            print(f"  export {name}='{value}'")
+
+    if args.fakes_only:
+        print("Fakes are running, press Ctrl-C to stop")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            return
+
+    if args.target:
+        base_url = args.target.rstrip("/")
+    elif args.workers > 1:
+        process, base_url = start_workers(environment, args.port, args.workers)
+    else:
+        base_url = start_in_process(environment, args.port)
+
+    try:
+        results, elapsed = drive(base_url, urls["audio"], args)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = summarize(results, elapsed, behaviours, args)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+
+from config import LOG_LEVEL, LOG_QUEUE_SIZE
+from metrics import LOG_RECORDS_DROPPED
+
+
+# Fields attached to every record logged in the current analysis, e.g. the MP3
+log_context = ContextVar("log_context", default={})
+
+
+@contextmanager
+def bind(**fields):
+    """Add fields to every record logged inside the block, stage threads included"""
+
+    token = log_context.set({**log_context.get(), **fields})
+
+    try:
+        yield
+    finally:
+        log_context.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, then the structured fields"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "context", {}),
+            **getattr(record, "fields", {}),
+        }
+
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to the writer thread without ever blocking the caller"""
+
+    def prepare(self, record):
+        # Arguments and tracebacks are rendered here, formatting is left to the writer thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        # The context lives in the calling thread, capture it before the handoff
+        record.context = log_context.get()
+
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def configure_logging():
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    listener = QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger("echosensai")
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.propagate = False
+
+    return listener
+
+
+listener = configure_logging()
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"echosensai.{name}")
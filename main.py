@@ -1,24 +1,42 @@
+# Imported first, so the startup report times the whole boot
+import startup
+
+from typing import List, Optional
+import threading
+
 import uvicorn
-from bson import ObjectId
-from pymongo.errors import DuplicateKeyError
 from fastapi import FastAPI, HTTPException, Request, Security, Depends
-from fastapi.responses import HTMLResponse
+from fastapi.responses import (
+    HTMLResponse,
+    StreamingResponse,
+    PlainTextResponse,
+    ORJSONResponse,
+)
 from fastapi.templating import Jinja2Templates
 from fastapi.security import APIKeyHeader
 
-from config import CALL_ANALYSIS_API_KEY
-from models import (
-    AudioRequest,
-    CallMetadata,
-    DetailedAudioResponse,
-    UsageObject,
-    DiarizedTranscriptObject,
-    RatingsObject,
-    SummaryObject,
+from config import (
+    CALL_ANALYSIS_API_KEY,
+    BATCH_MAX_ITEMS,
+    ANALYSIS_DEADLINE_SECONDS,
+    STARTUP_WARM_UP,
 )
-from mongodb import collection
+from models import AudioRequest, DetailedAudioResponse, JobStatusResponse
+from batch import run_batch
+from http_client import pool_stats
+from mongodb import ensure_indexes, mongo_pool_stats
+from persistence import RESPONSE_FIELDS
+from rate_limiter import scheduler_stats
+from resilience import Deadline, upstream_stats
+from metrics import render_metrics
+from logs import get_logger
+from completion_cache import completion_cache
+from transcript_cache import transcript_cache
+from result_cache import result_cache
 from enums import HttpStatusCode
-from pipelines import prepare_analysis
+from jobs import submit_job, get_job_status, get_job_result
+from pipelines import process_call
+from token_budget import check_bundled_encoding
 
 app = FastAPI(
     title="EchoSensai",
@@ -26,10 +44,33 @@ app = FastAPI(
     version="1.3.2",
     openapi_tags=[
         {"name": "Call Analysis", "description": "Endpoints for call analysis"},
+        {"name": "Diagnostics", "description": "Endpoints for capacity planning"},
     ],
 )
 
 templates = Jinja2Templates(directory="templates")
+logger = get_logger("main")
+
+
+@startup.warm_up_hook
+def create_indexes():
+    """Create the indexes of the analysis collection and the caches, idempotent"""
+
+    ensure_indexes()
+    transcript_cache.ensure_indexes()
+    completion_cache.ensure_indexes()
+
+
+@app.on_event("startup")
+def warm_up():
+    # A missing tokenizer file would otherwise only surface as failing analyses
+    check_bundled_encoding()
+    startup.mark_booted()
+
+    if STARTUP_WARM_UP == "blocking":
+        startup.warm_up()
+    elif STARTUP_WARM_UP == "background":
+        threading.Thread(target=startup.warm_up, name="warm-up", daemon=True).start()
 
 
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
@@ -50,132 +91,203 @@ async def get_api_key(api_key_header: str = Security(api_key_header)):
         )
 
 
+def get_response_fields(fields: Optional[str] = None):
+    """The comma separated response fields to return, None for the full analysis"""
+
+    if not fields:
+        return None
+
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - RESPONSE_FIELDS.keys()
+
+    if unknown:
+        raise HTTPException(
+            status_code=HttpStatusCode.BAD_REQUEST.value,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}, choose from: {', '.join(RESPONSE_FIELDS)}",
+        )
+
+    # In a fixed order, so equal selections share a Mongo projection and a coalesced run
+    return tuple(field for field in RESPONSE_FIELDS if field in requested)
+
+
+def analysis_response(
+    analysis: DetailedAudioResponse, fields: Optional[tuple]
+) -> ORJSONResponse:
+    """Serialise an analysis with orjson, only the requested fields when given"""
+
+    return ORJSONResponse(analysis.dict(include=set(fields) if fields else None))
+
+
 @app.get("/", tags=["Index"], response_class=HTMLResponse)
 def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 
+@app.get(
+    "/metrics",
+    tags=["Diagnostics"],
+    response_class=PlainTextResponse,
+    description="Get this worker's metrics in the Prometheus text format.",
+)
+def get_metrics():
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get(
+    "/startup_stats",
+    tags=["Diagnostics"],
+    description="Get how long this worker took to boot and to warm up its deferred imports and clients.",
+)
+def get_startup_stats(api_key: str = Depends(get_api_key)):
+    return startup.startup_report()
+
+
+@app.get(
+    "/pool_stats",
+    tags=["Diagnostics"],
+    description="Get the outbound HTTP connection pool usage of this worker.",
+)
+def get_pool_stats(api_key: str = Depends(get_api_key)):
+    return pool_stats()
+
+
+@app.get(
+    "/mongo_pool_stats",
+    tags=["Diagnostics"],
+    description="Get the MongoDB connection pool usage of this worker's blocking and async clients.",
+)
+def get_mongo_pool_stats(api_key: str = Depends(get_api_key)):
+    return mongo_pool_stats()
+
+
+@app.get(
+    "/scheduler_stats",
+    tags=["Diagnostics"],
+    description="Get the queue depth, in-flight calls and adaptive concurrency of each Azure OpenAI deployment.",
+)
+def get_scheduler_stats(api_key: str = Depends(get_api_key)):
+    return scheduler_stats()
+
+
+@app.get(
+    "/upstream_stats",
+    tags=["Diagnostics"],
+    description="Get the circuit breaker state and hedging of each external dependency.",
+)
+def get_upstream_stats(api_key: str = Depends(get_api_key)):
+    return upstream_stats()
+
+
+@app.get(
+    "/cache_stats",
+    tags=["Diagnostics"],
+    description="Get the hit and miss counters of this worker's caches.",
+)
+def get_cache_stats(api_key: str = Depends(get_api_key)):
+    return {
+        "transcripts": transcript_cache.stats(),
+        "completions": completion_cache.stats(),
+        "results": result_cache.stats(),
+    }
+
+
 @app.post(
     "/get_detailed_call_analysis",
     tags=["Call Analysis"],
     response_model=DetailedAudioResponse,
-    description="Get a call analysis of an audio input on 8 parameters.",
+    response_class=ORJSONResponse,
+    description="Get a call analysis of an audio input on 8 parameters. Pass `fields`, e.g. `ratings,summary`, to get only those fields.",
     name="Echo-Octa-Sensai",
 )
 def process(
-    audio_url: AudioRequest, api_key: str = Depends(get_api_key)
-) -> DetailedAudioResponse:
-    print()
-    print()
-    print("-" * 150)
-    print()
-    print(
-        f"\033[36mprocessing {audio_url.sales_lead_info.salesperson_name}'s call ({audio_url.sales_lead_info.lead_id}):\n{audio_url.mp3_url}\033[0m"
+    audio_url: AudioRequest,
+    fields: Optional[tuple] = Depends(get_response_fields),
+    api_key: str = Depends(get_api_key),
+) -> ORJSONResponse:
+    # The clock starts when the request arrives, every stage spends from the same budget
+    deadline = Deadline(ANALYSIS_DEADLINE_SECONDS)
+
+    call = {
+        "mp3": audio_url.mp3_url,
+        "lead_id": audio_url.sales_lead_info.lead_id,
+        "salesperson_name": audio_url.sales_lead_info.salesperson_name,
+    }
+    logger.info("Processing call", extra={"fields": call})
+
+    processed_analysis, duplicate = process_call(
+        audio_url, deadline=deadline, fields=fields
     )
-    print()
-
-    mp3 = audio_url.mp3_url
-
-    try:
-        input_details = {
-            "mp3": mp3,
-            "sales_lead_info": audio_url.sales_lead_info.dict(),
-        }
-        inserted_object = collection.insert_one(input_details)
-        inserted_object_id = inserted_object.inserted_id
-
-        try:
-            processed_analysis = prepare_analysis(audio_url)
-
-            log = {
-                "status": "SUCCESS",
-                "error_class": "",
-                "error_description": "",
-            }
-
-            document = {
-                "timestamp": ObjectId(inserted_object_id).generation_time,
-                "logs": log,
-            }
-
-        except HTTPException as e:
-            log = {
-                "status": "FAILED",
-                "error_class": str(type(e).__name__),
-                "error_description": str(e.detail),
-            }
-            document = {
-                "sales_lead_info": audio_url.sales_lead_info.dict(),
-                "timestamp": ObjectId(inserted_object_id).generation_time,
-                "logs": log,
-            }
-
-        collection.update_one({"_id": inserted_object_id}, {"$set": document})
-
-        print()
-        print("\033[36mcall processed!\033[0m")
-        print()
-        print("-" * 150)
-        print()
-
-        return processed_analysis
-
-    except DuplicateKeyError:
-        fetched_object = collection.find_one({"mp3": audio_url.mp3_url})
-
-        try:
-            sales_lead = fetched_object["sales_lead_info"]
-            sales_lead_info = CallMetadata(**sales_lead)
-        except KeyError:
-            sales_lead_info = None
-
-        try:
-            mp3 = fetched_object["mp3"]
-        except KeyError:
-            mp3 = None
-
-        try:
-            mongodb_ratings = fetched_object["analysis"]
-            ratings = RatingsObject(**mongodb_ratings)
-        except KeyError:
-            ratings = None
-
-        try:
-            mongodb_transcript = fetched_object["transcript"]
-            transcript = DiarizedTranscriptObject(**mongodb_transcript)
-        except KeyError:
-            transcript = None
-
-        try:
-            mongodb_summary = fetched_object["summary"]
-            summary = SummaryObject(**mongodb_summary)
-        except KeyError:
-            summary = None
-
-        try:
-            mongodb_token_usage = fetched_object["gpt35_usage"]
-            token_usage = UsageObject(**mongodb_token_usage)
-        except KeyError:
-            token_usage = None
-
-        processed_analysis = DetailedAudioResponse(
-            mp3=mp3,
-            sales_lead_info=sales_lead_info,
-            ratings=ratings,
-            script=transcript,
-            summary=summary,
-            token_usage=token_usage,
+
+    if duplicate:
+        logger.info("Call analysis already exists in the database", extra={"fields": call})
+    else:
+        logger.info("Call processed", extra={"fields": call})
+
+    return analysis_response(processed_analysis, fields)
+
+
+@app.post(
+    "/batch_call_analysis",
+    tags=["Call Analysis"],
+    response_class=StreamingResponse,
+    description="Analyze a batch of audio inputs, streaming one JSON status line per call as it finishes.",
+)
+def process_batch(
+    audio_urls: List[AudioRequest],
+    include_analysis: bool = False,
+    api_key: str = Depends(get_api_key),
+) -> StreamingResponse:
+    if len(audio_urls) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=HttpStatusCode.BAD_REQUEST.value,
+            detail=f"A batch can contain at most {BATCH_MAX_ITEMS} calls!",
         )
 
-        print()
-        print("\033[36mcall analysis already exists in the database!\033[0m")
-        print()
-        print("-" * 150)
-        print()
-        print()
-        print()
+    return StreamingResponse(
+        run_batch(audio_urls, include_analysis), media_type="application/x-ndjson"
+    )
+
+
+@app.post(
+    "/jobs",
+    tags=["Call Analysis"],
+    response_model=JobStatusResponse,
+    status_code=HttpStatusCode.ACCEPTED.value,
+    description="Queue a call analysis of an audio input and get a job id to poll.",
+)
+async def submit_analysis_job(
+    audio_url: AudioRequest, api_key: str = Depends(get_api_key)
+) -> JobStatusResponse:
+    return await submit_job(audio_url)
 
-        return processed_analysis
+
+@app.get(
+    "/jobs/{job_id}",
+    tags=["Call Analysis"],
+    response_model=JobStatusResponse,
+    description="Get the status of a queued call analysis.",
+)
+async def get_analysis_job(
+    job_id: str, api_key: str = Depends(get_api_key)
+) -> JobStatusResponse:
+    return await get_job_status(job_id)
+
+
+@app.get(
+    "/jobs/{job_id}/result",
+    tags=["Call Analysis"],
+    response_model=DetailedAudioResponse,
+    response_class=ORJSONResponse,
+    description="Get the call analysis of a finished job. Pass `fields`, e.g. `ratings,summary`, to get only those fields.",
+)
+async def get_analysis_job_result(
+    job_id: str,
+    fields: Optional[tuple] = Depends(get_response_fields),
+    api_key: str = Depends(get_api_key),
+) -> ORJSONResponse:
+    return analysis_response(await get_job_result(job_id, fields), fields)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,62 @@
+from typing import List
+
+from models import RatingsObject
+
+
+BUDGET_NOT_DISCLOSED = "Budget not disclosed"
+
+# How each numeric rating of the chunks is combined into the rating of the call
+FIRST_CHUNK_RATINGS = ("salesperson_company_introduction",)
+LAST_CHUNK_RATINGS = ("customer_sentiment_by_the_end_of_call",)
+BEST_CHUNK_RATINGS = ("meeting_request",)
+WORST_CHUNK_RATINGS = ("rudeness_or_politeness_metric",)
+AVERAGE_RATINGS = (
+    "salesperson_convincing_abilities",
+    "salesperson_understanding_of_customer_requirements",
+    "customer_eagerness_to_buy",
+)
+
+
+def merge_ratings(chunk_ratings: List[RatingsObject]) -> RatingsObject:
+    """Combine the ratings of consecutive chunks of a call into the ratings of the whole call"""
+
+    merged = {}
+
+    def values(field):
+        return [
+            getattr(ratings, field)
+            for ratings in chunk_ratings
+            if getattr(ratings, field) is not None
+        ]
+
+    for field in FIRST_CHUNK_RATINGS:
+        merged[field] = next(iter(values(field)), None)
+
+    for field in LAST_CHUNK_RATINGS:
+        merged[field] = next(reversed(values(field)), None)
+
+    for field in BEST_CHUNK_RATINGS:
+        merged[field] = max(values(field), default=None)
+
+    for field in WORST_CHUNK_RATINGS:
+        merged[field] = min(values(field), default=None)
+
+    for field in AVERAGE_RATINGS:
+        field_values = values(field)
+        merged[field] = (
+            round(sum(field_values) / len(field_values)) if field_values else None
+        )
+
+    # The latest budget the customer disclosed wins
+    budgets = [
+        budget for budget in values("customer_budget") if budget != BUDGET_NOT_DISCLOSED
+    ]
+    merged["customer_budget"] = budgets[-1] if budgets else BUDGET_NOT_DISCLOSED
+
+    preferences = []
+    for preference in values("customer_preferences"):
+        if preference.strip() and preference not in preferences:
+            preferences.append(preference)
+    merged["customer_preferences"] = "\n".join(preferences) or None
+
+    return RatingsObject(**merged)
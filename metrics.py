@@ -0,0 +1,249 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+
+# Seconds, from a cache hit up to a long Deepgram transcription
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300,
+)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()) -> str:
+    pairs = [
+        f'{name}="{escape_label_value(value)}"'
+        for name, value in list(zip(names, values)) + list(extra)
+    ]
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """A named metric family whose samples are keyed by label values"""
+
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+        with _registry_lock:
+            _registry.append(self)
+
+    def key(self, labels: dict):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+        with self.lock:
+            samples = list(self.values.items())
+
+        for key, value in sorted(samples):
+            lines.extend(self.render_sample(key, value))
+
+        return lines
+
+    def render_sample(self, key, value):
+        return [f"{self.name}{format_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self.key(labels)
+
+        with self.lock:
+            self.values[key] = value
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the block as in flight while it runs"""
+
+        self.inc(**labels)
+
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            sample = self.values.get(key)
+
+            if sample is None:
+                # Per-bucket counts plus the +Inf bucket, then the sum
+                sample = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+
+            sample[0][index] += 1
+            sample[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the block takes, whether or not it raises"""
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render_sample(self, key, value):
+        counts, total = value[0][:], value[1]
+        lines = []
+        cumulative = 0
+
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            labels = format_labels(self.labelnames, key, [("le", bound)])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+        labels = format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+
+        return lines
+
+
+def render_metrics() -> str:
+    """Every metric of this process in the Prometheus text exposition format"""
+
+    with _registry_lock:
+        metrics = list(_registry)
+
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+
+    return "\n".join(lines) + "\n"
+
+
+AUDIO_DOWNLOAD_SECONDS = Histogram(
+    "echosensai_audio_download_seconds",
+    "Time to read an MP3 from its URL, from the request to the last byte.",
+)
+AUDIO_BYTES = Counter(
+    "echosensai_audio_bytes_total", "MP3 bytes downloaded."
+)
+DEEPGRAM_SECONDS = Histogram(
+    "echosensai_deepgram_seconds",
+    "Time Deepgram took to answer a transcription request, including the upload.",
+)
+LLM_STAGE_SECONDS = Histogram(
+    "echosensai_llm_stage_seconds",
+    "Time an LLM stage took, including the wait for rate-limit admission.",
+    ("stage", "source"),
+)
+LLM_QUEUE_SECONDS = Histogram(
+    "echosensai_llm_queue_seconds",
+    "Time an Azure OpenAI call waited for rate-limit admission.",
+    ("deployment",),
+)
+LLM_TOKENS = Counter(
+    "echosensai_llm_tokens_total",
+    "Tokens billed, or saved by the completion cache, per LLM stage.",
+    ("stage", "kind"),
+)
+LLM_IN_FLIGHT = Gauge(
+    "echosensai_llm_in_flight",
+    "Azure OpenAI calls currently sent and not yet answered.",
+    ("deployment",),
+)
+MONGO_WRITE_SECONDS = Histogram(
+    "echosensai_mongo_write_seconds",
+    "Time a MongoDB write took.",
+    ("operation",),
+)
+MONGO_POOL_CONNECTIONS = Gauge(
+    "echosensai_mongo_pool_connections",
+    "MongoDB pool connections per client that are open, checked out, or waited for.",
+    ("client", "state"),
+)
+MONGO_POOL_WAIT_SECONDS = Histogram(
+    "echosensai_mongo_pool_wait_seconds",
+    "Time an operation waited to check a connection out of the MongoDB pool.",
+    ("client",),
+)
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    "echosensai_mongo_pool_checkout_failures_total",
+    "Connections that could not be checked out of the MongoDB pool.",
+    ("client", "reason"),
+)
+ROUTING_DECISIONS = Counter(
+    "echosensai_routing_decisions_total",
+    "Analyses per selected model context and analysis mode.",
+    ("model_config", "mode"),
+)
+CACHE_REQUESTS = Counter(
+    "echosensai_cache_requests_total",
+    "Cache lookups per cache, tier or stage, and outcome.",
+    ("cache", "scope", "result"),
+)
+UPSTREAM_FAILURES = Counter(
+    "echosensai_upstream_failures_total",
+    "Calls that counted against an upstream's health, or were rejected by its open circuit.",
+    ("upstream", "reason"),
+)
+STAGE_CHECKPOINTS = Counter(
+    "echosensai_stage_checkpoints_total",
+    "Pipeline stages reused from a checkpoint of an earlier run, or computed.",
+    ("stage", "result"),
+)
+ANALYSES_IN_FLIGHT = Gauge(
+    "echosensai_analyses_in_flight", "Analyses currently running."
+)
+ANALYSIS_SECONDS = Histogram(
+    "echosensai_analysis_seconds",
+    "End-to-end time of an analysis.",
+    ("status",),
+)
+LOG_RECORDS_DROPPED = Counter(
+    "echosensai_log_records_dropped_total",
+    "Log records dropped because the log queue was full.",
+)
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel
 
 
@@ -36,6 +36,7 @@ class UsageObject(BaseModel):
     prompt_tokens: Optional[int] = None
     completion_tokens: Optional[int] = None
     total_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
 
 
 class DiarizedTranscriptObject(BaseModel):
@@ -50,3 +51,19 @@ class DetailedAudioResponse(BaseModel):
     summary: Optional[SummaryObject] = None
     script: Optional[DiarizedTranscriptObject] = None
     token_usage: Optional[UsageObject] = None
+
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str
+    error_class: Optional[str] = None
+    error_description: Optional[str] = None
+
+
+class BatchItemStatus(BaseModel):
+    indexes: List[int]
+    mp3_url: str
+    status: str
+    error_class: Optional[str] = None
+    error_description: Optional[str] = None
+    analysis: Optional[DetailedAudioResponse] = None
@@ -1,8 +1,167 @@
+import time
+import threading
+
 import pymongo
+from pymongo import monitoring
+from pymongo.write_concern import WriteConcern
+
+from config import (
+    MONGODB_URI,
+    MONGO_WRITE_CONCERN,
+    MONGO_WRITE_JOURNAL,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_MAX_IDLE_TIME_MS,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_SOCKET_TIMEOUT_MS,
+    MONGO_READ_CONCERN,
+    MONGO_READ_PREFERENCE,
+)
+from metrics import (
+    MONGO_POOL_CONNECTIONS,
+    MONGO_POOL_WAIT_SECONDS,
+    MONGO_POOL_CHECKOUT_FAILURES,
+)
+from startup import Lazy, warm_up_hook
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Tracks how much of a client's connection pool is in use from pymongo's pool events"""
+
+    def __init__(self, client_name: str):
+        self.client_name = client_name
+        self.lock = threading.Lock()
+        self.counts = {"open": 0, "checked_out": 0, "waiting": 0}
+        self.peak_checked_out = 0
+        # Checkout events of one operation are published on the thread running it
+        self.checkout = threading.local()
+
+    def count(self, state: str, amount: int):
+        MONGO_POOL_CONNECTIONS.inc(amount, client=self.client_name, state=state)
+
+        with self.lock:
+            self.counts[state] += amount
+            self.peak_checked_out = max(
+                self.peak_checked_out, self.counts["checked_out"]
+            )
+
+    def connection_check_out_started(self, event):
+        self.checkout.started = time.perf_counter()
+        self.count("waiting", 1)
+
+    def connection_checked_out(self, event):
+        self.count("waiting", -1)
+        self.count("checked_out", 1)
+
+        started = getattr(self.checkout, "started", None)
+        if started is not None:
+            MONGO_POOL_WAIT_SECONDS.observe(
+                time.perf_counter() - started, client=self.client_name
+            )
+
+    def connection_check_out_failed(self, event):
+        self.count("waiting", -1)
+        MONGO_POOL_CHECKOUT_FAILURES.inc(client=self.client_name, reason=event.reason)
+
+    def connection_checked_in(self, event):
+        self.count("checked_out", -1)
+
+    def connection_created(self, event):
+        self.count("open", 1)
+
+    def connection_closed(self, event):
+        self.count("open", -1)
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                **self.counts,
+                "peak_checked_out": self.peak_checked_out,
+                "max_pool_size": MONGO_MAX_POOL_SIZE,
+                "utilisation": round(self.counts["checked_out"] / MONGO_MAX_POOL_SIZE, 3),
+            }
+
 
-from config import MONGODB_URI
+_pool_listeners = {}
 
-client = pymongo.MongoClient(MONGODB_URI)
-db = client.get_default_database()
+
+def client_options(client_name: str) -> dict:
+    """MongoClient options shared by the blocking and the async client, with pool metrics under `client_name`"""
+
+    listener = _pool_listeners.setdefault(client_name, PoolMetricsListener(client_name))
+
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "readConcernLevel": MONGO_READ_CONCERN,
+        "readPreference": MONGO_READ_PREFERENCE,
+        "event_listeners": [listener],
+    }
+
+
+def mongo_pool_stats():
+    """Connection pool usage of every MongoDB client, keyed by client name"""
+
+    return {name: listener.stats() for name, listener in _pool_listeners.items()}
+
+
+# Stage outputs and job documents are written with this durability
+analysis_write_concern = WriteConcern(w=MONGO_WRITE_CONCERN, j=MONGO_WRITE_JOURNAL)
+
+# Created on first use: a mongodb+srv URI costs DNS lookups before the app could serve
+client = Lazy(
+    lambda: pymongo.MongoClient(MONGODB_URI, **client_options("blocking")),
+    "mongo client",
+)
+
+
+class LazyDatabase(Lazy):
+    """The default database, whose collections can be taken before the client exists"""
+
+    def __getitem__(self, name):
+        return Lazy(lambda: self.resolve()[name])
+
+
+db = LazyDatabase(lambda: client.get_default_database())
 
 collection = db["detailed_analysis"]
+
+# Stage outputs are written through this handle so their durability is tunable
+analysis_writes = Lazy(
+    lambda: collection.with_options(write_concern=analysis_write_concern)
+)
+
+
+@warm_up_hook
+def connect():
+    """Open the first connection to MongoDB"""
+
+    client.admin.command("ping")
+
+
+def ensure_indexes():
+    """Create the secondary indexes the API relies on"""
+
+    collection.create_index("audio_fingerprint", sparse=True)
@@ -0,0 +1,161 @@
+import json
+import hashlib
+import threading
+from datetime import datetime
+
+from config import MONGO_CHECKPOINT_STAGES
+from mongodb import analysis_writes
+from metrics import MONGO_WRITE_SECONDS, STAGE_CHECKPOINTS
+from logs import get_logger
+from models import (
+    CallMetadata,
+    DetailedAudioResponse,
+    UsageObject,
+    DiarizedTranscriptObject,
+    RatingsObject,
+    SummaryObject,
+)
+
+
+logger = get_logger("persistence")
+
+# Bumped whenever the stored form of a stage checkpoint changes
+STAGE_CHECKPOINT_FORMAT = 1
+
+
+def stage_key(*inputs) -> str:
+    """Hash of everything a stage output depends on, a checkpoint is valid while it matches"""
+
+    serialized = json.dumps(
+        [STAGE_CHECKPOINT_FORMAT, *inputs], sort_keys=True, separators=(",", ":")
+    )
+
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+def load_stage_checkpoints(document_id) -> dict:
+    """Stage checkpoints an earlier run left on an analysis document"""
+
+    document = analysis_writes.find_one({"_id": document_id}, {"stage_checkpoints": 1})
+
+    return (document or {}).get("stage_checkpoints") or {}
+
+
+class AnalysisWriter:
+    """Unit of work that gathers stage results of one analysis document and writes them in as few round trips as possible"""
+
+    def __init__(
+        self, document_id=None, mp3=None, checkpoint_stages=None, stage_checkpoints=None
+    ):
+        if document_id is not None:
+            self.filter = {"_id": document_id}
+        else:
+            self.filter = {"mp3": mp3}
+
+        if checkpoint_stages is None:
+            checkpoint_stages = MONGO_CHECKPOINT_STAGES
+
+        self.checkpoint_stages = set(checkpoint_stages)
+        self.stage_checkpoints = stage_checkpoints or {}
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def stage(self, name: str, fields: dict):
+        """Record the output of a stage, writing it out if the stage is a checkpoint"""
+
+        with self.lock:
+            self.pending.update(fields)
+
+        if name in self.checkpoint_stages:
+            self.flush()
+
+    def completed(self, stage: str, key: str):
+        """The checkpoint an earlier run left for `stage`, None unless it was computed from the same inputs"""
+
+        checkpoint = self.stage_checkpoints.get(stage)
+
+        if checkpoint is None or checkpoint.get("key") != key:
+            return None
+
+        STAGE_CHECKPOINTS.inc(stage=stage, result="reused")
+        logger.info("Reusing checkpointed stage", extra={"fields": {"stage": stage}})
+
+        return checkpoint
+
+    def complete(self, stage: str, key: str, output, usage=None):
+        """Checkpoint a stage output so a rerun of the analysis can skip the stage"""
+
+        STAGE_CHECKPOINTS.inc(stage=stage, result="computed")
+        self.stage(
+            stage,
+            {
+                f"stage_checkpoints.{stage}": {
+                    "key": key,
+                    "output": output,
+                    "usage": usage,
+                    "completed_at": datetime.utcnow(),
+                }
+            },
+        )
+
+    def run_stage(self, stage: str, key: str, compute):
+        """(output, usage) of a stage from its checkpoint when still valid, otherwise from `compute()`"""
+
+        checkpoint = self.completed(stage, key)
+
+        if checkpoint is not None:
+            return checkpoint["output"], checkpoint["usage"]
+
+        output, usage = compute()
+        self.complete(stage, key, output, usage)
+
+        return output, usage
+
+    def take_pending(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+
+        return pending
+
+    def flush(self):
+        """Write every pending stage output in a single update"""
+
+        pending = self.take_pending()
+
+        if pending:
+            with MONGO_WRITE_SECONDS.time(operation="stage_update"):
+                analysis_writes.update_one(self.filter, {"$set": pending})
+
+
+# Response field: the document field it is stored in and the model it is rebuilt with
+RESPONSE_FIELDS = {
+    "mp3": ("mp3", None),
+    "sales_lead_info": ("sales_lead_info", CallMetadata),
+    "ratings": ("analysis", RatingsObject),
+    "summary": ("summary", SummaryObject),
+    "script": ("transcript", DiarizedTranscriptObject),
+    "token_usage": ("gpt35_usage", UsageObject),
+}
+
+
+def response_projection(fields=None) -> dict:
+    """Mongo projection of the document fields the requested response fields are rebuilt from"""
+
+    return {RESPONSE_FIELDS[field][0]: 1 for field in fields or RESPONSE_FIELDS}
+
+
+def build_analysis_response(fetched_object: dict, fields=None) -> DetailedAudioResponse:
+    """Rebuild the API response from a stored analysis document, only the requested `fields` when given"""
+
+    response = {}
+
+    for field in fields or RESPONSE_FIELDS:
+        document_field, model = RESPONSE_FIELDS[field]
+        value = fetched_object.get(document_field)
+
+        if value is not None and model is not None:
+            value = model(**value)
+
+        response[field] = value
+
+    return DetailedAudioResponse(**response)
@@ -1,32 +1,72 @@
+import json
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from contextvars import copy_context
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from starlette.exceptions import HTTPException
-from openai.error import (
-    Timeout,
-    RateLimitError,
-    APIError,
-    ServiceUnavailableError,
-    AuthenticationError,
-    APIConnectionError,
-    InvalidRequestError,
-)
 
 from helper import (
+    openai_error,
     convert_url,
     get_diarized_output,
     get_ratings,
     get_summary,
-    count_tokens,
     get_speaker_labels,
+    get_fused_analysis,
+    get_merged_summary,
     validate_speaker_count,
+    merge_usage,
 )
 from config import (
     DEEPGRAM_API_BASE,
     DEEPGRAM_TOKEN,
-    AZURE_OPENAI_PARAMS_16K,
-    AZURE_OPENAI_PARAMS_4K,
-    TOKENS_FACTOR_OF_SAFTEY,
+    AZURE_OPENAI_PARAMS_BY_MODEL,
+    PIPELINE_CONCURRENT_STAGES,
+    PIPELINE_STAGE_WORKERS,
+    AUDIO_DEDUPLICATION,
+    ANALYSIS_MODE,
+    LOCAL_LABEL_CONFIDENCE_THRESHOLD,
+    LABEL_PREFIX_UTTERANCES,
+    MODEL_CONTEXT_WINDOWS,
+    ANALYSIS_DEADLINE_SECONDS,
+    RESULT_POLL_SECONDS,
+)
+from token_budget import (
+    select_model_config,
+    stage_fits,
+    chunk_transcript,
+    chunk_token_budget,
+)
+from map_reduce import merge_ratings
+from rate_limiter import PRIORITY_INTERACTIVE, scheduling_scope
+from resilience import Deadline
+from logs import get_logger, bind
+from metrics import (
+    ANALYSES_IN_FLIGHT,
+    ANALYSIS_SECONDS,
+    MONGO_WRITE_SECONDS,
+    ROUTING_DECISIONS,
 )
 from mongodb import collection
-from functions import EVALUATE_PARAMETERS, SUMMARIZE_CALL, LABEL_SPEAKERS
+from persistence import (
+    AnalysisWriter,
+    build_analysis_response,
+    load_stage_checkpoints,
+    stage_key,
+)
+from result_cache import result_cache, new_lease, lease_active, claim_lease
+from transcript_cache import transcript_cache
+from speaker_classifier import classify_speakers
+from utterances import Transcript
+from functions import (
+    EVALUATE_PARAMETERS,
+    SUMMARIZE_CALL,
+    LABEL_SPEAKERS,
+    ANALYZE_CALL,
+    SPEAKER_ROLES,
+)
 from models import (
     DiarizedTranscriptObject,
     SummaryObject,
@@ -39,145 +79,532 @@ from exceptions import InvalidSpeakerCountException
 from enums import HttpStatusCode
 
 
-def prepare_analysis(audio: AudioRequest) -> DetailedAudioResponse:
-    """This pipeline generates an end-to-end AI powered call analysis"""
+logger = get_logger("pipelines")
 
-    mp3 = audio.mp3_url
+stage_executor = ThreadPoolExecutor(
+    max_workers=PIPELINE_STAGE_WORKERS, thread_name_prefix="pipeline-stage"
+)
 
-    mp3_bytes = convert_url(mp3)
 
-    labelling_usage = {
-        "prompt_tokens": 0,
-        "completion_tokens": 0,
-        "total_tokens": 0,
-    }
+def submit_stage(function, *args):
+    """Run a stage on the stage executor, keeping the caller's scheduling priority"""
+
+    return stage_executor.submit(copy_context().run, function, *args)
+
+
+def summarize_transcript(
+    writer, transcript, AZURE_OPENAI_PARAMS, deadline, transcript_tokens=None
+):
+    """Summarize the labelled transcript and persist the summary"""
+
+    summary, summarizing_usage = writer.run_stage(
+        "summary",
+        stage_key(transcript, SUMMARIZE_CALL, AZURE_OPENAI_PARAMS["engine"]),
+        lambda: get_summary(
+            transcript, SUMMARIZE_CALL, AZURE_OPENAI_PARAMS, deadline, transcript_tokens
+        ),
+    )
+    summaryObject = SummaryObject(**summary)
+    writer.stage("summary", {"summary": summaryObject.dict()})
+
+    return summaryObject, summarizing_usage
+
+
+def evaluate_transcript(
+    writer, transcript, AZURE_OPENAI_PARAMS, deadline, transcript_tokens=None
+):
+    """Rate the labelled transcript and persist the analysis"""
+
+    ratings, rating_usage = writer.run_stage(
+        "ratings",
+        stage_key(transcript, EVALUATE_PARAMETERS, AZURE_OPENAI_PARAMS["engine"]),
+        lambda: get_ratings(
+            transcript,
+            EVALUATE_PARAMETERS,
+            AZURE_OPENAI_PARAMS,
+            deadline,
+            transcript_tokens,
+        ),
+    )
+    ratingsObject = RatingsObject(**ratings)
+    writer.stage("analysis", {"analysis": ratingsObject.dict()})
+
+    return ratingsObject, rating_usage
+
+
+def label_speakers(
+    diarization, AZURE_OPENAI_PARAMS, deadline, prefix_utterances, transcript_tokens=None
+):
+    """Label the speakers as salesperson and customer, with no labels when the speaker count is invalid"""
 
     try:
-        # Step 1: Get the Diarization & Transcript
-        raw_diarization = get_diarized_output(
-            mp3_bytes, DEEPGRAM_TOKEN, DEEPGRAM_API_BASE
+        # Step 1.1.1: Validate if there are 2 speakers
+        validate_speaker_count(diarization)
+
+    except InvalidSpeakerCountException:
+        logger.warning(
+            "Invalid number of speakers, stripping the speaker labels",
+            extra={"fields": {"speakers": len(diarization.speakers())}},
         )
+        return {"speaker_labels": None}, None
 
-        if count_tokens(raw_diarization) >= TOKENS_FACTOR_OF_SAFTEY:
-            AZURE_OPENAI_PARAMS = AZURE_OPENAI_PARAMS_16K
-            model_config = "16k"
-        else:
-            AZURE_OPENAI_PARAMS = AZURE_OPENAI_PARAMS_4K
-            model_config = "4k"
+    # Step 1.2.1: Label the un-labelled speakers (Speaker:0 & Speaker:1) as salesperson and customer
+    labels, confidence = classify_speakers(diarization)
+    labelling_usage = None
 
-        collection.update_one(
-            {"mp3": mp3},
-            {
-                "$set": {
-                    "model_config": model_config,
-                }
-            },
+    if confidence >= LOCAL_LABEL_CONFIDENCE_THRESHOLD:
+        logger.info(
+            "Labelled speakers locally", extra={"fields": {"confidence": confidence}}
         )
+        labelling_source = "local"
+    else:
+        # The opening of the call is enough to tell the roles apart
+        head = diarization.head(prefix_utterances)
+        head_tokens = None
 
-        try:
-            # Step 1.1.1: Validate if there are 2 speakers
-            raw_diarization = validate_speaker_count(raw_diarization)
+        if transcript_tokens is not None:
+            # Scheduled on the head's share of the counted transcript, not encoded again
+            head_tokens = transcript_tokens * len(head) // max(len(diarization), 1)
 
-            # Step 1.2.1: Label the un-labelled speakers (Speaker:0 & Speaker:1) as salesperson and customer
-            labels, labelling_usage = get_speaker_labels(
-                raw_diarization, LABEL_SPEAKERS, AZURE_OPENAI_PARAMS
-            )
+        labels, labelling_usage = get_speaker_labels(
+            head.render(), LABEL_SPEAKERS, AZURE_OPENAI_PARAMS, deadline, head_tokens
+        )
+        labelling_source = "llm"
 
-            # Step 1.3.1: Replace the labels in the raw transcript
-            print("Replacing labelled roles")
-            transcript = raw_diarization.replace(
-                "[Speaker:0]", labels["speaker_0"]
-            ).replace("[Speaker:1]", labels["speaker_1"])
-            diarizedTranscriptObject = DiarizedTranscriptObject(
-                diarized_transcript=transcript
-            )
-            collection.update_one(
-                {"mp3": mp3},
-                {
-                    "$set": {
-                        "transcript": diarizedTranscriptObject.dict(),
-                    },
-                },
-            )
+    labelling = {
+        "speaker_labels": labels,
+        "speaker_labelling": {"source": labelling_source, "local_confidence": confidence},
+    }
 
-        except InvalidSpeakerCountException:
-            print()
-            print("\033[31mInvalid Number of speakers found, fixing transcript!\033[0m")
-            print()
-
-            # Step 1.1.2: Remove the wrong labels (Single speaker / More than 2 speakers) to avoid a possible confusion to the LLM
-            transcript = (
-                raw_diarization.replace("[Speaker:0]", "")
-                .replace("[Speaker:1]", "")
-                .replace("[Speaker:2]", "")
-                .replace("[Speaker:3]", "")
-            )
-            diarizedTranscriptObject = DiarizedTranscriptObject(
-                raw_transcript=transcript
-            )
-            collection.update_one(
-                {"mp3": mp3},
-                {
-                    "$set": {
-                        "transcript": diarizedTranscriptObject.dict(),
-                    },
-                },
-            )
+    return labelling, labelling_usage
+
+
+def label_transcript(
+    diarization,
+    writer,
+    AZURE_OPENAI_PARAMS,
+    usage_breakdown,
+    deadline,
+    prefix_utterances=LABEL_PREFIX_UTTERANCES,
+    transcript_tokens=None,
+):
+    """Render the transcript with labelled speakers, or without labels when the speaker count is invalid"""
+
+    labelling, labelling_usage = writer.run_stage(
+        "labels",
+        stage_key(
+            diarization.render(),
+            prefix_utterances,
+            LOCAL_LABEL_CONFIDENCE_THRESHOLD,
+            LABEL_SPEAKERS,
+            AZURE_OPENAI_PARAMS["engine"],
+        ),
+        lambda: label_speakers(
+            diarization,
+            AZURE_OPENAI_PARAMS,
+            deadline,
+            prefix_utterances,
+            transcript_tokens,
+        ),
+    )
+
+    if labelling_usage is not None:
+        usage_breakdown["labels"] = labelling_usage
+
+    labels = labelling["speaker_labels"]
 
-        # Step 2: Prepare Summary
-        print("Preparing Summary")
-        summary, summarizing_usage = get_summary(
-            transcript, SUMMARIZE_CALL, AZURE_OPENAI_PARAMS
+    if labels is None:
+        # Step 1.1.2: Remove the wrong labels (Single speaker / More than 2 speakers) to avoid a possible confusion to the LLM
+        speaker_labels = None
+        diarizedTranscriptObject = DiarizedTranscriptObject(
+            raw_transcript=diarization.render(strip_labels=True)
         )
-        summaryObject = SummaryObject(**summary)
-        collection.update_one(
-            {"mp3": mp3},
-            {
-                "$set": {
-                    "summary": summaryObject.dict(),
-                }
-            },
+    else:
+        writer.stage(
+            "speaker_labelling", {"speaker_labelling": labelling["speaker_labelling"]}
         )
 
-        # Step 3: Evaluate Ratings
-        ratings, rating_usage = get_ratings(
-            transcript, EVALUATE_PARAMETERS, AZURE_OPENAI_PARAMS
+        # Step 1.3.1: Render the transcript with the labelled roles
+        speaker_labels = {0: labels["speaker_0"], 1: labels["speaker_1"]}
+        diarizedTranscriptObject = DiarizedTranscriptObject(
+            diarized_transcript=diarization.render(speaker_labels)
         )
-        ratingsObject = RatingsObject(**ratings)
-        collection.update_one(
-            {"mp3": mp3},
-            {
-                "$set": {
-                    "analysis": ratingsObject.dict(),
-                }
-            },
+
+    writer.stage("transcript", {"transcript": diarizedTranscriptObject.dict()})
+
+    return speaker_labels, diarizedTranscriptObject
+
+
+def staged_analysis(
+    diarization,
+    raw_diarization,
+    writer,
+    AZURE_OPENAI_PARAMS,
+    usage_breakdown,
+    deadline,
+    transcript_tokens=None,
+):
+    """Label, summarize and rate the call with one LLM request per stage"""
+
+    _, diarizedTranscriptObject = label_transcript(
+        diarization,
+        writer,
+        AZURE_OPENAI_PARAMS,
+        usage_breakdown,
+        deadline,
+        transcript_tokens=transcript_tokens,
+    )
+    transcript = (
+        diarizedTranscriptObject.diarized_transcript
+        or diarizedTranscriptObject.raw_transcript
+    )
+
+    # Step 2 & 3: Prepare Summary and Evaluate Ratings, both read only the transcript
+    if PIPELINE_CONCURRENT_STAGES:
+        summary_future = submit_stage(
+            summarize_transcript,
+            writer,
+            transcript,
+            AZURE_OPENAI_PARAMS,
+            deadline,
+            transcript_tokens,
+        )
+        ratings_future = submit_stage(
+            evaluate_transcript,
+            writer,
+            transcript,
+            AZURE_OPENAI_PARAMS,
+            deadline,
+            transcript_tokens,
+        )
+        # Let both stages persist their output before an error propagates, a resume would pay for them again
+        wait([summary_future, ratings_future])
+        summaryObject, usage_breakdown["summary"] = summary_future.result()
+        ratingsObject, usage_breakdown["ratings"] = ratings_future.result()
+    else:
+        summaryObject, usage_breakdown["summary"] = summarize_transcript(
+            writer, transcript, AZURE_OPENAI_PARAMS, deadline, transcript_tokens
+        )
+        ratingsObject, usage_breakdown["ratings"] = evaluate_transcript(
+            writer, transcript, AZURE_OPENAI_PARAMS, deadline, transcript_tokens
         )
 
-        # Step 4: Analyze the API Calls' Usage
-        print("Preparing Usage")
-        usage = {}
-        usage["prompt_tokens"] = (
-            rating_usage["prompt_tokens"]
-            + labelling_usage["prompt_tokens"]
-            + summarizing_usage["prompt_tokens"]
-        )
-        usage["completion_tokens"] = (
-            rating_usage["completion_tokens"]
-            + labelling_usage["completion_tokens"]
-            + summarizing_usage["completion_tokens"]
-        )
-        usage["total_tokens"] = (
-            rating_usage["total_tokens"]
-            + labelling_usage["total_tokens"]
-            + summarizing_usage["total_tokens"]
+    return diarizedTranscriptObject, summaryObject, ratingsObject
+
+
+def chunked_analysis(
+    diarization, writer, AZURE_OPENAI_PARAMS, usage_breakdown, deadline
+):
+    """Map-reduce analysis for calls that do not fit in one context: summarize and rate every chunk in parallel, then merge"""
+
+    chunk_budget = chunk_token_budget()
+    chunks = chunk_transcript(diarization, chunk_budget)
+    logger.info("Analyzing call in chunks", extra={"fields": {"chunks": len(chunks)}})
+
+    # The first chunk is always small enough to label the speakers with
+    speaker_labels, diarizedTranscriptObject = label_transcript(
+        diarization,
+        writer,
+        AZURE_OPENAI_PARAMS,
+        usage_breakdown,
+        deadline,
+        prefix_utterances=min_positive(LABEL_PREFIX_UTTERANCES, len(chunks[0])),
+        transcript_tokens=chunk_budget * len(chunks),
+    )
+
+    chunk_transcripts = [
+        chunk.render(speaker_labels, strip_labels=speaker_labels is None)
+        for chunk in chunks
+    ]
+    # Every chunk is scheduled on the budget it was cut to, rather than encoded again
+    summary_futures = [
+        submit_stage(
+            get_summary,
+            transcript,
+            SUMMARIZE_CALL,
+            AZURE_OPENAI_PARAMS,
+            deadline,
+            chunk_budget,
+        )
+        for transcript in chunk_transcripts
+    ]
+    ratings_futures = [
+        submit_stage(
+            get_ratings,
+            transcript,
+            EVALUATE_PARAMETERS,
+            AZURE_OPENAI_PARAMS,
+            deadline,
+            chunk_budget,
         )
+        for transcript in chunk_transcripts
+    ]
+
+    # One failed chunk fails the call, the queued chunk calls would only hold up other requests
+    futures = summary_futures + ratings_futures
+    done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+    failed = next((future for future in done if future.exception()), None)
+    if failed is not None:
+        for future in futures:
+            future.cancel()
+        failed.result()
+
+    partial_summaries, summary_usages = zip(
+        *(future.result() for future in summary_futures)
+    )
+    partial_ratings, ratings_usages = zip(
+        *(future.result() for future in ratings_futures)
+    )
+    usage_breakdown["summary_chunks"] = merge_usage(*summary_usages)
+    usage_breakdown["ratings_chunks"] = merge_usage(*ratings_usages)
+
+    # Reduce: one small LLM call merges the summaries, ratings are merged by rule
+    summary, usage_breakdown["summary_reduce"] = get_merged_summary(
+        [SummaryObject(**summary) for summary in partial_summaries],
+        SUMMARIZE_CALL,
+        AZURE_OPENAI_PARAMS,
+        deadline,
+    )
+    summaryObject = SummaryObject(**summary)
+    ratingsObject = merge_ratings(
+        [RatingsObject(**ratings) for ratings in partial_ratings]
+    )
+
+    writer.stage("summary", {"summary": summaryObject.dict()})
+    writer.stage("analysis", {"analysis": ratingsObject.dict()})
+    writer.stage("chunking", {"chunk_count": len(chunks)})
+
+    return diarizedTranscriptObject, summaryObject, ratingsObject
+
+
+def min_positive(limit, count):
+    """`count` capped by `limit`, where a limit of 0 means no cap"""
+
+    return min(limit, count) if limit > 0 else count
+
+
+def fused_analysis(
+    diarization,
+    raw_diarization,
+    writer,
+    AZURE_OPENAI_PARAMS,
+    usage_breakdown,
+    deadline,
+    transcript_tokens=None,
+):
+    """Label, summarize and rate the call in a single LLM request, or None if its answer is unusable"""
+
+    # The combined schema relies on exactly two speaker tags
+    if len(diarization.speakers()) != 2:
+        return None
+
+    arguments, usage_breakdown["fused"] = get_fused_analysis(
+        raw_diarization, ANALYZE_CALL, AZURE_OPENAI_PARAMS, deadline, transcript_tokens
+    )
+
+    try:
+        fused = json.loads(arguments)
+
+        labels = fused["speaker_labels"]
+        if not {labels["speaker_0"], labels["speaker_1"]} <= SPEAKER_ROLES:
+            raise ValueError("Unknown speaker role")
+
+        summaryObject = SummaryObject(**fused["summary"])
+        ratingsObject = RatingsObject(**fused["ratings"])
+
+    except (ValueError, KeyError, TypeError):
+        # pydantic's ValidationError and JSON decoding errors are ValueErrors
+        logger.warning("Fused analysis could not be parsed, falling back")
+        return None
+
+    transcript = diarization.render({0: labels["speaker_0"], 1: labels["speaker_1"]})
+    diarizedTranscriptObject = DiarizedTranscriptObject(diarized_transcript=transcript)
+
+    writer.stage("transcript", {"transcript": diarizedTranscriptObject.dict()})
+    writer.stage("summary", {"summary": summaryObject.dict()})
+    writer.stage("analysis", {"analysis": ratingsObject.dict()})
+
+    return diarizedTranscriptObject, summaryObject, ratingsObject
+
+
+def reuse_analysis(audio: AudioRequest, fingerprint: str, writer: AnalysisWriter):
+    """Copy the analysis of a byte-identical recording that was already processed"""
+
+    existing = collection.find_one(
+        {"audio_fingerprint": fingerprint, "logs.status": "SUCCESS"},
+        {"model_config": 1, "transcript": 1, "summary": 1, "analysis": 1},
+    )
+
+    if existing is None or not all(
+        key in existing for key in ("transcript", "summary", "analysis")
+    ):
+        return None
+
+    logger.info(
+        "Reusing the analysis of an identical recording",
+        extra={"fields": {"reused_from": str(existing["_id"])}},
+    )
+    ROUTING_DECISIONS.inc(model_config=existing.get("model_config"), mode="reused")
+
+    # No tokens were spent on this call, the original keeps its own usage
+    usageObject = UsageObject(**merge_usage())
+    reused = {
+        "audio_fingerprint": fingerprint,
+        "reused_from": existing["_id"],
+        "model_config": existing.get("model_config"),
+        "transcript": existing["transcript"],
+        "summary": existing["summary"],
+        "analysis": existing["analysis"],
+        "gpt35_usage": usageObject.dict(),
+    }
+    writer.stage("reused_from", reused)
+
+    return build_analysis_response(
+        {
+            **reused,
+            "mp3": audio.mp3_url,
+            "sales_lead_info": audio.sales_lead_info.dict(),
+        }
+    )
+
+
+def transcribe_call(audio: AudioRequest, writer: AnalysisWriter, deadline: Deadline):
+    """Diarize the call, or return the analysis of an identical recording as the second item
+
+    A rerun of a failed analysis takes the diarization from its checkpoint
+    instead of downloading and transcribing the MP3 again.
+    """
+
+    transcription_key = stage_key(audio.mp3_url, DEEPGRAM_API_BASE)
+    checkpoint = writer.completed("transcription", transcription_key)
+
+    if checkpoint is not None:
+        return Transcript.from_records(checkpoint["output"]["records"]), None
+
+    mp3_audio = convert_url(audio.mp3_url, deadline)
+
+    if AUDIO_DEDUPLICATION or transcript_cache.enabled:
+        # The fingerprint is needed before the upload, so the audio is buffered first
+        fingerprint = mp3_audio.spool().fingerprint
+
+    if AUDIO_DEDUPLICATION:
+        reused_analysis = reuse_analysis(audio, fingerprint, writer)
+
+        if reused_analysis is not None:
+            mp3_audio.close()
+            return None, reused_analysis
+
+    diarization = None
+
+    if transcript_cache.enabled:
+        diarization = transcript_cache.get(fingerprint, DEEPGRAM_API_BASE)
+
+    if diarization is None:
+        diarization = get_diarized_output(
+            mp3_audio, DEEPGRAM_TOKEN, DEEPGRAM_API_BASE, deadline
+        )
+
+        if transcript_cache.enabled:
+            transcript_cache.set(fingerprint, DEEPGRAM_API_BASE, diarization)
+    else:
+        logger.info("Reusing cached diarization")
+        mp3_audio.close()
+
+    writer.stage("audio_fingerprint", {"audio_fingerprint": mp3_audio.fingerprint})
+    writer.complete(
+        "transcription",
+        transcription_key,
+        {"fingerprint": mp3_audio.fingerprint, "records": diarization.to_records()},
+    )
+
+    return diarization, None
+
+
+def prepare_analysis(
+    audio: AudioRequest, writer: AnalysisWriter = None, deadline: Deadline = None
+) -> DetailedAudioResponse:
+    """This pipeline generates an end-to-end AI powered call analysis"""
+
+    if deadline is None:
+        deadline = Deadline(ANALYSIS_DEADLINE_SECONDS)
+
+    if writer is None:
+        writer = AnalysisWriter(mp3=audio.mp3_url)
+
+        try:
+            return prepare_analysis(audio, writer, deadline)
+        finally:
+            writer.flush()
+
+    mp3 = audio.mp3_url
+
+    try:
+        # Step 1: Get the Diarization & Transcript, unless it was already transcribed
+        diarization, reused_analysis = transcribe_call(audio, writer, deadline)
+
+        if reused_analysis is not None:
+            return reused_analysis
+
+        raw_diarization = diarization.render()
+
+        # Route on prompt + schema + expected completion of the staged stages, not the transcript alone
+        model_config, required_tokens, transcript_tokens = select_model_config(
+            raw_diarization
+        )
+        AZURE_OPENAI_PARAMS = AZURE_OPENAI_PARAMS_BY_MODEL[model_config]
+
+        writer.stage("model_config", {"model_config": model_config})
+
+        usage_breakdown = {}
+        analysis = None
+
+        if required_tokens > MODEL_CONTEXT_WINDOWS[model_config]:
+            # Even the largest context is too small for the whole transcript
+            analysis = chunked_analysis(
+                diarization, writer, AZURE_OPENAI_PARAMS, usage_breakdown, deadline
+            )
+            analysis_mode = "chunked"
+        elif ANALYSIS_MODE == "fused" and stage_fits(
+            "fused", transcript_tokens, model_config
+        ):
+            # The fused request is larger, it is only sent when it fits the staged model
+            analysis = fused_analysis(
+                diarization,
+                raw_diarization,
+                writer,
+                AZURE_OPENAI_PARAMS,
+                usage_breakdown,
+                deadline,
+                transcript_tokens,
+            )
+            analysis_mode = "fused" if analysis is not None else "fused_fallback"
+        else:
+            analysis_mode = "staged"
+
+        if analysis is None:
+            analysis = staged_analysis(
+                diarization,
+                raw_diarization,
+                writer,
+                AZURE_OPENAI_PARAMS,
+                usage_breakdown,
+                deadline,
+                transcript_tokens,
+            )
+
+        diarizedTranscriptObject, summaryObject, ratingsObject = analysis
+
+        ROUTING_DECISIONS.inc(model_config=model_config, mode=analysis_mode)
+
+        # Step 4: Analyze the API Calls' Usage
+        usage = merge_usage(*usage_breakdown.values())
         usageObject = UsageObject(**usage)
-        collection.update_one(
-            {"mp3": mp3},
+        writer.stage(
+            "gpt35_usage",
             {
-                "$set": {
-                    "gpt35_usage": usageObject.dict(),
-                }
+                "gpt35_usage": usageObject.dict(),
+                "analysis_mode": analysis_mode,
+                "usage_breakdown": usage_breakdown,
             },
         )
 
@@ -194,15 +621,167 @@ def prepare_analysis(audio: AudioRequest) -> DetailedAudioResponse:
         return DetailedAudioResponse(**analysis_object)
 
     except (
-        Timeout,
-        RateLimitError,
-        APIError,
-        ServiceUnavailableError,
-        AuthenticationError,
-        APIConnectionError,
-        InvalidRequestError,
+        openai_error.Timeout,
+        openai_error.RateLimitError,
+        openai_error.APIError,
+        openai_error.ServiceUnavailableError,
+        openai_error.AuthenticationError,
+        openai_error.APIConnectionError,
+        openai_error.InvalidRequestError,
     ) as e:
         raise HTTPException(
             status_code=HttpStatusCode.INTERNAL_SERVER_ERROR.value,
             detail=f"Failed to execute pipeline, {e.__class__}!\n{e._message}",
         )
+
+
+def run_analysis(
+    audio: AudioRequest,
+    document_id,
+    priority: int = PRIORITY_INTERACTIVE,
+    deadline: Deadline = None,
+    resume: bool = False,
+) -> DetailedAudioResponse:
+    """Run the pipeline for an inserted analysis document and record the outcome in its logs
+
+    With `resume`, stages an earlier run of the document checkpointed are skipped.
+    """
+
+    stage_checkpoints = load_stage_checkpoints(document_id) if resume else None
+    writer = AnalysisWriter(document_id=document_id, stage_checkpoints=stage_checkpoints)
+    document = {"timestamp": ObjectId(document_id).generation_time}
+    status = "FAILED"
+    started = time.perf_counter()
+
+    try:
+        with bind(mp3=audio.mp3_url, document_id=str(document_id)), ANALYSES_IN_FLIGHT.track():
+            # Calls of one MP3 share a fair-queueing tenant in the Azure OpenAI scheduler
+            with scheduling_scope(priority, audio.mp3_url):
+                processed_analysis = prepare_analysis(audio, writer, deadline)
+
+        status = "SUCCESS"
+        document["logs"] = {
+            "status": "SUCCESS",
+            "error_class": "",
+            "error_description": "",
+        }
+
+        return processed_analysis
+
+    except HTTPException as e:
+        document["sales_lead_info"] = audio.sales_lead_info.dict()
+        document["logs"] = {
+            "status": "FAILED",
+            "error_class": str(type(e).__name__),
+            "error_description": str(e.detail),
+        }
+        raise
+
+    finally:
+        # Stage outputs that were not checkpointed go out together with the logs,
+        # and duplicates waiting on the lease see the outcome with it
+        document["lease"] = None
+        writer.stage("logs", document)
+        writer.flush()
+
+        duration = time.perf_counter() - started
+        ANALYSIS_SECONDS.observe(duration, status=status)
+        logger.info(
+            "Analysis finished",
+            extra={
+                "fields": {
+                    "mp3": audio.mp3_url,
+                    "status": status,
+                    "duration_ms": round(duration * 1000, 1),
+                }
+            },
+        )
+
+
+def process_call(
+    audio: AudioRequest,
+    priority: int = PRIORITY_INTERACTIVE,
+    deadline: Deadline = None,
+    fields=None,
+):
+    """Analyze a call, or fetch the stored analysis if the MP3 was already submitted
+
+    Concurrent requests for one MP3 wait for a single run, coalesced in this
+    worker by the result cache and across workers by the lease on the document.
+    A stored analysis is only read and rebuilt for the requested response `fields`.
+    """
+
+    if deadline is None:
+        deadline = Deadline(ANALYSIS_DEADLINE_SECONDS)
+
+    cached_analysis = result_cache.get(audio.mp3_url)
+
+    if cached_analysis is not None:
+        return cached_analysis, True
+
+    # Requests for different fields do not share a flight, a partial response only suits its own fields
+    return result_cache.coalesce(
+        (audio.mp3_url, fields),
+        lambda: analyze_call(audio, priority, deadline, fields),
+        deadline,
+    )
+
+
+def analyze_call(audio: AudioRequest, priority: int, deadline: Deadline, fields=None):
+    try:
+        input_details = {
+            "mp3": audio.mp3_url,
+            "sales_lead_info": audio.sales_lead_info.dict(),
+            "lease": new_lease(deadline),
+        }
+        with MONGO_WRITE_SECONDS.time(operation="insert"):
+            inserted_object = collection.insert_one(input_details)
+
+    except DuplicateKeyError:
+        return await_analysis(audio, priority, deadline, fields)
+
+    processed_analysis = run_analysis(
+        audio, inserted_object.inserted_id, priority, deadline
+    )
+    result_cache.set(audio.mp3_url, processed_analysis)
+
+    return processed_analysis, False
+
+
+def await_analysis(
+    audio: AudioRequest, priority: int, deadline: Deadline, fields=None
+):
+    """Wait for the stored analysis of a duplicate MP3, taking it over if it failed or was abandoned"""
+
+    while True:
+        stored_analysis, document = result_cache.fetch(audio.mp3_url, fields)
+
+        if stored_analysis is not None:
+            return stored_analysis, True
+
+        if document is None:
+            # The document was removed since the insert collided
+            return analyze_call(audio, priority, deadline, fields)
+
+        status = (document.get("logs") or {}).get("status")
+
+        # Queued and running analyses hold a lease, which lapses if their worker went away
+        if status != "FAILED" and lease_active(document):
+            result_cache.count("lease", "waits")
+            deadline.check("the duplicate analysis finished")
+            time.sleep(min(RESULT_POLL_SECONDS, deadline.remaining()))
+            continue
+
+        if claim_lease(document, deadline):
+            result_cache.count("lease", "takeovers")
+            logger.info(
+                "Taking over a failed or abandoned analysis",
+                extra={"fields": {"mp3": audio.mp3_url, "status": status}},
+            )
+
+            processed_analysis = run_analysis(
+                audio, document["_id"], priority, deadline, resume=True
+            )
+            result_cache.set(audio.mp3_url, processed_analysis)
+
+            return processed_analysis, False
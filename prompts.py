@@ -140,6 +140,8 @@ diarization_speaker_1 = "Wheather [Speaker:1] is a salesperson/customer"
 
 summary_system_prompt = "You are an expert call analyst at Square Yards. You will be given a conversation between a customer and salesperson, your task is to generate a summary based on various parameters."
 
+summary_reduce_system_prompt = "You are an expert call analyst at Square Yards. A long conversation between a customer and salesperson was split into consecutive parts, and you will be given the summary of every part in order. Your task is to combine them into one summary of the whole conversation based on various parameters, removing repetitions and keeping the order of events."
+
 summary_title = "Give a short title for the sales call which explains the whole conversation."
 
 summary_discussion_points = "The key discussion points from the conversation between the salesperson and customer in the form of bullet points."
@@ -149,3 +151,13 @@ summary_customer_queries = "The queries raised by the customer regarding the pro
 summary_next_action_items = "Based on the conversation, what are the next action items for the salesperson in the form of bullet points."
 
 summary_meeting_request_attempt = "Based on the conversation, analyze if the salesperson tried to fix a meeting with the customer / asks the customer for a site visit or not. Start the short analysis by stating if the salesperson made an attempt for site visit / meeting request or not. Next, give some improvement suggestions as to how should the salesperson should have convinced the customer for a site visit or meeting by suggesting strategies of top sales people like Zig Ziglar, Grant Cardone and Tom Hopkins in the form of bullet points. In other words, you have give improvement suggestions to the salesperson by telling him how to handle similar customers and win them over for scheduling a personal meeting for a site visit"
+
+
+# Fused Analysis
+
+fused_system_prompt = f"""You are an expert call analyst at Square Yards. You will be given a diarization of a sales call with Speaker 0 and Speaker 1. In a single answer you have to:
+    1. speaker_labels: identify which speaker is the salesperson and which one is the customer.
+    2. summary: {summary_system_prompt}
+    3. ratings: {ratings_system_prompt}
+
+    Always refer to the speakers by their identified roles, never as Speaker 0 or Speaker 1.""".strip()
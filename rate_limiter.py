@@ -0,0 +1,323 @@
+import os
+import time
+import heapq
+import sqlite3
+import itertools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from metrics import LLM_QUEUE_SECONDS, LLM_IN_FLIGHT
+from config import (
+    AZURE_OPENAI_RPM_LIMIT,
+    AZURE_OPENAI_TPM_LIMIT,
+    AZURE_OPENAI_MAX_CONCURRENCY,
+    RATE_LIMIT_STORE,
+    RATE_LIMIT_STORE_PATH,
+    RATE_LIMIT_COOLDOWN_SECONDS,
+)
+
+
+# Lower values are scheduled first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_JOB = 1
+PRIORITY_BATCH = 2
+
+# (priority, tenant) of the analysis running in the current context
+scheduling_context = ContextVar(
+    "scheduling_context", default=(PRIORITY_INTERACTIVE, None)
+)
+
+# Longest a queued request sleeps before re-checking the buckets
+MAX_POLL_SECONDS = 0.5
+
+
+@contextmanager
+def scheduling_scope(priority: int, tenant: str = None):
+    """Schedule the Azure calls made inside the block with this priority and fairness tenant"""
+
+    token = scheduling_context.set((priority, tenant))
+
+    try:
+        yield
+    finally:
+        scheduling_context.reset(token)
+
+
+class MemoryBucketStore:
+    """Token buckets of a single process"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def try_acquire(self, requests, now=None):
+        """Take `amount` from every (key, amount, capacity, rate) bucket, or none of them; returns the seconds to wait"""
+
+        now = time.time() if now is None else now
+
+        with self.lock:
+            levels = {}
+            for key, amount, capacity, rate in requests:
+                tokens, updated = self.buckets.get(key, (capacity, now))
+                levels[key] = min(capacity, tokens + (now - updated) * rate)
+
+            wait = max(
+                (min(amount, capacity) - levels[key]) / rate
+                for key, amount, capacity, rate in requests
+            )
+
+            if wait <= 0:
+                for key, amount, capacity, _ in requests:
+                    levels[key] -= min(amount, capacity)
+
+            for key in levels:
+                self.buckets[key] = (levels[key], now)
+
+            return max(wait, 0)
+
+    def adjust(self, key, delta):
+        """Refund (positive) or charge (negative) a bucket after the fact"""
+
+        with self.lock:
+            if key in self.buckets:
+                tokens, updated = self.buckets[key]
+                self.buckets[key] = (tokens + delta, updated)
+
+
+class SQLiteBucketStore:
+    """Token buckets in a local SQLite file, shared by every worker process on the host"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        with self.transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def transaction(self):
+        connection = getattr(self.local, "connection", None)
+
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self.local.connection = connection
+
+        # IMMEDIATE takes the write lock up front so workers cannot interleave a refill
+        connection.execute("BEGIN IMMEDIATE")
+
+        try:
+            yield connection
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        else:
+            connection.execute("COMMIT")
+
+    def try_acquire(self, requests, now=None):
+        now = time.time() if now is None else now
+
+        with self.transaction() as connection:
+            levels = {}
+            for key, amount, capacity, rate in requests:
+                row = connection.execute(
+                    "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, updated = row if row else (capacity, now)
+                levels[key] = min(capacity, tokens + (now - updated) * rate)
+
+            wait = max(
+                (min(amount, capacity) - levels[key]) / rate
+                for key, amount, capacity, rate in requests
+            )
+
+            if wait <= 0:
+                for key, amount, capacity, _ in requests:
+                    levels[key] -= min(amount, capacity)
+
+            connection.executemany(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                [(key, level, now) for key, level in levels.items()],
+            )
+
+            return max(wait, 0)
+
+    def adjust(self, key, delta):
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE buckets SET tokens = tokens + ? WHERE key = ?", (delta, key)
+            )
+
+
+class DeploymentScheduler:
+    """Admits Azure OpenAI calls of one deployment within its RPM/TPM quota, by priority and fairly across tenants, with AIMD concurrency"""
+
+    def __init__(self, deployment, store, rpm_limit, tpm_limit, max_concurrency):
+        self.deployment = deployment
+        self.store = store
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.max_concurrency = max_concurrency
+
+        self.condition = threading.Condition()
+        self.queue = []
+        self.sequence = itertools.count()
+        self.virtual_time = 0.0
+        self.tenant_finish = {}
+        self.in_flight = 0
+        self.concurrency_limit = float(max_concurrency)
+        self.paused_until = 0.0
+        self.rate_limited = 0
+
+    def buckets(self, tokens):
+        return [
+            (f"{self.deployment}:rpm", 1, self.rpm_limit, self.rpm_limit / 60),
+            (f"{self.deployment}:tpm", tokens, self.tpm_limit, self.tpm_limit / 60),
+        ]
+
+    def acquire(self, tokens: int, deadline=None):
+        """Block until the call may be sent, or until the analysis runs out of time"""
+
+        priority, tenant = scheduling_context.get()
+        queued_at = time.perf_counter()
+
+        with self.condition:
+            # Weighted fair queueing: a tenant's calls queue behind its own earlier calls
+            start = max(self.virtual_time, self.tenant_finish.get(tenant, 0.0))
+            finish = start + tokens
+            self.tenant_finish[tenant] = finish
+
+            entry = (priority, finish, next(self.sequence))
+            heapq.heappush(self.queue, entry)
+
+            try:
+                while True:
+                    if deadline is not None:
+                        deadline.check(f"{self.deployment} admitted the request")
+
+                    now = time.time()
+                    wait = MAX_POLL_SECONDS
+
+                    if (
+                        self.queue[0] is entry
+                        and self.in_flight < int(self.concurrency_limit)
+                        and now >= self.paused_until
+                    ):
+                        wait = self.store.try_acquire(self.buckets(tokens), now)
+
+                        if wait <= 0:
+                            heapq.heappop(self.queue)
+                            self.in_flight += 1
+                            LLM_IN_FLIGHT.inc(deployment=self.deployment)
+                            LLM_QUEUE_SECONDS.observe(
+                                time.perf_counter() - queued_at,
+                                deployment=self.deployment,
+                            )
+                            self.virtual_time = max(self.virtual_time, start)
+                            self.forget_idle_tenants()
+                            self.condition.notify_all()
+                            return
+
+                    elif now < self.paused_until:
+                        wait = self.paused_until - now
+
+                    if deadline is not None:
+                        wait = min(wait, deadline.remaining())
+
+                    self.condition.wait(timeout=min(wait, MAX_POLL_SECONDS))
+
+            except BaseException:
+                if entry in self.queue:
+                    self.queue.remove(entry)
+                    heapq.heapify(self.queue)
+                self.condition.notify_all()
+                raise
+
+    def forget_idle_tenants(self):
+        if len(self.tenant_finish) > 1024:
+            self.tenant_finish = {
+                tenant: finish
+                for tenant, finish in self.tenant_finish.items()
+                if finish > self.virtual_time
+            }
+
+    def release(self, rate_limited: bool = False, retry_after: float = None):
+        """Finish a call, shrinking concurrency on a 429 and growing it slowly otherwise"""
+
+        with self.condition:
+            self.in_flight -= 1
+            LLM_IN_FLIGHT.dec(deployment=self.deployment)
+
+            if rate_limited:
+                self.rate_limited += 1
+                self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+                self.paused_until = time.time() + (
+                    retry_after or RATE_LIMIT_COOLDOWN_SECONDS
+                )
+            else:
+                self.concurrency_limit = min(
+                    float(self.max_concurrency),
+                    self.concurrency_limit + 1 / self.concurrency_limit,
+                )
+
+            self.condition.notify_all()
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """Correct the token bucket with the usage Azure actually reported"""
+
+        if estimated_tokens != actual_tokens:
+            self.store.adjust(
+                f"{self.deployment}:tpm", estimated_tokens - actual_tokens
+            )
+
+    def stats(self):
+        with self.condition:
+            return {
+                "in_flight": self.in_flight,
+                "queued": len(self.queue),
+                "concurrency_limit": round(self.concurrency_limit, 2),
+                "rate_limited": self.rate_limited,
+            }
+
+
+def build_bucket_store():
+    if RATE_LIMIT_STORE == "sqlite":
+        return SQLiteBucketStore(RATE_LIMIT_STORE_PATH)
+
+    return MemoryBucketStore()
+
+
+bucket_store = build_bucket_store()
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(deployment: str) -> DeploymentScheduler:
+    """Get the process-wide scheduler of an Azure OpenAI deployment"""
+
+    with _schedulers_lock:
+        scheduler = _schedulers.get(deployment)
+
+        if scheduler is None:
+            scheduler = DeploymentScheduler(
+                deployment,
+                bucket_store,
+                AZURE_OPENAI_RPM_LIMIT,
+                AZURE_OPENAI_TPM_LIMIT,
+                AZURE_OPENAI_MAX_CONCURRENCY,
+            )
+            _schedulers[deployment] = scheduler
+
+        return scheduler
+
+
+def scheduler_stats():
+    with _schedulers_lock:
+        schedulers = list(_schedulers.items())
+
+    return {deployment: scheduler.stats() for deployment, scheduler in schedulers}
@@ -0,0 +1,80 @@
+from typing import Optional
+
+from bson import ObjectId
+from pymongo.read_concern import ReadConcern
+
+from config import MONGODB_URI, MONGO_READ_CONCERN
+from mongodb import client_options, analysis_write_concern
+from models import AudioRequest
+from metrics import MONGO_WRITE_SECONDS
+from startup import Lazy, lazy_import
+
+
+motor_asyncio = lazy_import("motor.motor_asyncio")
+
+QUEUED_LOG = {"status": "QUEUED", "error_class": "", "error_description": ""}
+
+# Bound to the event loop that first uses it, the one uvicorn serves on
+async_client = Lazy(
+    lambda: motor_asyncio.AsyncIOMotorClient(MONGODB_URI, **client_options("async")),
+    "mongo async client",
+)
+
+
+class AnalysisRepository:
+    """Async access to the detailed_analysis collection, for endpoints that await storage on the event loop"""
+
+    def __init__(self, client):
+        self.collection = Lazy(
+            lambda: client.get_default_database().get_collection(
+                "detailed_analysis",
+                write_concern=analysis_write_concern,
+                read_concern=ReadConcern(MONGO_READ_CONCERN),
+            )
+        )
+
+    async def create_job(self, audio: AudioRequest, lease: dict) -> ObjectId:
+        """Insert the analysis document of a queued job, raising DuplicateKeyError if the MP3 was already submitted"""
+
+        document = {
+            "mp3": audio.mp3_url,
+            "sales_lead_info": audio.sales_lead_info.dict(),
+            "logs": QUEUED_LOG,
+            "lease": lease,
+        }
+
+        with MONGO_WRITE_SECONDS.time(operation="insert"):
+            result = await self.collection.insert_one(document)
+
+        return result.inserted_id
+
+    async def requeue_job(self, document: dict, lease: dict) -> bool:
+        """Queue a failed or abandoned analysis again, False if it succeeded or another worker claimed it first"""
+
+        # Matching the lease that was read makes the claim a compare-and-swap, as in claim_lease
+        with MONGO_WRITE_SECONDS.time(operation="job_status"):
+            result = await self.collection.update_one(
+                {
+                    "_id": document["_id"],
+                    "lease": document.get("lease"),
+                    "logs.status": {"$ne": "SUCCESS"},
+                },
+                {"$set": {"logs": QUEUED_LOG, "lease": lease}},
+            )
+
+        return result.modified_count == 1
+
+    async def fetch_result(
+        self,
+        document_id: ObjectId = None,
+        mp3: str = None,
+        projection: dict = None,
+    ) -> Optional[dict]:
+        """The analysis document of a job or an MP3, reduced to the projected fields"""
+
+        query = {"_id": document_id} if document_id is not None else {"mp3": mp3}
+
+        return await self.collection.find_one(query, projection)
+
+
+analysis_repository = AnalysisRepository(async_client)
@@ -0,0 +1,276 @@
+import math
+import time
+import threading
+from collections import deque
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from fastapi import HTTPException
+
+from config import (
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_SECONDS,
+    HEDGE_QUANTILE,
+    HEDGE_MIN_DELAY_SECONDS,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+)
+from enums import HttpStatusCode
+from metrics import UPSTREAM_FAILURES
+
+
+# Recent successful call latencies kept per upstream to place the hedge
+LATENCY_WINDOW = 200
+# Latencies needed before hedging starts, the quantile is noise below that
+MIN_HEDGE_SAMPLES = 20
+
+hedge_executor = ThreadPoolExecutor(thread_name_prefix="hedged-call")
+
+
+class Deadline:
+    """Time budget of one analysis, from which every outbound call derives its timeout"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, step: str):
+        """Fail the analysis if no time is left for `step`"""
+
+        if self.expired:
+            raise HTTPException(
+                status_code=HttpStatusCode.GATEWAY_TIMEOUT.value,
+                detail=f"The analysis exceeded its {self.seconds:g}s deadline before {step}!",
+            )
+
+    def timeout(self, step: str, cap: float) -> float:
+        """Seconds `step` may take: the time left, capped by the step's own limit"""
+
+        self.check(step)
+
+        return min(cap, self.remaining())
+
+    def requests_timeout(self, step: str):
+        """(connect, read) timeout for a requests call made during `step`"""
+
+        return (
+            self.timeout(step, HTTP_CONNECT_TIMEOUT),
+            self.timeout(step, HTTP_READ_TIMEOUT),
+        )
+
+
+# Default for callers outside a request, only the per-call caps apply
+NO_DEADLINE = Deadline(math.inf)
+
+
+class CircuitBreaker:
+    """Fails fast once an upstream keeps failing, letting a single probe through after a cool-down"""
+
+    def __init__(self, name, failure_threshold, reset_seconds):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_seconds:
+                    self.rejected += 1
+                    return False
+
+                self.state = "half_open"
+                self.probing = False
+
+            if self.state == "half_open":
+                if self.probing:
+                    self.rejected += 1
+                    return False
+
+                self.probing = True
+
+            return True
+
+    def before_call(self):
+        if not self.allow():
+            UPSTREAM_FAILURES.inc(upstream=self.name, reason="circuit_open")
+            raise HTTPException(
+                status_code=HttpStatusCode.SERVICE_UNAVAILABLE.value,
+                detail=f"The {self.name} upstream is currently failing, please try again later!",
+            )
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        UPSTREAM_FAILURES.inc(upstream=self.name, reason="failure")
+
+        with self.lock:
+            self.failures += 1
+
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def stats(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "rejected": self.rejected,
+            }
+
+
+class Upstream:
+    """An external dependency: its circuit breaker, recent latencies and hedging of slow idempotent calls"""
+
+    def __init__(self, name):
+        self.name = name
+        self.breaker = CircuitBreaker(
+            name, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS
+        )
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+        self.hedges = 0
+
+    def hedge_delay(self):
+        """Latency past which a call counts as a tail outlier, None until enough calls were seen"""
+
+        with self.lock:
+            latencies = sorted(self.latencies)
+
+        if len(latencies) < MIN_HEDGE_SAMPLES:
+            return None
+
+        index = min(len(latencies) - 1, int(HEDGE_QUANTILE * len(latencies)))
+
+        return max(HEDGE_MIN_DELAY_SECONDS, latencies[index])
+
+    def timed(self, function):
+        def run():
+            start = time.monotonic()
+            result = function()
+
+            with self.lock:
+                self.latencies.append(time.monotonic() - start)
+
+            return result
+
+        return run
+
+    def call(self, function, deadline=NO_DEADLINE, hedge=False, unhealthy=None, discard=None):
+        """Call the upstream through its circuit breaker, hedging if asked to
+
+        `unhealthy(result, error)` tells whether the outcome counts against the upstream's
+        health, and `discard(result)` releases the result of a hedge that lost the race.
+        """
+
+        self.breaker.before_call()
+
+        try:
+            if hedge:
+                result = self.hedged(function, deadline, discard)
+            else:
+                result = self.timed(function)()
+        except Exception as error:
+            if unhealthy is None or unhealthy(None, error):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+
+        if unhealthy is not None and unhealthy(result, None):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+        return result
+
+    def hedged(self, function, deadline, discard):
+        """Start a second copy of the call once the first is slower than usual; the first success wins"""
+
+        delay = self.hedge_delay()
+        primary = hedge_executor.submit(copy_context().run, self.timed(function))
+
+        if delay is None or delay >= deadline.remaining():
+            return primary.result()
+
+        if wait([primary], timeout=delay).done:
+            return primary.result()
+
+        with self.lock:
+            self.hedges += 1
+
+        pending = {primary, hedge_executor.submit(copy_context().run, self.timed(function))}
+        error = None
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+
+                if discard is not None:
+                    for loser in pending | (done - {future}):
+                        loser.add_done_callback(
+                            lambda loser: loser.exception() is None
+                            and discard(loser.result())
+                        )
+
+                return future.result()
+
+        raise error
+
+    def stats(self):
+        delay = self.hedge_delay()
+
+        with self.lock:
+            hedges = self.hedges
+
+        return {
+            **self.breaker.stats(),
+            "hedge_delay": round(delay, 3) if delay is not None else None,
+            "hedges": hedges,
+        }
+
+
+_upstreams = {}
+_upstreams_lock = threading.Lock()
+
+
+def get_upstream(name: str) -> Upstream:
+    """Get the process-wide health tracker of an upstream, creating it on first use"""
+
+    with _upstreams_lock:
+        upstream = _upstreams.get(name)
+
+        if upstream is None:
+            upstream = Upstream(name)
+            _upstreams[name] = upstream
+
+        return upstream
+
+
+def upstream_stats():
+    with _upstreams_lock:
+        upstreams = list(_upstreams.items())
+
+    return {name: upstream.stats() for name, upstream in upstreams}
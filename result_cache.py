@@ -0,0 +1,188 @@
+import os
+import socket
+import threading
+from uuid import uuid4
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import orjson
+
+from config import RESULT_CACHE_MAX_BYTES, RESULT_LEASE_GRACE_SECONDS
+from mongodb import collection
+from metrics import CACHE_REQUESTS
+from persistence import build_analysis_response, response_projection
+
+
+def result_projection(fields=None) -> dict:
+    """The document fields the requested response fields are rebuilt from, plus the status and lease of the run"""
+
+    return {**response_projection(fields), "logs.status": 1, "lease": 1}
+
+
+# Written on the leases this worker holds, to tell who is running an analysis
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def new_lease(deadline) -> dict:
+    """Claim on an analysis document, held until the analysis' deadline plus a grace period"""
+
+    return {
+        "owner": WORKER_ID,
+        "token": uuid4().hex,
+        "expires_at": datetime.utcnow()
+        + timedelta(seconds=deadline.remaining() + RESULT_LEASE_GRACE_SECONDS),
+    }
+
+
+def lease_active(document: dict) -> bool:
+    lease = document.get("lease")
+
+    return lease is not None and lease["expires_at"] > datetime.utcnow()
+
+
+def claim_lease(document: dict, deadline) -> bool:
+    """Take over the document of a failed or abandoned analysis, False if another worker got there first"""
+
+    # Matching the lease that was read makes the takeover a compare-and-swap
+    result = collection.update_one(
+        {
+            "_id": document["_id"],
+            "lease": document.get("lease"),
+            "logs.status": {"$ne": "SUCCESS"},
+        },
+        {"$set": {"lease": new_lease(deadline)}, "$unset": {"logs": ""}},
+    )
+
+    return result.modified_count == 1
+
+
+class Flight:
+    """An analysis running in this worker that duplicate requests wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResultCache:
+    """Finished analyses by MP3: an in-process LRU in front of a projected Mongo lookup, with concurrent duplicates coalesced onto one run"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        # mp3: (response, serialised size), transcripts make sizes vary by orders of magnitude
+        self.entries = OrderedDict()
+        self.size = 0
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.counters = {
+            "memory": {"hits": 0, "misses": 0},
+            "mongo": {"hits": 0, "misses": 0},
+            "flight": {"coalesced": 0},
+            "lease": {"waits": 0, "takeovers": 0},
+        }
+
+    def count(self, scope, counter):
+        CACHE_REQUESTS.inc(cache="result", scope=scope, result=counter)
+
+        with self.lock:
+            self.counters[scope][counter] += 1
+
+    def get(self, mp3: str):
+        with self.lock:
+            entry = self.entries.get(mp3)
+            response = None
+
+            if entry is not None:
+                response = entry[0]
+                self.entries.move_to_end(mp3)
+
+        self.count("memory", "hits" if response is not None else "misses")
+
+        return response
+
+    def set(self, mp3: str, response):
+        """Keep a successful analysis, which never changes once stored"""
+
+        size = len(orjson.dumps(response.dict()))
+
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            previous = self.entries.pop(mp3, None)
+            if previous is not None:
+                self.size -= previous[1]
+
+            self.entries[mp3] = (response, size)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def fetch(self, mp3: str, fields=None):
+        """Read the stored analysis document, returning it with its response if the analysis succeeded
+
+        Only the requested `fields` are read and rebuilt, such partial responses are not cached.
+        """
+
+        document = collection.find_one({"mp3": mp3}, result_projection(fields))
+
+        if document is None or (document.get("logs") or {}).get("status") != "SUCCESS":
+            self.count("mongo", "misses")
+            return None, document
+
+        self.count("mongo", "hits")
+        response = build_analysis_response(document, fields)
+
+        if fields is None:
+            self.set(mp3, response)
+
+        return response, document
+
+    def coalesce(self, key, function, deadline):
+        """Call `function` once for concurrent requests of a key, the others get its result as a duplicate"""
+
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+
+            if leader:
+                flight = self.flights[key] = Flight()
+
+        if not leader:
+            self.count("flight", "coalesced")
+
+            while not flight.done.wait(deadline.remaining()):
+                deadline.check("the duplicate analysis finished")
+
+            if flight.error is not None:
+                raise flight.error
+
+            response, _ = flight.result
+            return response, True
+
+        try:
+            flight.result = function()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+
+            flight.done.set()
+
+    def stats(self):
+        with self.lock:
+            return {
+                **{scope: dict(counters) for scope, counters in self.counters.items()},
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "in_flight": len(self.flights),
+            }
+
+
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES)
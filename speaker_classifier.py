@@ -0,0 +1,108 @@
+import re
+import math
+
+from config import LOCAL_LABEL_UTTERANCES
+from utterances import Transcript
+
+
+SALESPERSON_KEYWORDS = (
+    "square yards",
+    "squareyards",
+    "square yard",
+    "property",
+    "project",
+    "builder",
+    "site visit",
+    "bhk",
+    "possession",
+    "enquiry",
+    "inquiry",
+    "requirement",
+    "budget",
+    "sir",
+    "ma'am",
+    "madam",
+)
+
+INTRODUCTION_PHRASES = (
+    "calling from",
+    "speaking from",
+    "this is",
+    "my name is",
+    "i am calling",
+    "i'm calling",
+    "from square yards",
+)
+
+CUSTOMER_PHRASES = (
+    "who is this",
+    "who's this",
+    "who is speaking",
+    "yes tell me",
+    "tell me",
+    "i am looking",
+    "i'm looking",
+    "my budget",
+    "not interested",
+)
+
+KEYWORD_WEIGHT = 1.0
+INTRODUCTION_WEIGHT = 3.0
+# Introductions count for more in the opening utterances of the call
+OPENING_UTTERANCES = 4
+OPENING_BOOST = 2.0
+CUSTOMER_PHRASE_WEIGHT = 1.5
+TALK_RATIO_WEIGHT = 2.0
+# Score margin that maps to a confidence of about 0.73, larger margins saturate towards 1
+CONFIDENCE_SCALE = 2.0
+
+
+def phrase_patterns(phrases):
+    """Match each phrase on word boundaries only, so "sir" does not count inside "desire" """
+
+    return tuple(re.compile(rf"\b{re.escape(phrase)}\b") for phrase in phrases)
+
+
+SALESPERSON_PATTERNS = phrase_patterns(SALESPERSON_KEYWORDS)
+INTRODUCTION_PATTERNS = phrase_patterns(INTRODUCTION_PHRASES)
+CUSTOMER_PATTERNS = phrase_patterns(CUSTOMER_PHRASES)
+
+
+def phrase_hits(text: str, patterns) -> int:
+    return sum(len(pattern.findall(text)) for pattern in patterns)
+
+
+def classify_speakers(transcript: Transcript, utterance_limit: int = LOCAL_LABEL_UTTERANCES):
+    """Guess which speaker is the salesperson from the opening utterances, with a confidence in [0.5, 1]"""
+
+    if transcript.speakers() != {0, 1}:
+        return None, 0.0
+
+    scores = {0: 0.0, 1: 0.0}
+    words = {0: 0, 1: 0}
+
+    for position, utterance in enumerate(transcript.utterances[:utterance_limit]):
+        text = utterance.text.lower()
+        boost = OPENING_BOOST if position < OPENING_UTTERANCES else 1.0
+
+        words[utterance.speaker] += len(text.split())
+        scores[utterance.speaker] += (
+            KEYWORD_WEIGHT * phrase_hits(text, SALESPERSON_PATTERNS)
+            + INTRODUCTION_WEIGHT * boost * phrase_hits(text, INTRODUCTION_PATTERNS)
+            - CUSTOMER_PHRASE_WEIGHT * phrase_hits(text, CUSTOMER_PATTERNS)
+        )
+
+    # Salespeople usually do most of the talking
+    total_words = words[0] + words[1]
+    if total_words:
+        scores[0] += TALK_RATIO_WEIGHT * (words[0] - words[1]) / total_words
+
+    margin = scores[0] - scores[1]
+    confidence = 1 / (1 + math.exp(-abs(margin) / CONFIDENCE_SCALE))
+
+    if margin >= 0:
+        labels = {"speaker_0": "salesperson: ", "speaker_1": "customer: "}
+    else:
+        labels = {"speaker_0": "customer: ", "speaker_1": "salesperson: "}
+
+    return labels, confidence
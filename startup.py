@@ -0,0 +1,112 @@
+import time
+import importlib
+import threading
+from contextlib import contextmanager
+
+from logs import get_logger
+
+
+logger = get_logger("startup")
+
+# The clock starts when the app's first module imports this one
+started = time.perf_counter()
+
+_timings = {}
+_timings_lock = threading.Lock()
+
+_warm_up_hooks = []
+_warmed_up = threading.Event()
+
+
+@contextmanager
+def timed(step: str):
+    """Record how long a startup step took, for the startup report"""
+
+    step_started = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        with _timings_lock:
+            _timings[step] = time.perf_counter() - step_started
+
+
+class Lazy:
+    """Stands in for an object that is only built on first use, e.g. a heavy module or a database client"""
+
+    def __init__(self, factory, step: str = None):
+        self._factory = factory
+        self._step = step
+        self._target = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    if self._step is None:
+                        self._target = self._factory()
+                    else:
+                        with timed(self._step):
+                            self._target = self._factory()
+
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __getitem__(self, key):
+        return self.resolve()[key]
+
+
+def lazy_import(name: str) -> Lazy:
+    """A module imported on first attribute access rather than when the app boots"""
+
+    return Lazy(lambda: importlib.import_module(name), f"import {name}")
+
+
+def warm_up_hook(function):
+    """Register a function that front-loads a first-use cost, run by warm_up"""
+
+    _warm_up_hooks.append(function)
+
+    return function
+
+
+def warm_up():
+    """Pay every deferred first-use cost now, so the first request does not"""
+
+    for hook in _warm_up_hooks:
+        try:
+            with timed(f"warm_up {hook.__module__}.{hook.__name__}"):
+                hook()
+        except Exception:
+            logger.warning(
+                "Warm-up hook failed",
+                exc_info=True,
+                extra={"fields": {"hook": f"{hook.__module__}.{hook.__name__}"}},
+            )
+
+    _warmed_up.set()
+    logger.info("Warm-up finished", extra={"fields": startup_report()})
+
+
+def startup_report() -> dict:
+    """How long booting took, and each import, client and warm-up step deferred from it"""
+
+    with _timings_lock:
+        steps = {step: round(seconds, 4) for step, seconds in _timings.items()}
+
+    return {
+        "boot_seconds": steps.get("boot"),
+        "uptime_seconds": round(time.perf_counter() - started, 3),
+        "warmed_up": _warmed_up.is_set(),
+        "steps": steps,
+    }
+
+
+def mark_booted():
+    """Record the time from the first import to the app being ready to serve"""
+
+    with _timings_lock:
+        _timings["boot"] = time.perf_counter() - started
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+import tiktoken
+
+import token_budget
+from config import TIKTOKEN_ENCODING_FILE
+
+
+# Words the stand-in encoding merges into single tokens, so text encodes to fewer tokens than bytes
+MERGED_WORDS = (" sir", " the", " call", " site", " visit", " budget", " lakhs", "Speaker")
+
+
+def stand_in_encoding():
+    """A small BPE with cl100k_base's split pattern, for when the bundled ranks are not fetched"""
+
+    ranks = {bytes([byte]): byte for byte in range(256)}
+
+    for word in MERGED_WORDS:
+        for end in range(2, len(word) + 1):
+            ranks.setdefault(word[:end].encode(), len(ranks))
+
+    return tiktoken.Encoding(
+        name="stand_in_cl100k_base",
+        pat_str=token_budget.CL100K_BASE_PATTERN,
+        mergeable_ranks=ranks,
+        special_tokens={},
+    )
+
+
+@pytest.fixture
+def encoding(monkeypatch):
+    """The encoding token_budget counts with: the bundled cl100k_base if fetched, a stand-in otherwise"""
+
+    if os.path.exists(TIKTOKEN_ENCODING_FILE):
+        encoding = token_budget.load_bundled_encoding(TIKTOKEN_ENCODING_FILE)
+    else:
+        encoding = stand_in_encoding()
+
+    monkeypatch.setattr(token_budget, "get_encoding", lambda model=None: encoding)
+    token_budget.stage_overhead.cache_clear()
+
+    yield encoding
+
+    token_budget.stage_overhead.cache_clear()
@@ -0,0 +1,40 @@
+import requests
+
+from config import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, OPENAI_REQUEST_TIMEOUT
+from helper import http_upstream_failed, openai_error, openai_upstream_failed
+
+
+FULL_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+# Cut short by the deadline of an analysis that is almost out of time
+SHORT_TIMEOUT = (HTTP_CONNECT_TIMEOUT / 10, HTTP_READ_TIMEOUT / 10)
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def test_http_timeout_counts_only_with_its_full_cap():
+    assert http_upstream_failed(FULL_TIMEOUT)(None, requests.ReadTimeout())
+    assert not http_upstream_failed(SHORT_TIMEOUT)(None, requests.ReadTimeout())
+    assert http_upstream_failed(FULL_TIMEOUT)(None, requests.ConnectTimeout())
+    assert not http_upstream_failed(SHORT_TIMEOUT)(None, requests.ConnectTimeout())
+
+
+def test_http_connection_errors_and_5xx_count():
+    assert http_upstream_failed(SHORT_TIMEOUT)(None, requests.ConnectionError())
+    assert http_upstream_failed(FULL_TIMEOUT)(Response(503), None)
+    assert not http_upstream_failed(FULL_TIMEOUT)(Response(404), None)
+
+
+def test_openai_timeout_counts_only_with_its_full_cap():
+    timeout = openai_error.Timeout("timed out")
+
+    assert openai_upstream_failed(OPENAI_REQUEST_TIMEOUT)(None, timeout)
+    assert not openai_upstream_failed(OPENAI_REQUEST_TIMEOUT / 10)(None, timeout)
+    assert openai_upstream_failed(OPENAI_REQUEST_TIMEOUT / 10)(
+        None, openai_error.ServiceUnavailableError("down")
+    )
+    assert not openai_upstream_failed(OPENAI_REQUEST_TIMEOUT)(
+        None, openai_error.InvalidRequestError("bad", None)
+    )
@@ -0,0 +1,177 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+import jobs
+from models import AudioRequest, CallMetadata
+from repository import AnalysisRepository
+
+
+class AsyncCollection:
+    """Awaitable front for a mongomock collection, standing in for motor"""
+
+    def __init__(self, collection):
+        self.sync = collection
+
+    async def insert_one(self, document):
+        return self.sync.insert_one(document)
+
+    async def update_one(self, query, update):
+        return self.sync.update_one(query, update)
+
+    async def find_one(self, query, projection=None):
+        return self.sync.find_one(query, projection)
+
+
+class RecordingExecutor:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, function, *args):
+        self.submitted.append(args)
+
+
+def lease(seconds):
+    return {
+        "owner": "other-worker",
+        "token": "token",
+        "expires_at": datetime.utcnow() + timedelta(seconds=seconds),
+    }
+
+
+def audio(mp3="a.mp3"):
+    return AudioRequest(
+        mp3_url=mp3, sales_lead_info=CallMetadata(lead_id=1, salesperson_name="Asha")
+    )
+
+
+@pytest.fixture
+def collection():
+    mongomock = pytest.importorskip("mongomock")
+    collection = mongomock.MongoClient().db.detailed_analysis
+    collection.create_index("mp3", unique=True)
+
+    return collection
+
+
+@pytest.fixture
+def repository(monkeypatch, collection):
+    repository = AnalysisRepository(None)
+    repository.collection = AsyncCollection(collection)
+    monkeypatch.setattr(jobs, "analysis_repository", repository)
+
+    return repository
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    executor = RecordingExecutor()
+    monkeypatch.setattr(jobs, "job_executor", executor)
+
+    return executor
+
+
+@pytest.fixture
+def slots(monkeypatch):
+    slots = threading.BoundedSemaphore(2)
+    monkeypatch.setattr(jobs, "job_slots", slots)
+
+    return slots
+
+
+def free_slots(slots):
+    return slots._value
+
+
+def submit(mp3="a.mp3"):
+    return asyncio.run(jobs.submit_job(audio(mp3)))
+
+
+def test_queues_a_new_job(repository, executor, slots):
+    status = submit()
+
+    assert status.status == "QUEUED"
+    assert len(executor.submitted) == 1
+    # The worker owns the permit now
+    assert free_slots(slots) == 1
+
+
+def test_duplicate_of_a_running_job_returns_its_status(collection, repository, executor, slots):
+    collection.insert_one({"mp3": "a.mp3", "logs": {"status": "RUNNING"}, "lease": lease(60)})
+
+    assert submit().status == "RUNNING"
+    assert executor.submitted == []
+    assert free_slots(slots) == 2
+
+
+def test_duplicate_of_a_finished_job_is_not_run_again(collection, repository, executor, slots):
+    collection.insert_one({"mp3": "a.mp3", "logs": {"status": "SUCCESS"}, "lease": None})
+
+    assert submit().status == "SUCCESS"
+    assert executor.submitted == []
+    assert free_slots(slots) == 2
+
+
+@pytest.mark.parametrize(
+    "logs, held",
+    [({"status": "FAILED"}, lease(60)), ({"status": "RUNNING"}, lease(-1))],
+)
+def test_failed_or_abandoned_job_is_requeued_and_resumed(
+    collection, repository, executor, slots, logs, held
+):
+    document_id = collection.insert_one({"mp3": "a.mp3", "logs": logs, "lease": held}).inserted_id
+
+    assert submit().status == "QUEUED"
+
+    (_, queued_id, queued_lease, resume), = executor.submitted
+    assert queued_id == document_id
+    assert resume
+
+    document = collection.find_one({"_id": document_id})
+    assert document["logs"]["status"] == "QUEUED"
+    assert document["lease"]["token"] == queued_lease["token"]
+    assert free_slots(slots) == 1
+
+
+def test_job_deleted_after_the_duplicate_insert_is_created_again(
+    collection, repository, executor, slots, monkeypatch
+):
+    collection.insert_one({"mp3": "a.mp3", "logs": {"status": "FAILED"}})
+    fetch_result = repository.fetch_result
+
+    async def deleted_before_fetch(**kwargs):
+        collection.delete_many({})
+        return await fetch_result(**kwargs)
+
+    monkeypatch.setattr(repository, "fetch_result", deleted_before_fetch)
+
+    assert submit().status == "QUEUED"
+    (_, _, _, resume), = executor.submitted
+    assert not resume
+    assert collection.count_documents({}) == 1
+
+
+def test_storage_errors_give_the_slot_back(collection, repository, executor, slots, monkeypatch):
+    collection.insert_one({"mp3": "a.mp3", "logs": {"status": "FAILED"}})
+
+    async def unavailable(*args, **kwargs):
+        raise AutoReconnect("primary stepped down")
+
+    monkeypatch.setattr(repository, "requeue_job", unavailable)
+    for _ in range(3):
+        with pytest.raises(AutoReconnect):
+            submit()
+
+    monkeypatch.setattr(repository, "fetch_result", unavailable)
+    with pytest.raises(AutoReconnect):
+        submit()
+
+    monkeypatch.setattr(repository, "create_job", unavailable)
+    with pytest.raises(AutoReconnect):
+        submit("b.mp3")
+
+    assert executor.submitted == []
+    assert free_slots(slots) == 2
@@ -0,0 +1,74 @@
+from map_reduce import BUDGET_NOT_DISCLOSED, merge_ratings
+from models import RatingsObject
+
+
+def ratings(**fields):
+    return RatingsObject(**fields)
+
+
+def test_opening_and_closing_ratings_come_from_the_first_and_last_chunk():
+    merged = merge_ratings(
+        [
+            ratings(salesperson_company_introduction=4, customer_sentiment_by_the_end_of_call=1),
+            ratings(salesperson_company_introduction=1, customer_sentiment_by_the_end_of_call=2),
+            ratings(salesperson_company_introduction=2, customer_sentiment_by_the_end_of_call=5),
+        ]
+    )
+
+    assert merged.salesperson_company_introduction == 4
+    assert merged.customer_sentiment_by_the_end_of_call == 5
+
+
+def test_best_worst_and_average_ratings():
+    merged = merge_ratings(
+        [
+            ratings(meeting_request=1, rudeness_or_politeness_metric=5, customer_eagerness_to_buy=2),
+            ratings(meeting_request=3, rudeness_or_politeness_metric=2, customer_eagerness_to_buy=3),
+            ratings(meeting_request=2, rudeness_or_politeness_metric=4, customer_eagerness_to_buy=5),
+        ]
+    )
+
+    assert merged.meeting_request == 3
+    assert merged.rudeness_or_politeness_metric == 2
+    assert merged.customer_eagerness_to_buy == 3
+
+
+def test_missing_ratings_are_skipped():
+    merged = merge_ratings(
+        [
+            ratings(salesperson_company_introduction=None, salesperson_convincing_abilities=4),
+            ratings(salesperson_company_introduction=3, salesperson_convincing_abilities=None),
+            ratings(),
+        ]
+    )
+
+    assert merged.salesperson_company_introduction == 3
+    assert merged.salesperson_convincing_abilities == 4
+    assert merged.meeting_request is None
+
+
+def test_latest_disclosed_budget_wins():
+    merged = merge_ratings(
+        [
+            ratings(customer_budget="60 lakhs"),
+            ratings(customer_budget="80 lakhs"),
+            ratings(customer_budget=BUDGET_NOT_DISCLOSED),
+        ]
+    )
+
+    assert merged.customer_budget == "80 lakhs"
+    assert merge_ratings([ratings(), ratings()]).customer_budget == BUDGET_NOT_DISCLOSED
+
+
+def test_preferences_are_joined_without_duplicates():
+    merged = merge_ratings(
+        [
+            ratings(customer_preferences="2BHK"),
+            ratings(customer_preferences=" "),
+            ratings(customer_preferences="2BHK"),
+            ratings(customer_preferences="Near the metro"),
+        ]
+    )
+
+    assert merged.customer_preferences == "2BHK\nNear the metro"
+    assert merge_ratings([ratings()]).customer_preferences is None
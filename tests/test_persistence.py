@@ -0,0 +1,218 @@
+import pytest
+from fastapi import HTTPException
+
+import persistence
+import pipelines
+from enums import HttpStatusCode
+from models import AudioRequest, CallMetadata
+from persistence import AnalysisWriter, load_stage_checkpoints, stage_key
+from utterances import Transcript, Utterance
+
+
+USAGE = {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+
+DIARIZATION = Transcript(
+    [
+        Utterance(0, "Hello sir, I am calling from the site office.", 0.0, 2.0),
+        Utterance(1, "Yes, tell me.", 2.0, 3.0),
+        Utterance(0, "Can we schedule a site visit this weekend?", 3.0, 5.0),
+        Utterance(1, "Sunday works, my budget is eighty lakhs.", 5.0, 7.0),
+    ]
+)
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    mongomock = pytest.importorskip("mongomock")
+    collection = mongomock.MongoClient().db.detailed_analysis
+    monkeypatch.setattr(persistence, "analysis_writes", collection)
+
+    return collection
+
+
+@pytest.fixture
+def document_id(collection):
+    return collection.insert_one({"mp3": "a.mp3"}).inserted_id
+
+
+def checkpoint(key, output, usage=None):
+    return {"key": key, "output": output, "usage": usage}
+
+
+def test_run_stage_computes_and_checkpoints(collection, document_id):
+    writer = AnalysisWriter(document_id=document_id, checkpoint_stages=["summary"])
+
+    assert writer.run_stage("summary", "key", lambda: ({"title": "t"}, USAGE)) == (
+        {"title": "t"},
+        USAGE,
+    )
+
+    stored = load_stage_checkpoints(document_id)["summary"]
+    assert stored["key"] == "key"
+    assert stored["output"] == {"title": "t"}
+    assert stored["usage"] == USAGE
+
+
+def test_run_stage_reuses_a_matching_checkpoint(document_id):
+    writer = AnalysisWriter(
+        document_id=document_id,
+        stage_checkpoints={"summary": checkpoint("key", {"title": "stored"}, USAGE)},
+    )
+
+    def compute():
+        raise AssertionError("a valid checkpoint is not computed again")
+
+    assert writer.run_stage("summary", "key", compute) == ({"title": "stored"}, USAGE)
+
+
+def test_checkpoint_of_other_inputs_is_recomputed(document_id):
+    writer = AnalysisWriter(
+        document_id=document_id,
+        stage_checkpoints={"summary": checkpoint("old-key", {"title": "stale"})},
+    )
+
+    assert writer.completed("summary", "new-key") is None
+    assert writer.run_stage("summary", "new-key", lambda: ({"title": "fresh"}, USAGE)) == (
+        {"title": "fresh"},
+        USAGE,
+    )
+    assert writer.stage_checkpoints["summary"]["key"] == "old-key"
+
+
+def test_only_checkpoint_stages_are_written_before_the_flush(collection, document_id):
+    writer = AnalysisWriter(document_id=document_id, checkpoint_stages=["transcript"])
+
+    writer.stage("summary", {"summary": {"title": "t"}})
+    assert "summary" not in collection.find_one({"_id": document_id})
+
+    writer.stage("transcript", {"transcript": {"raw_transcript": "r"}})
+    stored = collection.find_one({"_id": document_id})
+    assert stored["transcript"] == {"raw_transcript": "r"}
+    # A checkpoint write carries the stages pending before it
+    assert stored["summary"] == {"title": "t"}
+
+
+def test_stage_key_changes_with_any_input():
+    assert stage_key("transcript", "prompt") == stage_key("transcript", "prompt")
+    assert stage_key("transcript", "prompt") != stage_key("transcript", "other prompt")
+
+
+class Upstreams:
+    """Stands in for Deepgram and Azure OpenAI, counting the calls the pipeline makes"""
+
+    def __init__(self, monkeypatch, ratings_error=None):
+        self.calls = []
+        self.ratings_error = ratings_error
+
+        monkeypatch.setattr(pipelines, "convert_url", self.refuse("download"))
+        monkeypatch.setattr(pipelines, "get_diarized_output", self.refuse("deepgram"))
+        monkeypatch.setattr(pipelines, "get_speaker_labels", self.labels)
+        monkeypatch.setattr(pipelines, "get_summary", self.summary)
+        monkeypatch.setattr(pipelines, "get_ratings", self.ratings)
+
+    def refuse(self, name):
+        def call(*args, **kwargs):
+            self.calls.append(name)
+            raise AssertionError(f"{name} is not called on a resumed transcription")
+
+        return call
+
+    def labels(self, *args):
+        self.calls.append("labels")
+        return {"speaker_0": "Salesperson", "speaker_1": "Customer"}, USAGE
+
+    def summary(self, *args):
+        self.calls.append("summary")
+        return {"title": "Site visit"}, USAGE
+
+    def ratings(self, *args):
+        self.calls.append("ratings")
+        if self.ratings_error is not None:
+            raise self.ratings_error
+        return {"meeting_request": 4}, USAGE
+
+
+@pytest.fixture
+def transcribed(collection, encoding):
+    """An analysis document whose earlier run failed after transcribing the call"""
+
+    transcription_key = stage_key("a.mp3", pipelines.DEEPGRAM_API_BASE)
+    document_id = collection.insert_one(
+        {
+            "mp3": "a.mp3",
+            "logs": {"status": "FAILED"},
+            "stage_checkpoints": {
+                "transcription": checkpoint(
+                    transcription_key,
+                    {"fingerprint": "f", "records": DIARIZATION.to_records()},
+                )
+            },
+        }
+    ).inserted_id
+
+    return document_id
+
+
+def audio():
+    return AudioRequest(
+        mp3_url="a.mp3", sales_lead_info=CallMetadata(lead_id=1, salesperson_name="Asha")
+    )
+
+
+def test_resume_skips_the_download_and_transcription(collection, transcribed, monkeypatch):
+    upstreams = Upstreams(monkeypatch)
+
+    response = pipelines.run_analysis(audio(), transcribed, resume=True)
+
+    assert "download" not in upstreams.calls
+    assert "deepgram" not in upstreams.calls
+    assert response.summary.title == "Site visit"
+    assert response.ratings.meeting_request == 4
+
+
+def test_without_resume_the_call_is_downloaded_again(collection, transcribed, monkeypatch):
+    upstreams = Upstreams(monkeypatch)
+
+    with pytest.raises(AssertionError):
+        pipelines.run_analysis(audio(), transcribed)
+
+    assert upstreams.calls == ["download"]
+
+
+def test_final_flush_writes_the_stages_that_are_not_checkpoints(
+    collection, transcribed, monkeypatch
+):
+    Upstreams(monkeypatch)
+
+    pipelines.run_analysis(audio(), transcribed, resume=True)
+
+    stored = collection.find_one({"_id": transcribed})
+    assert stored["logs"]["status"] == "SUCCESS"
+    assert stored["lease"] is None
+    assert stored["summary"]["title"] == "Site visit"
+    assert stored["analysis"]["meeting_request"] == 4
+    assert stored["gpt35_usage"]["total_tokens"] > 0
+    assert {"transcription", "summary", "ratings"} <= set(stored["stage_checkpoints"])
+
+
+def test_failed_run_keeps_its_finished_stages_for_the_resume(
+    collection, transcribed, monkeypatch
+):
+    rate_limited = HTTPException(
+        status_code=HttpStatusCode.INTERNAL_SERVER_ERROR.value, detail="Rate limited"
+    )
+    upstreams = Upstreams(monkeypatch, ratings_error=rate_limited)
+
+    with pytest.raises(HTTPException):
+        pipelines.run_analysis(audio(), transcribed, resume=True)
+
+    stored = collection.find_one({"_id": transcribed})
+    assert stored["logs"]["status"] == "FAILED"
+    assert "summary" in stored["stage_checkpoints"]
+
+    # The resumed run only pays for the stage that failed
+    upstreams = Upstreams(monkeypatch)
+    pipelines.run_analysis(audio(), transcribed, resume=True)
+
+    assert upstreams.calls == ["ratings"]
+    assert collection.find_one({"_id": transcribed})["logs"]["status"] == "SUCCESS"
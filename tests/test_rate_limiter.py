@@ -0,0 +1,156 @@
+import threading
+import time
+
+import pytest
+from starlette.exceptions import HTTPException
+
+from rate_limiter import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    DeploymentScheduler,
+    MemoryBucketStore,
+    scheduling_scope,
+)
+from resilience import Deadline
+
+
+def bucket(key, amount, capacity=100, rate=10):
+    return (key, amount, capacity, rate)
+
+
+def test_full_bucket_admits_right_away():
+    store = MemoryBucketStore()
+
+    assert store.try_acquire([bucket("tpm", 60)], now=0) == 0
+    assert store.buckets["tpm"] == (40, 0)
+
+
+def test_empty_bucket_returns_the_wait_until_refilled():
+    store = MemoryBucketStore()
+    store.try_acquire([bucket("tpm", 100)], now=0)
+
+    assert store.try_acquire([bucket("tpm", 30)], now=0) == pytest.approx(3)
+    # Refilled at 10 tokens per second
+    assert store.try_acquire([bucket("tpm", 30)], now=3) == 0
+
+
+def test_buckets_are_taken_all_or_nothing():
+    store = MemoryBucketStore()
+    store.try_acquire([bucket("tpm", 95)], now=0)
+
+    wait = store.try_acquire([bucket("rpm", 1), bucket("tpm", 10)], now=0)
+
+    assert wait == pytest.approx(0.5)
+    assert store.buckets["rpm"] == (100, 0)
+
+
+def test_request_larger_than_capacity_is_clamped():
+    store = MemoryBucketStore()
+
+    assert store.try_acquire([bucket("tpm", 500)], now=0) == 0
+    assert store.buckets["tpm"] == (0, 0)
+
+
+def test_adjust_refunds_an_overestimate():
+    store = MemoryBucketStore()
+    store.try_acquire([bucket("tpm", 80)], now=0)
+
+    store.adjust("tpm", 50)
+
+    assert store.try_acquire([bucket("tpm", 70)], now=0) == 0
+
+
+def scheduler(max_concurrency=1, rpm_limit=600, tpm_limit=60000):
+    return DeploymentScheduler(
+        "test", MemoryBucketStore(), rpm_limit, tpm_limit, max_concurrency
+    )
+
+
+def acquire_in_thread(scheduler, priority, tokens, admitted, tenant=None):
+    def run():
+        with scheduling_scope(priority, tenant):
+            scheduler.acquire(tokens)
+        admitted.append(priority)
+        scheduler.release()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    return thread
+
+
+def wait_for(condition, timeout=5):
+    started = time.monotonic()
+
+    while not condition():
+        assert time.monotonic() - started < timeout
+        time.sleep(0.01)
+
+
+def test_acquire_within_limits_admits_and_release_frees_the_slot():
+    deployment = scheduler(max_concurrency=2)
+
+    deployment.acquire(100)
+    deployment.acquire(100)
+    assert deployment.stats()["in_flight"] == 2
+
+    deployment.release()
+    deployment.release()
+    assert deployment.stats()["in_flight"] == 0
+
+
+def test_concurrency_limit_queues_until_a_release():
+    deployment = scheduler(max_concurrency=1)
+    admitted = []
+
+    deployment.acquire(100)
+    thread = acquire_in_thread(deployment, PRIORITY_INTERACTIVE, 100, admitted)
+    wait_for(lambda: deployment.stats()["queued"] == 1)
+    assert admitted == []
+
+    deployment.release()
+    thread.join(5)
+
+    assert admitted == [PRIORITY_INTERACTIVE]
+
+
+def test_higher_priority_is_admitted_first():
+    deployment = scheduler(max_concurrency=1)
+    admitted = []
+
+    deployment.acquire(100)
+    batch = acquire_in_thread(deployment, PRIORITY_BATCH, 100, admitted, "batch")
+    wait_for(lambda: deployment.stats()["queued"] == 1)
+    interactive = acquire_in_thread(
+        deployment, PRIORITY_INTERACTIVE, 100, admitted, "interactive"
+    )
+    wait_for(lambda: deployment.stats()["queued"] == 2)
+
+    deployment.release()
+    batch.join(5)
+    interactive.join(5)
+
+    assert admitted == [PRIORITY_INTERACTIVE, PRIORITY_BATCH]
+
+
+def test_rate_limit_halves_concurrency_and_success_grows_it_back():
+    deployment = scheduler(max_concurrency=8)
+
+    deployment.acquire(100)
+    deployment.release(rate_limited=True, retry_after=0.01)
+    assert deployment.stats()["concurrency_limit"] == 4
+
+    deployment.acquire(100)
+    deployment.release()
+    assert deployment.stats()["concurrency_limit"] == 4.25
+
+
+def test_expired_deadline_leaves_the_queue():
+    deployment = scheduler(max_concurrency=1)
+    deployment.acquire(100)
+
+    with pytest.raises(HTTPException) as error:
+        deployment.acquire(100, Deadline(0.05))
+
+    assert error.value.status_code == 504
+    assert deployment.stats()["queued"] == 0
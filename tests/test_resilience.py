@@ -0,0 +1,122 @@
+import pytest
+from starlette.exceptions import HTTPException
+
+import resilience
+from resilience import CircuitBreaker, Upstream
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+
+    return clock
+
+
+def breaker():
+    return CircuitBreaker("test", failure_threshold=3, reset_seconds=30)
+
+
+def test_opens_after_consecutive_failures(clock):
+    circuit = breaker()
+
+    for _ in range(2):
+        circuit.record_failure()
+        assert circuit.allow()
+
+    circuit.record_failure()
+
+    assert circuit.state == "open"
+    assert not circuit.allow()
+    assert circuit.stats()["rejected"] == 1
+
+
+def test_success_resets_the_failure_count(clock):
+    circuit = breaker()
+
+    circuit.record_failure()
+    circuit.record_failure()
+    circuit.record_success()
+    circuit.record_failure()
+
+    assert circuit.state == "closed"
+    assert circuit.stats()["consecutive_failures"] == 1
+
+
+def test_lets_a_single_probe_through_after_the_cool_down(clock):
+    circuit = breaker()
+    for _ in range(3):
+        circuit.record_failure()
+
+    clock.now += 31
+
+    assert circuit.allow()
+    assert circuit.state == "half_open"
+    # Other calls fail fast while the probe is out
+    assert not circuit.allow()
+
+
+def test_successful_probe_closes(clock):
+    circuit = breaker()
+    for _ in range(3):
+        circuit.record_failure()
+    clock.now += 31
+    circuit.allow()
+
+    circuit.record_success()
+
+    assert circuit.state == "closed"
+    assert circuit.allow()
+
+
+def test_failed_probe_opens_again(clock):
+    circuit = breaker()
+    for _ in range(3):
+        circuit.record_failure()
+    clock.now += 31
+    circuit.allow()
+
+    circuit.record_failure()
+
+    assert circuit.state == "open"
+    assert not circuit.allow()
+    clock.now += 31
+    assert circuit.allow()
+
+
+def test_before_call_fails_fast_with_503_when_open(clock):
+    circuit = breaker()
+    for _ in range(3):
+        circuit.record_failure()
+
+    with pytest.raises(HTTPException) as error:
+        circuit.before_call()
+
+    assert error.value.status_code == 503
+
+
+def test_upstream_only_counts_unhealthy_outcomes(clock):
+    upstream = Upstream("test")
+
+    def fail():
+        raise ValueError("bad request")
+
+    for _ in range(5):
+        with pytest.raises(ValueError):
+            upstream.call(fail, unhealthy=lambda result, error: False)
+
+    assert upstream.breaker.state == "closed"
+
+    for _ in range(resilience.CIRCUIT_FAILURE_THRESHOLD):
+        with pytest.raises(ValueError):
+            upstream.call(fail, unhealthy=lambda result, error: True)
+
+    assert upstream.breaker.state == "open"
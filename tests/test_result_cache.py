@@ -0,0 +1,155 @@
+import threading
+from datetime import datetime, timedelta
+
+import orjson
+import pytest
+
+import result_cache
+from models import DetailedAudioResponse
+from resilience import Deadline
+from result_cache import WORKER_ID, ResultCache, claim_lease, lease_active
+
+
+def lease(seconds, owner="other-worker"):
+    return {
+        "owner": owner,
+        "token": "token",
+        "expires_at": datetime.utcnow() + timedelta(seconds=seconds),
+    }
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    mongomock = pytest.importorskip("mongomock")
+    collection = mongomock.MongoClient().db.detailed_analysis
+    monkeypatch.setattr(result_cache, "collection", collection)
+
+    return collection
+
+
+def test_lease_active():
+    assert lease_active({"lease": lease(60)})
+    assert not lease_active({"lease": lease(-1)})
+    assert not lease_active({"lease": None})
+    assert not lease_active({})
+
+
+def test_claims_an_abandoned_analysis(collection):
+    collection.insert_one({"mp3": "a.mp3", "lease": lease(-1), "logs": {"status": "RUNNING"}})
+    document = collection.find_one({"mp3": "a.mp3"})
+
+    assert claim_lease(document, Deadline(60))
+
+    claimed = collection.find_one({"mp3": "a.mp3"})
+    assert claimed["lease"]["owner"] == WORKER_ID
+    assert lease_active(claimed)
+    assert "logs" not in claimed
+
+
+def test_only_one_worker_claims_the_same_lease(collection):
+    collection.insert_one({"mp3": "a.mp3", "lease": lease(-1)})
+    document = collection.find_one({"mp3": "a.mp3"})
+
+    assert claim_lease(document, Deadline(60))
+    # A second claim read the old lease, which no longer matches
+    assert not claim_lease(document, Deadline(60))
+
+
+def test_does_not_claim_a_finished_analysis(collection):
+    collection.insert_one({"mp3": "a.mp3", "lease": None, "logs": {"status": "SUCCESS"}})
+    document = collection.find_one({"mp3": "a.mp3"})
+
+    assert not claim_lease(document, Deadline(60))
+
+
+def run_concurrently(count, function):
+    barrier = threading.Barrier(count)
+    results = [None] * count
+    errors = [None] * count
+
+    def run(index):
+        barrier.wait()
+        try:
+            results[index] = function()
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    return results, errors
+
+
+def test_coalesces_concurrent_calls_onto_one_run():
+    cache = ResultCache(1024)
+    calls = []
+    release = threading.Event()
+
+    def analyze():
+        calls.append(1)
+        release.wait(5)
+        return "analysis", False
+
+    def request():
+        return cache.coalesce("a.mp3", analyze, Deadline(10))
+
+    timer = threading.Timer(0.2, release.set)
+    timer.start()
+    results, errors = run_concurrently(4, request)
+
+    assert len(calls) == 1
+    assert errors == [None] * 4
+    assert sorted(results) == [("analysis", False)] + [("analysis", True)] * 3
+    assert cache.stats()["flight"]["coalesced"] == 3
+    assert cache.stats()["in_flight"] == 0
+
+
+def test_followers_get_the_leaders_error():
+    cache = ResultCache(1024)
+    release = threading.Event()
+
+    def analyze():
+        release.wait(5)
+        raise RuntimeError("analysis failed")
+
+    timer = threading.Timer(0.2, release.set)
+    timer.start()
+    _, errors = run_concurrently(
+        3, lambda: cache.coalesce("a.mp3", analyze, Deadline(10))
+    )
+
+    assert all(isinstance(error, RuntimeError) for error in errors)
+    assert cache.stats()["in_flight"] == 0
+
+
+def test_different_keys_run_separately():
+    cache = ResultCache(1024)
+
+    assert cache.coalesce("a.mp3", lambda: ("a", False), Deadline(10)) == ("a", False)
+    assert cache.coalesce("b.mp3", lambda: ("b", False), Deadline(10)) == ("b", False)
+
+
+def test_evicts_least_recently_used_past_the_byte_cap():
+    response = DetailedAudioResponse(mp3="x" * 100)
+    size = len(orjson.dumps(response.dict()))
+
+    cache = ResultCache(2 * size + size // 2)
+    cache.set("a", response)
+    cache.set("b", response)
+    cache.get("a")
+    cache.set("c", response)
+
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.stats()["bytes"] <= cache.max_bytes
+
+
+def test_skips_a_response_larger_than_the_cap():
+    cache = ResultCache(10)
+
+    cache.set("a", DetailedAudioResponse(mp3="x" * 100))
+
+    assert cache.get("a") is None
+    assert cache.stats()["bytes"] == 0
@@ -0,0 +1,107 @@
+from token_budget import COUNT_CHUNK_LINES, count_tokens, chunk_transcript
+from utterances import Transcript, Utterance
+from benchmarks.deepgram import synthetic_response
+
+
+def call_text(lines: int) -> str:
+    return "\n".join(
+        f"[Speaker:{line % 2}] Yes sir, the site visit is on day {line}, budget 80 lakhs"
+        for line in range(lines)
+    )
+
+
+def test_count_tokens_without_limit_is_a_full_encode(encoding):
+    text = call_text(10)
+
+    assert count_tokens(text) == len(encoding.encode_ordinary(text))
+
+
+def test_count_tokens_under_limit_matches_full_encode(encoding):
+    text = call_text(5 * COUNT_CHUNK_LINES)
+    tokens = len(encoding.encode_ordinary(text))
+
+    # More bytes than the limit takes the line-chunked path, exact for single-spaced lines
+    assert len(text.encode()) > tokens + 1
+    assert count_tokens(text, limit=tokens + 1) == tokens
+    assert count_tokens(text, limit=tokens) == tokens
+
+
+def test_count_tokens_stops_once_limit_is_crossed(encoding):
+    text = call_text(20 * COUNT_CHUNK_LINES)
+    first_chunk = "".join(text.splitlines(keepends=True)[:COUNT_CHUNK_LINES])
+    limit = 10
+
+    count = count_tokens(text, limit=limit)
+
+    assert count > limit
+    # Only the first chunk of lines was encoded
+    assert count == len(encoding.encode_ordinary(first_chunk))
+    assert count < len(encoding.encode_ordinary(text))
+
+
+def test_count_tokens_in_chunks_is_off_by_at_most_a_token_per_chunk(encoding):
+    # Every chunk starts and ends on a blank line, a full encode merges the newlines across the boundary
+    body = [f"{line}\n" for line in call_text(COUNT_CHUNK_LINES - 2).splitlines()]
+    lines = (["\n"] + body + ["\n"]) * 5
+    text = "".join(lines)
+    tokens = len(encoding.encode_ordinary(text))
+    chunks = -(-len(lines) // COUNT_CHUNK_LINES)
+
+    assert len(text.encode()) > tokens + chunks
+    assert tokens <= count_tokens(text, limit=tokens + chunks) <= tokens + chunks - 1
+
+
+def utterance_tokens(encoding, utterance):
+    return len(encoding.encode_ordinary(f"[Speaker:{utterance.speaker}] {utterance.text}\n"))
+
+
+def turns(speakers):
+    """Transcript whose consecutive utterances of one speaker form a turn"""
+
+    return Transcript(
+        [Utterance(speaker, "sir the call is about the site visit") for speaker in speakers]
+    )
+
+
+def test_chunks_keep_every_utterance_in_order(encoding):
+    transcript = Transcript.from_deepgram(synthetic_response(120))
+
+    chunks = chunk_transcript(transcript, 600)
+
+    assert len(chunks) > 1
+    assert [u for chunk in chunks for u in chunk.utterances] == transcript.utterances
+
+
+def test_chunks_stay_within_budget(encoding):
+    transcript = Transcript.from_deepgram(synthetic_response(120))
+    budget = 600
+
+    for chunk in chunk_transcript(transcript, budget):
+        tokens = sum(utterance_tokens(encoding, u) for u in chunk.utterances)
+
+        # Only an utterance that alone exceeds the budget may overflow, in a chunk of its own
+        assert tokens <= budget or len(chunk) == 1
+
+
+def test_chunks_are_cut_between_speaker_turns(encoding):
+    transcript = turns([0, 0, 0, 1, 1, 1, 0, 0, 0, 1, 1, 1])
+    turn_tokens = sum(utterance_tokens(encoding, u) for u in transcript.utterances[:3])
+
+    chunks = chunk_transcript(transcript, turn_tokens + 1)
+
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3, 3]
+
+
+def test_turn_over_budget_is_cut_between_its_utterances(encoding):
+    transcript = turns([0, 0, 0, 0, 1])
+    utterance_budget = max(utterance_tokens(encoding, u) for u in transcript.utterances)
+
+    chunks = chunk_transcript(transcript, utterance_budget)
+
+    assert [len(chunk) for chunk in chunks] == [1, 1, 1, 1, 1]
+
+
+def test_empty_transcript_is_one_empty_chunk(encoding):
+    chunks = chunk_transcript(Transcript([]), 100)
+
+    assert [len(chunk) for chunk in chunks] == [0]
@@ -0,0 +1,54 @@
+import pytest
+
+from utterances import Transcript, Utterance
+from benchmarks.deepgram import CALL_LENGTHS, synthetic_response
+
+# The former jq filter is the reference the native extractor must reproduce
+pytest.importorskip("jq")
+
+from benchmarks.legacy import (  # noqa: E402
+    jq_format_utterances,
+    replace_speaker_labels,
+    strip_speaker_labels,
+)
+
+
+LABELS = {"speaker_0": "salesperson: ", "speaker_1": "customer: "}
+
+EDGE_CASES = [
+    {"results": {"utterances": []}},
+    {"results": {"utterances": [{"speaker": 3, "transcript": ""}]}},
+    {"results": {"utterances": [{"speaker": 0, "transcript": 'He said "hi"\tand\\left'}]}},
+    {"results": {"utterances": [{"speaker": 1, "transcript": "नमस्ते ठीक है"}]}},
+]
+
+RESPONSES = EDGE_CASES + [
+    synthetic_response(count, seed) for seed, count in enumerate(CALL_LENGTHS.values())
+]
+
+
+@pytest.mark.parametrize("response", RESPONSES)
+def test_render_matches_jq(response):
+    assert Transcript.from_deepgram(response).render() == jq_format_utterances(response)
+
+
+@pytest.mark.parametrize("response", RESPONSES)
+def test_labelled_render_matches_replace_chain(response):
+    transcript = Transcript.from_deepgram(response)
+    expected = replace_speaker_labels(jq_format_utterances(response), LABELS)
+
+    assert transcript.render({0: LABELS["speaker_0"], 1: LABELS["speaker_1"]}) == expected
+
+
+@pytest.mark.parametrize("response", RESPONSES)
+def test_stripped_render_matches_replace_chain(response):
+    transcript = Transcript.from_deepgram(response)
+    expected = strip_speaker_labels(jq_format_utterances(response))
+
+    assert transcript.render(strip_labels=True) == expected
+
+
+def test_records_round_trip():
+    transcript = Transcript([Utterance(0, "hello", 0.0, 1.5), Utterance(1, "hi", 1.5, 2.0)])
+
+    assert Transcript.from_records(transcript.to_records()).render() == transcript.render()
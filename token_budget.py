@@ -0,0 +1,286 @@
+import os
+import json
+import base64
+from functools import lru_cache
+
+from config import (
+    TIKTOKEN_MODEL_NAME,
+    TIKTOKEN_ENCODING_FILE,
+    MODEL_CONTEXT_WINDOWS,
+    EXPECTED_COMPLETION_TOKENS,
+    CHUNK_TOKEN_BUDGET,
+)
+from prompts import (
+    diarization_system_prompt,
+    summary_system_prompt,
+    ratings_system_prompt,
+    fused_system_prompt,
+)
+from utterances import Transcript, speaker_text
+from functions import (
+    LABEL_SPEAKERS,
+    SUMMARIZE_CALL,
+    EVALUATE_PARAMETERS,
+    ANALYZE_CALL,
+)
+from startup import lazy_import, timed, warm_up_hook
+from exceptions import MissingEncodingException
+
+
+tiktoken = lazy_import("tiktoken")
+
+
+# Chat formatting overhead: role/separator tokens per message and the reply primer
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# Number of transcript lines encoded at once when counting against a limit
+COUNT_CHUNK_LINES = 64
+
+# (system prompt, user message prefix, function schema) sent by every LLM stage
+STAGE_DEFINITIONS = {
+    "labels": (diarization_system_prompt, "", LABEL_SPEAKERS),
+    "summary": (summary_system_prompt, "Conversation: \n\n", SUMMARIZE_CALL),
+    "ratings": (ratings_system_prompt, "", EVALUATE_PARAMETERS),
+    "fused": (fused_system_prompt, "", ANALYZE_CALL),
+}
+
+STAGED_STAGES = ("labels", "summary", "ratings")
+
+
+# cl100k_base as tiktoken defines it, minus the ranks it would download
+CL100K_BASE_PATTERN = r"""(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+CL100K_BASE_SPECIAL_TOKENS = {
+    "<|endoftext|>": 100257,
+    "<|fim_prefix|>": 100258,
+    "<|fim_middle|>": 100259,
+    "<|fim_suffix|>": 100260,
+    "<|endofprompt|>": 100276,
+}
+
+
+def load_bundled_encoding(path: str):
+    """Build cl100k_base from a local copy of its BPE ranks, see encodings/fetch_cl100k_base.py"""
+
+    with open(path, "rb") as file:
+        mergeable_ranks = {
+            base64.b64decode(token): int(rank)
+            for token, rank in (line.split() for line in file if line.strip())
+        }
+
+    return tiktoken.Encoding(
+        name="cl100k_base",
+        pat_str=CL100K_BASE_PATTERN,
+        mergeable_ranks=mergeable_ranks,
+        special_tokens=CL100K_BASE_SPECIAL_TOKENS,
+    )
+
+
+def check_bundled_encoding():
+    """Fail the boot when the bundled ranks are missing, rather than the first request that counts tokens"""
+
+    if not os.path.exists(TIKTOKEN_ENCODING_FILE):
+        raise MissingEncodingException(
+            f"{TIKTOKEN_ENCODING_FILE} is missing, fetch it at build time with "
+            "`python encodings/fetch_cl100k_base.py` or point TIKTOKEN_ENCODING_FILE at a copy"
+        )
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = TIKTOKEN_MODEL_NAME):
+    """Get the process-wide tiktoken encoder for a model"""
+
+    with timed(f"tiktoken encoding {model}"):
+        if tiktoken.encoding_name_for_model(model) != "cl100k_base":
+            return tiktoken.encoding_for_model(model)
+
+        # Never fall back to tiktoken's own download, it stalls or fails the request that triggers it
+        check_bundled_encoding()
+
+        return load_bundled_encoding(TIKTOKEN_ENCODING_FILE)
+
+
+@warm_up_hook
+def load_encoding():
+    """Build the BPE ranks before the first token count needs them"""
+
+    get_encoding().encode_ordinary("warm up")
+
+
+def count_tokens(string: str, model: str = TIKTOKEN_MODEL_NAME, limit: int = None):
+    """Count the tokens of a string, stopping as soon as `limit` is crossed"""
+
+    encoding = get_encoding(model)
+
+    if limit is None or len(string.encode()) <= limit:
+        return len(encoding.encode_ordinary(string))
+
+    # Approximate: BPE never merges across chunks, so a run of blank lines split
+    # between two chunks counts a token more than a full encode would
+    lines = string.splitlines(keepends=True)
+    total = 0
+
+    for start in range(0, len(lines), COUNT_CHUNK_LINES):
+        chunk = "".join(lines[start : start + COUNT_CHUNK_LINES])
+        total += len(encoding.encode_ordinary(chunk))
+
+        if total > limit:
+            break
+
+    return total
+
+
+def count_tokens_batch(strings, model: str = TIKTOKEN_MODEL_NAME):
+    """Count the tokens of several strings in one batched encode"""
+
+    encoding = get_encoding(model)
+
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(list(strings))]
+
+
+@lru_cache(maxsize=None)
+def stage_overhead(stage: str, model: str = TIKTOKEN_MODEL_NAME):
+    """Fixed prompt-token cost of a stage, excluding the transcript itself"""
+
+    system_prompt, user_prefix, function = STAGE_DEFINITIONS[stage]
+
+    fixed_tokens = count_tokens_batch(
+        [system_prompt, user_prefix, json.dumps(function)], model
+    )
+
+    return sum(fixed_tokens) + 2 * TOKENS_PER_MESSAGE + TOKENS_PER_REPLY
+
+
+def stage_budget(stage: str, model: str = TIKTOKEN_MODEL_NAME):
+    """Tokens a stage needs besides the transcript, including its completion"""
+
+    return stage_overhead(stage, model) + EXPECTED_COMPLETION_TOKENS[stage]
+
+
+def estimate_request_tokens(
+    stage: str,
+    request: dict,
+    transcript_tokens: int = None,
+    model: str = TIKTOKEN_MODEL_NAME,
+):
+    """Tokens a chat completion request is expected to bill, prompt and completion
+
+    A request whose transcript was already counted is estimated from the stage's fixed
+    cost, the transcript is never encoded again; others, like the small summary reduce,
+    are encoded as sent.
+    """
+
+    if transcript_tokens is not None and stage in STAGE_DEFINITIONS:
+        return stage_budget(stage, model) + transcript_tokens
+
+    messages = request.get("messages", [])
+    prompt_tokens = sum(
+        count_tokens_batch(
+            [message["content"] for message in messages]
+            + [json.dumps(function) for function in request.get("functions", [])],
+            model,
+        )
+    )
+
+    return (
+        prompt_tokens
+        + TOKENS_PER_MESSAGE * len(messages)
+        + TOKENS_PER_REPLY
+        + EXPECTED_COMPLETION_TOKENS.get(stage, max(EXPECTED_COMPLETION_TOKENS.values()))
+    )
+
+
+def select_model_config(
+    transcript: str, model: str = TIKTOKEN_MODEL_NAME, stages=STAGED_STAGES
+):
+    """Pick the smallest model context that fits every given stage for this transcript
+
+    Returns the model config, the tokens the largest stage needs and the transcript's own tokens.
+    """
+
+    windows = sorted(MODEL_CONTEXT_WINDOWS.items(), key=lambda item: item[1])
+    largest_config, largest_window = windows[-1]
+
+    fixed_tokens = max(stage_budget(stage, model) for stage in stages)
+    transcript_tokens = count_tokens(
+        transcript, model, limit=largest_window - fixed_tokens
+    )
+    required_tokens = fixed_tokens + transcript_tokens
+
+    for model_config, window in windows:
+        if required_tokens <= window:
+            return model_config, required_tokens, transcript_tokens
+
+    return largest_config, required_tokens, transcript_tokens
+
+
+def stage_fits(
+    stage: str, transcript_tokens: int, model_config: str, model: str = TIKTOKEN_MODEL_NAME
+):
+    """Whether a stage's request for a transcript of `transcript_tokens` fits the model config's context"""
+
+    return (
+        stage_budget(stage, model) + transcript_tokens
+        <= MODEL_CONTEXT_WINDOWS[model_config]
+    )
+
+
+def chunk_token_budget(model: str = TIKTOKEN_MODEL_NAME):
+    """Transcript tokens per chunk that leave room for the chunk stages in the largest context"""
+
+    largest_window = max(MODEL_CONTEXT_WINDOWS.values())
+    fixed_tokens = max(stage_budget(stage, model) for stage in ("summary", "ratings"))
+
+    return min(CHUNK_TOKEN_BUDGET, largest_window - fixed_tokens)
+
+
+def chunk_transcript(
+    transcript: Transcript, token_budget: int, model: str = TIKTOKEN_MODEL_NAME
+):
+    """Split a transcript on speaker turns into chunks of at most `token_budget` tokens"""
+
+    utterances = transcript.utterances
+    utterance_tokens = count_tokens_batch(
+        [
+            f"[Speaker:{speaker_text(utterance.speaker)}] {utterance.text}\n"
+            for utterance in utterances
+        ],
+        model,
+    )
+
+    # Consecutive utterances of one speaker form a turn, the unit chunks are cut on
+    turns = []
+    for index, utterance in enumerate(utterances):
+        if turns and utterances[turns[-1][0]].speaker == utterance.speaker:
+            turns[-1][1] = index + 1
+            turns[-1][2] += utterance_tokens[index]
+        else:
+            turns.append([index, index + 1, utterance_tokens[index]])
+
+    # A turn that alone exceeds the budget can only be cut between its utterances
+    units = []
+    for start, end, tokens in turns:
+        if tokens > token_budget:
+            units.extend(
+                (index, index + 1, utterance_tokens[index])
+                for index in range(start, end)
+            )
+        else:
+            units.append((start, end, tokens))
+
+    chunks = []
+    chunk_start = 0
+    chunk_tokens = 0
+
+    for start, end, tokens in units:
+        if chunk_tokens and chunk_tokens + tokens > token_budget:
+            chunks.append(Transcript(utterances[chunk_start:start]))
+            chunk_start = start
+            chunk_tokens = 0
+
+        chunk_tokens += tokens
+
+    if chunk_start < len(utterances) or not chunks:
+        chunks.append(Transcript(utterances[chunk_start:]))
+
+    return chunks
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+from config import (
+    TRANSCRIPT_CACHE_BACKENDS,
+    TRANSCRIPT_CACHE_DIR,
+    TRANSCRIPT_CACHE_MAX_BYTES,
+    TRANSCRIPT_CACHE_TTL_SECONDS,
+)
+from mongodb import db
+from utterances import Transcript
+from metrics import CACHE_REQUESTS
+
+
+# Bumped whenever the cached transcript representation changes
+TRANSCRIPT_CACHE_FORMAT = 2
+
+
+def transcript_cache_key(fingerprint: str, deepgram_api_base: str) -> str:
+    """Cache key of a transcript: the audio fingerprint plus the Deepgram request options"""
+
+    url = urlsplit(deepgram_api_base or "")
+    options = urlencode(sorted(parse_qsl(url.query)))
+    request = "|".join(
+        [str(TRANSCRIPT_CACHE_FORMAT), fingerprint, url.netloc + url.path, options]
+    )
+
+    return hashlib.sha256(request.encode()).hexdigest()
+
+
+class DiskTranscriptCache:
+    """Transcripts stored as files, evicted by age and then least recently used past the size limit"""
+
+    name = "disk"
+
+    def __init__(self, directory, max_bytes, ttl_seconds):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        path = self.path(key)
+
+        try:
+            with open(path) as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry["created_at"] > self.ttl_seconds:
+            self.remove(path)
+            return None
+
+        # The modification time doubles as the last access time for eviction
+        os.utime(path)
+
+        return entry["transcript"]
+
+    def set(self, key, transcript):
+        path = self.path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+
+        with open(temp_path, "w") as file:
+            json.dump({"created_at": time.time(), "transcript": transcript}, file)
+
+        os.replace(temp_path, path)
+        self.evict()
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            now = time.time()
+
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith(".json"):
+                    continue
+
+                stat = entry.stat()
+
+                if now - stat.st_mtime > self.ttl_seconds:
+                    self.remove(entry.path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total_bytes = sum(size for _, size, _ in entries)
+
+            for _, size, path in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+
+                self.remove(path)
+                total_bytes -= size
+
+
+class MongoTranscriptCache:
+    """Transcripts shared by every worker in a Mongo collection, expired by a TTL index"""
+
+    name = "mongo"
+
+    def __init__(self, collection, ttl_seconds):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+
+    def ensure_indexes(self):
+        self.collection.create_index(
+            "created_at", expireAfterSeconds=self.ttl_seconds
+        )
+
+    def get(self, key):
+        entry = self.collection.find_one(
+            {
+                "_id": key,
+                "created_at": {
+                    "$gt": datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+                },
+            },
+            {"transcript": 1},
+        )
+
+        return entry["transcript"] if entry else None
+
+    def set(self, key, transcript):
+        self.collection.update_one(
+            {"_id": key},
+            {"$set": {"transcript": transcript, "created_at": datetime.utcnow()}},
+            upsert=True,
+        )
+
+
+class TranscriptCache:
+    """Tiered Deepgram transcript cache, checked fastest tier first, with hit/miss counters"""
+
+    def __init__(self, tiers):
+        self.tiers = tiers
+        self.lock = threading.Lock()
+        self.counters = {
+            tier.name: {"hits": 0, "misses": 0, "errors": 0} for tier in tiers
+        }
+
+    @property
+    def enabled(self):
+        return bool(self.tiers)
+
+    def count(self, tier, counter):
+        CACHE_REQUESTS.inc(cache="transcript", scope=tier.name, result=counter)
+
+        with self.lock:
+            self.counters[tier.name][counter] += 1
+
+    def get(self, fingerprint: str, deepgram_api_base: str) -> Transcript:
+        key = transcript_cache_key(fingerprint, deepgram_api_base)
+
+        for position, tier in enumerate(self.tiers):
+            try:
+                records = tier.get(key)
+            except Exception:
+                self.count(tier, "errors")
+                continue
+
+            if records is None:
+                self.count(tier, "misses")
+                continue
+
+            self.count(tier, "hits")
+
+            # Backfill the faster tiers that missed
+            for faster_tier in self.tiers[:position]:
+                self.set_tier(faster_tier, key, records)
+
+            return Transcript.from_records(records)
+
+        return None
+
+    def set(self, fingerprint: str, deepgram_api_base: str, transcript: Transcript):
+        key = transcript_cache_key(fingerprint, deepgram_api_base)
+        records = transcript.to_records()
+
+        for tier in self.tiers:
+            self.set_tier(tier, key, records)
+
+    def set_tier(self, tier, key, transcript):
+        # A cache write failure must never fail the analysis
+        try:
+            tier.set(key, transcript)
+        except Exception:
+            self.count(tier, "errors")
+
+    def ensure_indexes(self):
+        for tier in self.tiers:
+            if hasattr(tier, "ensure_indexes"):
+                tier.ensure_indexes()
+
+    def stats(self):
+        with self.lock:
+            return {name: dict(counters) for name, counters in self.counters.items()}
+
+
+def build_transcript_cache():
+    tiers = []
+
+    if "disk" in TRANSCRIPT_CACHE_BACKENDS:
+        tiers.append(
+            DiskTranscriptCache(
+                TRANSCRIPT_CACHE_DIR,
+                TRANSCRIPT_CACHE_MAX_BYTES,
+                TRANSCRIPT_CACHE_TTL_SECONDS,
+            )
+        )
+
+    if "mongo" in TRANSCRIPT_CACHE_BACKENDS:
+        tiers.append(
+            MongoTranscriptCache(db["transcript_cache"], TRANSCRIPT_CACHE_TTL_SECONDS)
+        )
+
+    return TranscriptCache(tiers)
+
+
+transcript_cache = build_transcript_cache()
@@ -0,0 +1,97 @@
+import json
+
+
+def speaker_text(speaker) -> str:
+    """Render a speaker id the way the former jq filter interpolated it"""
+
+    if type(speaker) is int:
+        return str(speaker)
+
+    return speaker if isinstance(speaker, str) else json.dumps(speaker)
+
+
+class Utterance:
+    """One diarized utterance: who spoke, what was said and when"""
+
+    __slots__ = ("speaker", "text", "start", "end")
+
+    def __init__(self, speaker, text: str, start: float = None, end: float = None):
+        self.speaker = speaker
+        self.text = text
+        self.start = start
+        self.end = end
+
+
+class Transcript:
+    """Diarized utterances, built once from Deepgram and rendered to text only where a string is needed"""
+
+    __slots__ = ("utterances",)
+
+    def __init__(self, utterances):
+        self.utterances = utterances
+
+    @classmethod
+    def from_deepgram(cls, response_json: dict) -> "Transcript":
+        return cls(
+            [
+                Utterance(
+                    utterance["speaker"],
+                    utterance["transcript"],
+                    utterance.get("start"),
+                    utterance.get("end"),
+                )
+                for utterance in response_json["results"]["utterances"]
+            ]
+        )
+
+    @classmethod
+    def from_records(cls, records) -> "Transcript":
+        return cls([Utterance(*record) for record in records])
+
+    def to_records(self):
+        """Compact list form used by the transcript cache"""
+
+        return [
+            [utterance.speaker, utterance.text, utterance.start, utterance.end]
+            for utterance in self.utterances
+        ]
+
+    def __len__(self):
+        return len(self.utterances)
+
+    def head(self, count: int) -> "Transcript":
+        """The first `count` utterances, or all of them when `count` is not positive"""
+
+        if count <= 0:
+            return self
+
+        return Transcript(self.utterances[:count])
+
+    def speakers(self) -> set:
+        return {utterance.speaker for utterance in self.utterances}
+
+    def render(self, labels: dict = None, strip_labels: bool = False) -> str:
+        """Render `[Speaker:N] text` lines, replacing speaker tags by `labels` or dropping them"""
+
+        if strip_labels:
+            return "\n".join(f" {utterance.text}" for utterance in self.utterances)
+
+        labels = labels or {}
+        tags = {}
+        lines = []
+
+        for utterance in self.utterances:
+            tag = tags.get(utterance.speaker)
+
+            if tag is None:
+                tag = labels.get(utterance.speaker)
+
+                if tag is None:
+                    tag = f"[Speaker:{speaker_text(utterance.speaker)}]"
+
+                tags[utterance.speaker] = tag
+
+            lines.append(f"{tag} {utterance.text}")
+
+        return "\n".join(lines)
+